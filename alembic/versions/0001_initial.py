@@ -0,0 +1,51 @@
+"""initial schema
+
+Revision ID: 0001
+Revises: 
+Create Date: 2024-09-02 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'backup_jobs',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('dest_folder', sa.String(), nullable=False),
+        sa.Column('schedule_time', sa.String(), nullable=False),
+        sa.Column('days', sa.String(), nullable=False),
+        sa.Column('send_email', sa.Boolean(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('last_run_date', sa.DateTime(), nullable=True),
+        sa.Column('run_count', sa.Integer(), nullable=True),
+    )
+    op.create_table(
+        'paths',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('path', sa.String(), nullable=False),
+        sa.Column('backup_job_id', sa.Integer(), sa.ForeignKey('backup_jobs.id'), nullable=True),
+    )
+    op.create_table(
+        'email_addresses',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('email', sa.String(), nullable=False),
+        sa.Column('backup_job_id', sa.Integer(), sa.ForeignKey('backup_jobs.id'), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('email_addresses')
+    op.drop_table('paths')
+    op.drop_table('backup_jobs')
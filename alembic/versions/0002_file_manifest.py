@@ -0,0 +1,40 @@
+"""file manifest
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # La tabella puo' essere gia' stata creata da create_all()
+    if sa.inspect(op.get_bind()).has_table('file_manifest'):
+        return
+    op.create_table(
+        'file_manifest',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('backup_job_id', sa.Integer(), sa.ForeignKey('backup_jobs.id'), nullable=False),
+        sa.Column('path', sa.String(), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('mtime_ns', sa.BigInteger(), nullable=False),
+        sa.Column('inode', sa.BigInteger(), nullable=True),
+        sa.Column('hash', sa.String(), nullable=True),
+    )
+    op.create_index('ix_file_manifest_backup_job_id', 'file_manifest', ['backup_job_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_file_manifest_backup_job_id', table_name='file_manifest')
+    op.drop_table('file_manifest')
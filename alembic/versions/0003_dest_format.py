@@ -0,0 +1,28 @@
+"""backup job destination format
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('backup_jobs') as batch_op:
+        batch_op.add_column(sa.Column('dest_format', sa.String(), nullable=False, server_default='mirror'))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('backup_jobs') as batch_op:
+        batch_op.drop_column('dest_format')
@@ -0,0 +1,37 @@
+"""hardlink snapshots
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'backup_snapshots',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('backup_job_id', sa.Integer(), sa.ForeignKey('backup_jobs.id'), nullable=False),
+        sa.Column('path', sa.String(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('files_copied', sa.Integer(), nullable=True),
+        sa.Column('files_linked', sa.Integer(), nullable=True),
+        sa.Column('bytes_copied', sa.BigInteger(), nullable=True),
+    )
+    op.create_index('ix_backup_snapshots_backup_job_id', 'backup_snapshots', ['backup_job_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_backup_snapshots_backup_job_id', table_name='backup_snapshots')
+    op.drop_table('backup_snapshots')
@@ -0,0 +1,43 @@
+"""run history
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'backup_runs',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('backup_job_id', sa.Integer(), sa.ForeignKey('backup_jobs.id'), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=False),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.Column('success', sa.Boolean(), nullable=True),
+        sa.Column('files_scanned', sa.Integer(), nullable=True),
+        sa.Column('files_copied', sa.Integer(), nullable=True),
+        sa.Column('files_skipped', sa.Integer(), nullable=True),
+        sa.Column('bytes_copied', sa.BigInteger(), nullable=True),
+        sa.Column('error_count', sa.Integer(), nullable=True),
+        sa.Column('scan_seconds', sa.Float(), nullable=True),
+        sa.Column('copy_seconds', sa.Float(), nullable=True),
+        sa.Column('verify_seconds', sa.Float(), nullable=True),
+    )
+    op.create_index('ix_backup_runs_backup_job_id', 'backup_runs', ['backup_job_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_backup_runs_backup_job_id', table_name='backup_runs')
+    op.drop_table('backup_runs')
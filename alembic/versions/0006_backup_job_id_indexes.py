@@ -0,0 +1,33 @@
+"""indexes on backup_job_id foreign keys
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006'
+down_revision: Union[str, None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_paths_backup_job_id', 'paths', ['backup_job_id'])
+    op.create_index('ix_email_addresses_backup_job_id', 'email_addresses', ['backup_job_id'])
+    # Lo storico si legge per job in ordine di data: l'indice composto
+    # sostituisce quello sul solo backup_job_id
+    op.create_index('ix_backup_runs_backup_job_id_started_at', 'backup_runs', ['backup_job_id', 'started_at'])
+    op.drop_index('ix_backup_runs_backup_job_id', table_name='backup_runs')
+
+
+def downgrade() -> None:
+    op.create_index('ix_backup_runs_backup_job_id', 'backup_runs', ['backup_job_id'])
+    op.drop_index('ix_backup_runs_backup_job_id_started_at', table_name='backup_runs')
+    op.drop_index('ix_email_addresses_backup_job_id', table_name='email_addresses')
+    op.drop_index('ix_paths_backup_job_id', table_name='paths')
@@ -0,0 +1,34 @@
+"""per-job include/exclude filter rules
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007'
+down_revision: Union[str, None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'filter_rules',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('pattern', sa.String(), nullable=False),
+        sa.Column('position', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('backup_job_id', sa.Integer(), sa.ForeignKey('backup_jobs.id'), nullable=True),
+    )
+    op.create_index('ix_filter_rules_backup_job_id', 'filter_rules', ['backup_job_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_filter_rules_backup_job_id', table_name='filter_rules')
+    op.drop_table('filter_rules')
@@ -0,0 +1,42 @@
+"""post-copy verification results
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0008'
+down_revision: Union[str, None] = '0007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('backup_runs') as batch_op:
+        batch_op.add_column(sa.Column('files_verified', sa.Integer(), nullable=True))
+    op.create_table(
+        'verify_failures',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('backup_job_id', sa.Integer(), sa.ForeignKey('backup_jobs.id'), nullable=False),
+        sa.Column('run_id', sa.Integer(), sa.ForeignKey('backup_runs.id'), nullable=True),
+        sa.Column('path', sa.String(), nullable=False),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('expected_hash', sa.String(), nullable=True),
+        sa.Column('actual_hash', sa.String(), nullable=True),
+        sa.Column('detected_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_verify_failures_backup_job_id', 'verify_failures', ['backup_job_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_verify_failures_backup_job_id', table_name='verify_failures')
+    op.drop_table('verify_failures')
+    with op.batch_alter_table('backup_runs') as batch_op:
+        batch_op.drop_column('files_verified')
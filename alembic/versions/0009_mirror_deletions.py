@@ -0,0 +1,29 @@
+"""optional deletion propagation for mirror jobs
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0009'
+down_revision: Union[str, None] = '0008'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('backup_jobs') as batch_op:
+        batch_op.add_column(sa.Column('mirror_deletions', sa.Boolean(), nullable=False,
+                                      server_default=sa.text('0')))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('backup_jobs') as batch_op:
+        batch_op.drop_column('mirror_deletions')
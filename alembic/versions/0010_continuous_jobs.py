@@ -0,0 +1,29 @@
+"""continuous (inotify) backup mode
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0010'
+down_revision: Union[str, None] = '0009'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('backup_jobs') as batch_op:
+        batch_op.add_column(sa.Column('continuous', sa.Boolean(), nullable=False,
+                                      server_default=sa.text('0')))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('backup_jobs') as batch_op:
+        batch_op.drop_column('continuous')
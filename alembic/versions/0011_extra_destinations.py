@@ -0,0 +1,35 @@
+"""additional destinations per backup job
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0011'
+down_revision: Union[str, None] = '0010'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'destinations',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('folder', sa.String(), nullable=False),
+        sa.Column('backup_job_id', sa.Integer(), sa.ForeignKey('backup_jobs.id'), nullable=True),
+        sa.Column('last_success_at', sa.DateTime(), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+    )
+    op.create_index('ix_destinations_backup_job_id', 'destinations', ['backup_job_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_destinations_backup_job_id', table_name='destinations')
+    op.drop_table('destinations')
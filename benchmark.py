@@ -0,0 +1,304 @@
+"""Benchmark del motore di backup su alberi sintetici riproducibili.
+
+    python benchmark.py
+    python benchmark.py --scenario tiny --scenario rerun --format store --output risultati.json
+
+Ogni scenario genera una sorgente con una forma precisa (tanti file
+piccoli, cartelle profonde, pochi file enormi, file sparsi, riesecuzione
+con poche modifiche), poi esegue BackupEngine senza GUI ne' database in un
+processo separato, cosi' memoria e contatori di I/O riguardano solo quel
+backup. Il risultato e' un JSON con file/s, MB/s, chiamate di sistema di
+lettura e scrittura, picco di memoria e durata delle fasi, da confrontare
+tra versioni diverse. La cartella di lavoro va messa sul disco da misurare.
+"""
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+MB = 1024 * 1024
+BLOCK = MB
+
+
+class Workload:
+    """Genera file con contenuto deterministico: meta' testo, meta' dati casuali."""
+
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        text = b''.join(b'%08d lorem ipsum dolor sit amet, consectetur adipiscing elit\n' % i
+                        for i in range(BLOCK // 64))[:BLOCK]
+        self.blocks = (text, self.rng.randbytes(BLOCK))
+
+    def data(self, size):
+        # Fette di blocchi gia' pronti: generare i byte costerebbe piu' che scriverli
+        block = self.blocks[self.rng.randrange(2)]
+        start = self.rng.randrange(BLOCK)
+        return (block[start:] + block[:start])[:size]
+
+    def write_file(self, path, size):
+        with open(path, 'wb') as f:
+            while size > 0:
+                data = self.data(min(size, BLOCK))
+                f.write(data)
+                size -= len(data)
+
+    def write_sparse(self, path, size, data_size):
+        # Estensioni di dati sparse nel file, il resto sono buchi
+        extents = max(1, data_size // BLOCK)
+        with open(path, 'wb') as f:
+            f.truncate(size)
+            for i in range(extents):
+                f.seek(size * i // extents)
+                f.write(self.data(min(BLOCK, data_size)))
+
+
+def make_tiny(root, workload, scale):
+    for i in range(int(20000 * scale)):
+        folder = os.path.join(root, f'dir{i % 100:03d}')
+        os.makedirs(folder, exist_ok=True)
+        workload.write_file(os.path.join(folder, f'file{i:06d}.txt'), workload.rng.randrange(4096))
+
+
+def make_deep(root, workload, scale):
+    for branch in range(int(50 * scale) or 1):
+        folder = os.path.join(root, f'branch{branch:03d}')
+        for depth in range(40):
+            folder = os.path.join(folder, f'level{depth:02d}')
+            os.makedirs(folder, exist_ok=True)
+            workload.write_file(os.path.join(folder, 'data.bin'), workload.rng.randrange(1, 16384))
+
+
+def make_huge(root, workload, scale):
+    for i in range(3):
+        workload.write_file(os.path.join(root, f'huge{i}.img'), int(256 * MB * scale))
+
+
+def make_sparse(root, workload, scale):
+    for i in range(4):
+        workload.write_sparse(os.path.join(root, f'disk{i}.raw'), int(512 * MB * scale), int(8 * MB * scale))
+
+
+def make_rerun(root, workload, scale):
+    for i in range(int(5000 * scale)):
+        folder = os.path.join(root, f'project{i % 50:02d}')
+        os.makedirs(folder, exist_ok=True)
+        workload.write_file(os.path.join(folder, f'doc{i:05d}.dat'), workload.rng.randrange(1024, 65536))
+
+
+def touch_rerun(root, workload, fraction=0.01):
+    """Modifica una piccola parte dei file e ne aggiunge qualcuno, come tra due backup giornalieri."""
+    paths = sorted(os.path.join(folder, name) for folder, _, names in os.walk(root) for name in names)
+    for path in workload.rng.sample(paths, max(1, int(len(paths) * fraction))):
+        workload.write_file(path, workload.rng.randrange(1024, 65536))
+    for i in range(max(1, int(len(paths) * fraction))):
+        workload.write_file(os.path.join(root, f'new{i:05d}.dat'), workload.rng.randrange(1024, 65536))
+
+
+# nome -> (generatore, descrizione)
+SCENARIOS = {
+    'tiny': (make_tiny, 'molti file piccoli (0-4 KB)'),
+    'deep': (make_deep, 'cartelle annidate su 40 livelli'),
+    'huge': (make_huge, 'pochi file enormi'),
+    'sparse': (make_sparse, 'file sparsi con pochi dati'),
+    'rerun': (make_rerun, 'seconda esecuzione con l\'1% dei file modificato'),
+}
+
+
+def _proc_io():
+    # Contatori del kernel per il processo: syscr/syscw contano le chiamate
+    # di lettura e scrittura, read_bytes/write_bytes l'I/O arrivato al disco
+    try:
+        with open('/proc/self/io') as f:
+            return {key: int(value) for key, value in (line.split(': ') for line in f)}
+    except OSError:
+        return None
+
+
+def _reset_peak_rss():
+    # Da Linux 4.0 scrivere 5 in clear_refs azzera il picco (VmHWM)
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_kb(reset_done):
+    if reset_done:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _run_engine(source, dest_format, dest_folder, workers, manifest=None):
+    from engine.backup import BackupEngine, create_destination
+
+    engine = BackupEngine([source], create_destination(dest_format, dest_folder), manifest=manifest,
+                          workers=workers)
+    if not engine.run():
+        raise RuntimeError(f"Backup failed: {engine.errors}")
+    return engine
+
+
+def run_scenario(name, dest_format, workdir, workers):
+    """Eseguita in un processo nuovo: misura un solo backup dello scenario."""
+    # Il motore va importato prima delle misure: l'import non fa parte del backup
+    importlib.import_module('engine.backup')
+
+    source = os.path.join(workdir, name, 'src')
+    dest_folder = os.path.join(workdir, name, f'dst-{dest_format}')
+    shutil.rmtree(dest_folder, ignore_errors=True)
+    manifest = None
+    if name == 'rerun':
+        # Il primo backup prepara la destinazione e il manifest e non viene misurato
+        manifest = _run_engine(source, dest_format, dest_folder, workers).new_manifest
+        touch_rerun(source, Workload(1))
+
+    reset_done = _reset_peak_rss()
+    io_before = _proc_io()
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.perf_counter()
+    engine = _run_engine(source, dest_format, dest_folder, workers, manifest)
+    seconds = time.perf_counter() - started
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    io_after = _proc_io()
+
+    stats = engine.stats.as_dict()
+    files = stats['files_copied'] + stats['files_linked'] + stats['files_skipped']
+    result = {
+        'scenario': name,
+        'format': dest_format,
+        'workers': workers,
+        'seconds': round(seconds, 4),
+        'files_scanned': stats['files_scanned'],
+        'files_copied': stats['files_copied'],
+        'files_skipped': stats['files_skipped'],
+        'bytes_copied': stats['bytes_copied'],
+        'bytes_apparent': stats['bytes_apparent'],
+        'bytes_allocated': stats['bytes_allocated'],
+        'files_per_second': round(files / seconds, 1) if seconds else None,
+        'mb_per_second': round(stats['bytes_copied'] / MB / seconds, 2) if seconds else None,
+        'peak_rss_kb': _peak_rss_kb(reset_done),
+        'cpu_user_seconds': round(usage.ru_utime - usage_before.ru_utime, 4),
+        'cpu_system_seconds': round(usage.ru_stime - usage_before.ru_stime, 4),
+        'context_switches': (usage.ru_nvcsw - usage_before.ru_nvcsw) + (usage.ru_nivcsw - usage_before.ru_nivcsw),
+        'phase_seconds': {phase: round(value, 4) for phase, value in stats['phase_seconds'].items()},
+        'copy_methods': stats['copy_methods'],
+        'latency': engine.trace.latency_summary(),
+    }
+    if io_before and io_after:
+        result['syscalls'] = {'read': io_after['syscr'] - io_before['syscr'],
+                              'write': io_after['syscw'] - io_before['syscw']}
+        result['io_bytes'] = {key: io_after[key] - io_before[key]
+                              for key in ('rchar', 'wchar', 'read_bytes', 'write_bytes')}
+    return result
+
+
+def _child(conn, *args):
+    try:
+        conn.send(('ok', run_scenario(*args)))
+    except Exception as e:
+        conn.send(('error', f'{type(e).__name__}: {e}'))
+    finally:
+        conn.close()
+
+
+def _measure(context, *args):
+    parent, child = context.Pipe(duplex=False)
+    process = context.Process(target=_child, args=(child,) + args)
+    process.start()
+    child.close()
+    status, value = parent.recv()
+    process.join()
+    if status != 'ok':
+        raise RuntimeError(value)
+    return value
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark del motore di backup')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='scenario da eseguire, ripetibile (predefinito: tutti)')
+    parser.add_argument('--format', action='append', dest='formats',
+                        choices=('mirror', 'store', 'snapshot', 'archive'),
+                        help='formato di destinazione, ripetibile (predefinito: mirror)')
+    parser.add_argument('--workers', type=int, default=4, help='copie parallele')
+    parser.add_argument('--scale', type=float, default=1.0, help='moltiplica numero e dimensione dei file')
+    parser.add_argument('--repeat', type=int, default=1, help='esecuzioni misurate per scenario')
+    parser.add_argument('--workdir', help='cartella per sorgenti e destinazioni (predefinita: temporanea)')
+    parser.add_argument('--keep', action='store_true', help='non cancella la cartella di lavoro')
+    parser.add_argument('--output', help='file JSON dei risultati (predefinito: stdout)')
+    args = parser.parse_args(argv)
+
+    scenarios = args.scenario or list(SCENARIOS)
+    formats = args.formats or ['mirror']
+    workdir = args.workdir or tempfile.mkdtemp(prefix='pythonbackup-bench-')
+    # spawn: ogni misura parte da un processo pulito
+    context = multiprocessing.get_context('spawn')
+    results = []
+    try:
+        for name in scenarios:
+            generate, description = SCENARIOS[name]
+            source = os.path.join(workdir, name, 'src')
+            shutil.rmtree(source, ignore_errors=True)
+            os.makedirs(source)
+            print(f"Generating {name}: {description}", file=sys.stderr)
+            generate(source, Workload(0), args.scale)
+            measured = False
+            for dest_format in formats:
+                for run in range(args.repeat):
+                    if name == 'rerun' and measured:
+                        # La misura modifica la sorgente: si riparte da quella originale
+                        shutil.rmtree(source)
+                        os.makedirs(source)
+                        generate(source, Workload(0), args.scale)
+                    measured = True
+                    result = _measure(context, name, dest_format, workdir, args.workers)
+                    result['run'] = run
+                    print(f"  {dest_format}: {result['seconds']} s, {result['files_per_second']} file/s, "
+                          f"{result['mb_per_second']} MB/s", file=sys.stderr)
+                    results.append(result)
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'revision': _git_revision(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'scale': args.scale,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
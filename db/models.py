@@ -1,8 +1,9 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, Boolean, DateTime, ForeignKey
-from sqlalchemy.orm import relationship, sessionmaker, declarative_base
+from sqlalchemy import create_engine, event, inspect, text, Column, Integer, BigInteger, Float, String, Text, Boolean, DateTime, ForeignKey, Index
+from sqlalchemy.orm import relationship, sessionmaker, declarative_base, selectinload
 
 from datetime import datetime
 import logging
+import os
 
 
 # Imposta il livello di log a WARNING
@@ -10,24 +11,77 @@ logging.basicConfig()
 logging.getLogger('sqlalchemy.engine').setLevel(logging.WARNING)
 # Definizione della base e dell'engine del database
 DATABASE_URL = "sqlite:///backup_manager.db"
-engine = create_engine(DATABASE_URL, echo=True)
+# Il log delle query si attiva solo per il debug (DB_ECHO=1)
+engine = create_engine(DATABASE_URL, echo=os.getenv('DB_ECHO', '').lower() in ('1', 'true', 'yes'))
+# Ogni thread (GUI, backup, daemon) usa le proprie sessioni: non vanno condivise
 Session = sessionmaker(bind=engine)
 Base = declarative_base()
 
+
+@event.listens_for(engine, 'connect')
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL: le letture della GUI non bloccano le scritture dei backup e viceversa
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA busy_timeout=10000')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.execute('PRAGMA cache_size=-16000')
+    cursor.close()
+
 class Path(Base):
     __tablename__ = 'paths'
     id = Column(Integer, primary_key=True)
     path = Column(String, nullable=False)
-    backup_job_id = Column(Integer, ForeignKey('backup_jobs.id'))
+    backup_job_id = Column(Integer, ForeignKey('backup_jobs.id'), index=True)
 
 
 class EmailAddress(Base):
     __tablename__ = 'email_addresses'
     id = Column(Integer, primary_key=True)
     email = Column(String, nullable=False)
-    backup_job_id = Column(Integer, ForeignKey('backup_jobs.id'))
+    backup_job_id = Column(Integer, ForeignKey('backup_jobs.id'), index=True)
     backup_job = relationship("BackupJob", back_populates="email_addresses")
 
+
+class FilterRule(Base):
+    # Regola di inclusione/esclusione in stile .gitignore ('*.tmp', '!tieni.tmp',
+    # 'cache/') o predicato sui file ('size>1G', 'age>30d'); conta l'ordine
+    __tablename__ = 'filter_rules'
+    id = Column(Integer, primary_key=True)
+    pattern = Column(String, nullable=False)
+    position = Column(Integer, nullable=False, default=0)
+    backup_job_id = Column(Integer, ForeignKey('backup_jobs.id'), index=True)
+
+class Destination(Base):
+    # Destinazione aggiuntiva del job, scritta insieme a dest_folder e nello stesso formato
+    __tablename__ = 'destinations'
+    id = Column(Integer, primary_key=True)
+    folder = Column(String, nullable=False)
+    backup_job_id = Column(Integer, ForeignKey('backup_jobs.id'), index=True)
+    # Fine dell'ultima esecuzione riuscita anche su questa destinazione
+    last_success_at = Column(DateTime, nullable=True)
+    # Errore che l'ha esclusa dall'ultima esecuzione, None se e' allineata
+    last_error = Column(Text, nullable=True)
+
+    def is_lagging(self, last_run_date):
+        # Indietro rispetto alla destinazione principale: la prossima
+        # esecuzione la confronta file per file invece di usare il manifest
+        return (self.last_error is not None or self.last_success_at is None
+                or (last_run_date is not None and self.last_success_at < last_run_date))
+
+    def describe(self, last_run_date):
+        # Stato per la GUI e la riga di comando
+        if self.last_success_at is None:
+            status = 'mai scritta'
+        elif self.is_lagging(last_run_date):
+            status = f"in ritardo, allineata al {self.last_success_at.strftime('%d/%m/%Y %H:%M')}"
+        else:
+            status = 'allineata'
+        if self.last_error:
+            status += f" (errore: {self.last_error})"
+        return f"{self.folder}: {status}"
+
 class BackupJob(Base):
     __tablename__ = 'backup_jobs'
     id = Column(Integer, primary_key=True)
@@ -39,10 +93,158 @@ class BackupJob(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     last_run_date = Column(DateTime, nullable=True)
     run_count = Column(Integer, default=0)  #
+    # 'mirror' (copia semplice), 'store' (archivio deduplicato) o 'snapshot'
+    dest_format = Column(String, nullable=False, default='mirror', server_default='mirror')
+    # Solo per 'mirror': rimuove dalla copia i file eliminati alla sorgente e sposta quelli rinominati
+    mirror_deletions = Column(Boolean, nullable=False, default=False, server_default=text('0'))
+    # Backup continuo (Linux): le sorgenti sono osservate con inotify e si copiano solo le modifiche
+    continuous = Column(Boolean, nullable=False, default=False, server_default=text('0'))
 
     paths = relationship('Path', backref='backup_job', cascade='all, delete-orphan')
     email_addresses = relationship('EmailAddress', back_populates='backup_job', cascade='all, delete-orphan')
+    extra_destinations = relationship('Destination', backref='backup_job', cascade='all, delete-orphan',
+                                      order_by='Destination.id')
+    filter_rules = relationship('FilterRule', backref='backup_job', cascade='all, delete-orphan',
+                                order_by='FilterRule.position')
+    manifest_entries = relationship('FileManifest', back_populates='backup_job',
+                                    cascade='all, delete-orphan', lazy='dynamic')
+    snapshots = relationship('BackupSnapshot', back_populates='backup_job',
+                             cascade='all, delete-orphan', order_by='BackupSnapshot.created_at')
+    # Lo storico cresce a ogni esecuzione: si interroga, non si carica tutto
+    runs = relationship('BackupRun', back_populates='backup_job',
+                        cascade='all, delete-orphan', lazy='dynamic')
+    verify_failures = relationship('VerifyFailure', back_populates='backup_job',
+                                   cascade='all, delete-orphan', lazy='dynamic')
+
+
+def query_jobs(session):
+    # Percorsi ed email di tutti i job in due query invece di due per job
+    return session.query(BackupJob).options(selectinload(BackupJob.paths),
+                                            selectinload(BackupJob.email_addresses))
+
+
+def get_job(session, job_id):
+    return session.get(BackupJob, job_id, options=[selectinload(BackupJob.paths),
+                                                   selectinload(BackupJob.email_addresses)])
+
+
+class FileManifest(Base):
+    # Stato dei file sorgente all'ultimo backup riuscito
+    __tablename__ = 'file_manifest'
+    id = Column(Integer, primary_key=True)
+    backup_job_id = Column(Integer, ForeignKey('backup_jobs.id'), nullable=False, index=True)
+    path = Column(String, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    mtime_ns = Column(BigInteger, nullable=False)
+    inode = Column(BigInteger, nullable=True)
+    hash = Column(String, nullable=True)
+    backup_job = relationship('BackupJob', back_populates='manifest_entries')
+
+
+class BackupSnapshot(Base):
+    # Snapshot con hardlink creato da un'esecuzione riuscita
+    __tablename__ = 'backup_snapshots'
+    id = Column(Integer, primary_key=True)
+    backup_job_id = Column(Integer, ForeignKey('backup_jobs.id'), nullable=False, index=True)
+    path = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
+    files_copied = Column(Integer, default=0)
+    files_linked = Column(Integer, default=0)
+    bytes_copied = Column(BigInteger, default=0)
+    backup_job = relationship('BackupJob', back_populates='snapshots')
+
+
+class BackupRun(Base):
+    # Storico delle esecuzioni, con contatori e durata delle fasi
+    __tablename__ = 'backup_runs'
+    __table_args__ = (Index('ix_backup_runs_backup_job_id_started_at', 'backup_job_id', 'started_at'),)
+    id = Column(Integer, primary_key=True)
+    backup_job_id = Column(Integer, ForeignKey('backup_jobs.id'), nullable=False)
+    started_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+    success = Column(Boolean, default=False)
+    files_scanned = Column(Integer, default=0)
+    files_copied = Column(Integer, default=0)
+    files_skipped = Column(Integer, default=0)
+    bytes_copied = Column(BigInteger, default=0)
+    error_count = Column(Integer, default=0)
+    scan_seconds = Column(Float, nullable=True)
+    copy_seconds = Column(Float, nullable=True)
+    verify_seconds = Column(Float, nullable=True)
+    files_verified = Column(Integer, default=0)
+    backup_job = relationship('BackupJob', back_populates='runs')
+    verify_failures = relationship('VerifyFailure', back_populates='run')
+
+    @property
+    def duration(self):
+        if self.finished_at is None:
+            return None
+        return (self.finished_at - self.started_at).total_seconds()
+
+    @property
+    def throughput(self):
+        # Byte al secondo sulla durata complessiva dell'esecuzione
+        duration = self.duration
+        if not duration:
+            return None
+        return (self.bytes_copied or 0) / duration
+
+
+class VerifyFailure(Base):
+    # Copia che non corrisponde al sorgente (o all'hash registrato) durante una verifica
+    __tablename__ = 'verify_failures'
+    id = Column(Integer, primary_key=True)
+    backup_job_id = Column(Integer, ForeignKey('backup_jobs.id'), nullable=False, index=True)
+    # Esecuzione in cui e' stata fatta la verifica; None per le verifiche su richiesta
+    run_id = Column(Integer, ForeignKey('backup_runs.id'), nullable=True)
+    path = Column(String, nullable=False)
+    # Errore di lettura della copia, None se il contenuto e' diverso
+    error = Column(Text, nullable=True)
+    expected_hash = Column(String, nullable=True)
+    actual_hash = Column(String, nullable=True)
+    detected_at = Column(DateTime, default=datetime.now)
+    backup_job = relationship('BackupJob', back_populates='verify_failures')
+    run = relationship('BackupRun', back_populates='verify_failures')
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _alembic_config():
+    from alembic.config import Config
+
+    config = Config(os.path.join(ROOT_DIR, 'alembic.ini'))
+    config.set_main_option('script_location', os.path.join(ROOT_DIR, 'alembic'))
+    return config
+
+
+def _head_revision():
+    # Le migrazioni sono numerate in sequenza (0001_..., 0002_...): l'ultima e' la head
+    names = os.listdir(os.path.join(ROOT_DIR, 'alembic', 'versions'))
+    return max(name.split('_')[0] for name in names if name[:4].isdigit())
 
 
 def create_tables():
-    Base.metadata.create_all(engine)
+    # Un database nuovo viene creato dai modelli e marcato all'ultima
+    # revisione; uno esistente viene aggiornato con le migrazioni alembic.
+    # Se lo schema e' gia' aggiornato alembic non viene nemmeno importato.
+    with engine.connect() as connection:
+        inspector = inspect(connection)
+        if (inspector.has_table('alembic_version') and connection.execute(
+                text('SELECT version_num FROM alembic_version')).scalar() == _head_revision()):
+            return
+
+    from alembic import command
+
+    config = _alembic_config()
+    with engine.begin() as connection:
+        config.attributes['connection'] = connection
+        inspector = inspect(connection)
+        if not inspector.has_table('backup_jobs'):
+            Base.metadata.create_all(connection)
+            command.stamp(config, 'head')
+        else:
+            if not inspector.has_table('alembic_version'):
+                # Database creato prima delle migrazioni
+                command.stamp(config, '0001')
+            command.upgrade(config, 'head')
@@ -0,0 +1,271 @@
+import bz2
+import collections
+import datetime
+import errno
+import gzip
+import json
+import lzma
+import multiprocessing
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+CODECS = ('gzip', 'bz2', 'lzma')
+# Blocchi compressi indipendentemente: gzip, bz2 e xz accettano flussi concatenati
+BLOCK_SIZE = 4 * 1024 * 1024
+# Sotto questa dimensione si comprime nel thread di copia, senza passare dal pool
+PARALLEL_MIN_SIZE = 1024 * 1024
+# File troppo piccoli per guadagnare qualcosa dalla compressione
+COMPRESS_MIN_SIZE = 512
+SAMPLE_SIZE = 64 * 1024
+# Campione che zlib non riesce a ridurre almeno del 5%: dati gia' compressi o casuali
+INCOMPRESSIBLE_RATIO = 0.95
+# Formati che sono gia' compressi
+INCOMPRESSIBLE_EXTENSIONS = frozenset((
+    '.7z', '.aac', '.apk', '.avi', '.br', '.bz2', '.docx', '.epub', '.flac', '.gif', '.gz', '.heic',
+    '.jar', '.jpeg', '.jpg', '.lz', '.lz4', '.lzma', '.m4a', '.mkv', '.mov', '.mp3', '.mp4', '.odp',
+    '.ods', '.odt', '.ogg', '.opus', '.png', '.pptx', '.rar', '.tgz', '.webm', '.webp', '.xlsx', '.xz',
+    '.zip', '.zst',
+))
+CODEC_HEADER = 'PYTHONBACKUP.codec'
+SIZE_HEADER = 'PYTHONBACKUP.size'
+
+
+def compress_block(codec, data):
+    if codec == 'gzip':
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    if codec == 'bz2':
+        return bz2.compress(data, 9)
+    return lzma.compress(data, preset=6)
+
+
+def _decompressor(codec):
+    if codec == 'gzip':
+        return zlib.decompressobj(wbits=31)
+    if codec == 'bz2':
+        return bz2.BZ2Decompressor()
+    return lzma.LZMADecompressor()
+
+
+def looks_incompressible(path, sample):
+    if os.path.splitext(path)[1].lower() in INCOMPRESSIBLE_EXTENSIONS:
+        return True
+    return len(zlib.compress(sample, 1)) > len(sample) * INCOMPRESSIBLE_RATIO
+
+
+def iter_member(archive_path, offset, length, codec, chunk_size=BLOCK_SIZE):
+    """Contenuto originale di un membro dell'archivio, a pezzi.
+
+    I blocchi compressi sono flussi indipendenti uno dopo l'altro: finito
+    uno, il decompressore riparte dai byte che avanzano.
+    """
+    decompressor = None
+    with open(archive_path, 'rb') as f:
+        f.seek(offset)
+        remaining = length
+        while remaining:
+            data = f.read(min(chunk_size, remaining))
+            if not data:
+                raise OSError(f"Archive {archive_path} is truncated")
+            remaining -= len(data)
+            if codec is None:
+                yield data
+                continue
+            while data:
+                if decompressor is None or decompressor.eof:
+                    decompressor = _decompressor(codec)
+                try:
+                    plain = decompressor.decompress(data)
+                except (zlib.error, lzma.LZMAError, EOFError, OSError) as e:
+                    # Come gli errori di lettura: chi ripristina salta il file e prosegue
+                    raise OSError(f"Corrupt compressed data in {archive_path} at offset {offset}: {e}") from e
+                yield plain
+                data = decompressor.unused_data if decompressor.eof else b''
+    if codec is not None and length and not decompressor.eof:
+        raise OSError(f"Compressed data in {archive_path} at offset {offset} is truncated")
+
+
+class ArchiveDestination:
+    """Un archivio tar per esecuzione in <dest_folder>/archives/<tag>.
+
+    L'archivio viene scritto in sequenza, in un solo passaggio. Ogni file
+    e' un membro compresso a se' (gzip, bz2 o lzma), a blocchi compressi in
+    parallelo da un pool di processi; i file che non si comprimono vengono
+    salvati cosi' come sono. Come per lo store, ogni archivio contiene solo
+    i file cambiati e un indice accanto all'archivio dice, per ogni file
+    della sorgente, in quale archivio e a quale offset si trovano i dati.
+    """
+    name = 'archive'
+    resumable = False
+
+    def __init__(self, dest_folder, tag='default', codec='gzip', workers=None):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown archive codec: {codec}")
+        self.root = os.path.join(dest_folder, 'archives', tag)
+        self.codec = codec
+        self.workers = workers or os.cpu_count()
+        self.created_at = datetime.datetime.now()
+        self.archive_name = self.created_at.strftime('%Y%m%d-%H%M%S-%f') + '.tar'
+        self.archive_path = os.path.join(self.root, self.archive_name)
+        self.device = None
+        self.previous_files = {}
+        self.files = {}
+        self._archive = None
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def open(self):
+        os.makedirs(self.root, exist_ok=True)
+        self.device = os.stat(self.root).st_dev
+        self.previous_files = self.latest_index()
+        self._archive = open(self.archive_path + '.partial', 'wb')
+        # spawn: il processo principale ha thread attivi (vedi engine.verify)
+        self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                         mp_context=multiprocessing.get_context('spawn'))
+
+    def latest_index(self):
+        try:
+            names = sorted(name for name in os.listdir(self.root) if name.endswith('.index.json.gz'))
+        except FileNotFoundError:
+            return {}
+        if not names:
+            return {}
+        with gzip.open(os.path.join(self.root, names[-1]), 'rt', encoding='utf-8') as f:
+            return json.load(f)['files']
+
+    def needs_copy(self, entry, previous):
+        old = self.previous_files.get(entry.rel_path)
+        return (old is None or old['size'] != entry.stat.st_size
+                or old['mtime_ns'] != entry.stat.st_mtime_ns)
+
+    def prepare(self, entry):
+        pass
+
+    def skip(self, entry):
+        self.files[entry.rel_path] = self.previous_files[entry.rel_path]
+
+    def write(self, entry, progress=None):
+        size = entry.stat.st_size
+        with open(entry.path, 'rb') as src:
+            sample = src.read(SAMPLE_SIZE)
+            codec = self.codec
+            if size < COMPRESS_MIN_SIZE or looks_incompressible(entry.path, sample):
+                codec = None
+            src.seek(0)
+            if codec is not None and size < PARALLEL_MIN_SIZE:
+                data = src.read()
+                compressed = compress_block(codec, data)
+                if len(compressed) >= len(data):
+                    codec, compressed = None, data
+                return self._append(entry, codec, compressed, progress)
+            if codec is None:
+                # Lunghezza nota (st_size): si copia direttamente nell'archivio,
+                # senza passare da un file temporaneo
+                return self._append_stream(entry, src, progress)
+            with tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024) as spool:
+                self._compress_blocks(src, spool, codec, progress)
+                return self._append(entry, codec, spool, None)
+
+    def _compress_blocks(self, src, spool, codec, progress):
+        # Finestra limitata di blocchi in volo: la memoria resta costante
+        # anche per file molto grandi
+        pending = collections.deque()
+        while True:
+            data = src.read(BLOCK_SIZE)
+            if data:
+                pending.append((len(data), self._pool.submit(compress_block, codec, data)))
+            while pending and (not data or len(pending) >= self.workers * 2):
+                length, future = pending.popleft()
+                spool.write(future.result())
+                if progress:
+                    progress(length)
+            if not data:
+                return
+
+    def _header(self, entry, codec, length):
+        info = tarfile.TarInfo(entry.rel_path.replace(os.sep, '/'))
+        info.size = length
+        info.mtime = entry.stat.st_mtime
+        info.mode = entry.stat.st_mode & 0o7777
+        info.pax_headers = {CODEC_HEADER: codec or 'none', SIZE_HEADER: str(entry.stat.st_size)}
+        return info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+
+    def _record(self, entry, codec, offset, length):
+        self.files[entry.rel_path] = {'archive': self.archive_name, 'offset': offset, 'length': length,
+                                      'codec': codec, 'size': entry.stat.st_size,
+                                      'mtime_ns': entry.stat.st_mtime_ns, 'mode': entry.stat.st_mode}
+
+    def _append(self, entry, codec, data, progress):
+        if isinstance(data, bytes):
+            length = len(data)
+        else:
+            length = data.tell()
+            data.seek(0)
+        header = self._header(entry, codec, length)
+        padding = -length % tarfile.BLOCKSIZE
+        with self._lock:
+            offset = self._archive.tell() + len(header)
+            self._archive.write(header)
+            if isinstance(data, bytes):
+                self._archive.write(data)
+            else:
+                shutil.copyfileobj(data, self._archive, BLOCK_SIZE)
+            self._archive.write(b'\0' * padding)
+            self._record(entry, codec, offset, length)
+        if progress:
+            progress(entry.stat.st_size)
+        return f'archive-{codec or "stored"}', length
+
+    def _append_stream(self, entry, src, progress):
+        # Il lock resta preso per tutta la copia: gli altri worker intanto
+        # comprimono i propri file
+        length = entry.stat.st_size
+        header = self._header(entry, None, length)
+        with self._lock:
+            start = self._archive.tell()
+            try:
+                self._archive.write(header)
+                remaining = length
+                while remaining:
+                    data = src.read(min(BLOCK_SIZE, remaining))
+                    if not data:
+                        raise OSError(errno.EIO, f"{entry.path} shrank while being archived")
+                    self._archive.write(data)
+                    remaining -= len(data)
+                    if progress:
+                        progress(len(data))
+                self._archive.write(b'\0' * (-length % tarfile.BLOCKSIZE))
+            except BaseException:
+                # Via il membro incompleto: l'intestazione dichiara st_size byte
+                self._archive.seek(start)
+                self._archive.truncate()
+                raise
+            self._record(entry, None, start + len(header), length)
+        return 'archive-stored', length
+
+    def verify_target(self, rel_path):
+        record = self.files.get(rel_path)
+        if record is None:
+            return None
+        return ('archive', os.path.join(self.root, record['archive']), record['offset'], record['length'],
+                record['codec'])
+
+    def close(self, success):
+        self._pool.shutdown(wait=True, cancel_futures=not success)
+        with self._lock:
+            if success:
+                # Fine dell'archivio tar: due blocchi vuoti
+                self._archive.write(b'\0' * tarfile.BLOCKSIZE * 2)
+            self._archive.close()
+        if not success:
+            os.remove(self.archive_path + '.partial')
+            return
+        os.replace(self.archive_path + '.partial', self.archive_path)
+        index_path = self.archive_path[:-len('.tar')] + '.index.json.gz'
+        with gzip.open(index_path + '.tmp', 'wt', encoding='utf-8') as f:
+            json.dump({'created': self.created_at.isoformat(), 'files': self.files}, f)
+        os.replace(index_path + '.tmp', index_path)
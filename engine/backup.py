@@ -0,0 +1,317 @@
+import os
+import queue
+import threading
+import time
+
+from engine.copier import CopyPool
+from engine.copy_backend import allocated_size, is_sparse
+from engine.manifest import ManifestRecord
+from engine.mirror import MirrorDestination
+from engine.progress import ProgressTracker
+from engine.renames import RenameIndex, confirm_rename
+from engine.scanner import relative_path, scan_paths, scan_source
+from engine.stats import RunStats
+from engine.tracing import RunTrace
+
+_SCAN_DONE = object()
+# Sotto questa dimensione l'avanzamento si aggiorna solo a file completato
+PROGRESS_MIN_SIZE = 8 * 1024 * 1024
+# Copie eliminate per volta quando si propagano le cancellazioni
+DELETE_BATCH_SIZE = 1000
+# Sotto questo numero di file spariti il limite percentuale non si applica
+DELETE_GUARD_MIN_FILES = 10
+
+DEST_FORMATS = ('mirror', 'store', 'snapshot', 'archive')
+
+
+def create_destination(dest_format, dest_folder, backup_job_id=None, delta_threshold=None,
+                       previous_snapshot=None, propagate_deletions=False, archive_codec='gzip',
+                       compress_workers=None, extra_destinations=()):
+    # extra_destinations: (cartella, in ritardo) delle destinazioni aggiuntive, scritte con un TeeDestination
+    if extra_destinations:
+        from engine.fanout import Sink, TeeDestination
+        options = dict(backup_job_id=backup_job_id, delta_threshold=delta_threshold,
+                       propagate_deletions=propagate_deletions, archive_codec=archive_codec,
+                       compress_workers=compress_workers)
+        # Le aggiuntive cercano da sole il proprio ultimo snapshot
+        sinks = [Sink(create_destination(dest_format, dest_folder, previous_snapshot=previous_snapshot, **options),
+                      dest_folder)]
+        sinks += [Sink(create_destination(dest_format, folder, **options), folder, lagging)
+                  for folder, lagging in extra_destinations]
+        return TeeDestination(sinks)
+    # I formati meno usati si importano solo quando servono
+    tag = f'job-{backup_job_id}' if backup_job_id else 'default'
+    if dest_format == 'store':
+        from engine.store import StoreDestination
+        return StoreDestination(dest_folder, tag)
+    if dest_format == 'snapshot':
+        from engine.snapshot import SnapshotDestination
+        return SnapshotDestination(dest_folder, tag, previous_snapshot)
+    if dest_format == 'archive':
+        from engine.archive import ArchiveDestination
+        return ArchiveDestination(dest_folder, tag, archive_codec, compress_workers)
+    if dest_format == 'mirror':
+        return MirrorDestination(dest_folder, delta_threshold, propagate_deletions=propagate_deletions)
+    raise ValueError(f"Unknown destination format: {dest_format}")
+
+
+class BackupEngine:
+    def __init__(self, source_paths, destination, progress=None, should_stop=None, manifest=None,
+                 workers=4, per_source_device=None, per_dest_device=None, queue_size=1024, file_filter=None,
+                 checkpoint=None, progress_interval=0.25, changed_paths=None, trace=None,
+                 max_delete_fraction=0.5):
+        self.source_paths = source_paths
+        self.destination = destination
+        # progress riceve un ProgressSnapshot al massimo ogni progress_interval secondi
+        self.progress = progress
+        self.should_stop = should_stop or (lambda: False)
+        self.queue_size = queue_size
+        self.workers = workers
+        self.per_source_device = per_source_device
+        self.per_dest_device = per_dest_device
+        self.file_filter = file_filter
+        # Journal dei file gia' scritti, per riprendere un'esecuzione interrotta
+        self.checkpoint = checkpoint
+        # Manifest dell'ultima esecuzione riuscita (path -> ManifestRecord) e
+        # quello che viene costruito durante questa esecuzione
+        self.manifest = manifest or {}
+        self.new_manifest = {}
+        # Backup continuo: si esaminano solo questi percorsi e il resto del
+        # manifest resta valido
+        self.changed_paths = changed_paths
+        if changed_paths is not None:
+            self.new_manifest = dict(self.manifest)
+        self._missing = []
+        # Con la propagazione delle cancellazioni i file nuovi che somigliano a
+        # file spariti aspettano la fine della scansione: forse basta spostarli
+        self.propagate_deletions = getattr(destination, 'propagate_deletions', False)
+        self._renames = RenameIndex(self.manifest) if self.propagate_deletions else None
+        # Frazione massima del manifest che un'esecuzione puo' eliminare dalla copia
+        self.max_delete_fraction = max_delete_fraction
+        self._rename_candidates = []
+        self.tracker = ProgressTracker(progress, progress_interval)
+        self.stats = RunStats()
+        # Span, latenze per file e log dell'esecuzione
+        self.trace = trace or RunTrace()
+        self.log = self.trace.logger
+        self.errors = []
+        self._pool = None
+        self._started = None
+
+    def run(self):
+        self._started = time.monotonic()
+        started_ns = time.perf_counter_ns()
+        with self.trace.span('open_destination'):
+            self.destination.open()
+        if self.checkpoint is not None:
+            resumed = self.checkpoint.open(self.destination.backup_folder)
+            if resumed:
+                self.log.info("Resuming interrupted backup: %d files already copied", resumed)
+        self._pool = CopyPool(self.workers, self.per_source_device, self.per_dest_device)
+        self.tracker.start()
+        completed = False
+
+        # Lo scanner alimenta la coda mentre questo thread copia: la copia
+        # parte subito, senza un passaggio preliminare di conteggio.
+        entries = queue.Queue(maxsize=self.queue_size)
+        stop_scan = threading.Event()
+        scanner = threading.Thread(target=self._scan, args=(entries, stop_scan), daemon=True)
+        scanner.start()
+
+        try:
+            while True:
+                item = entries.get()
+                if item is _SCAN_DONE:
+                    break
+                if self.should_stop():
+                    return False
+                self._process(item)
+            if self._missing:
+                self._forget_missing()
+            if self.propagate_deletions:
+                deleted = set(self.manifest).difference(self.new_manifest)
+                with self.trace.span('renames'):
+                    self._apply_renames(deleted)
+            # Tutti i file da copiare sono in coda con la loro dimensione: il
+            # totale e' noto e il progresso puo' stimare la fine della copia
+            self.tracker.finish_scan()
+            self._pool.join()
+            if self.propagate_deletions:
+                with self.trace.span('delete'):
+                    if not self._apply_deletions(deleted):
+                        return False
+            # Scansione e copia si sovrappongono: la fase di copia va
+            # dall'inizio dell'esecuzione all'ultimo file scritto
+            self.stats.record_phase('copy', time.monotonic() - self._started)
+            self.trace.record('copy', 'phase', started_ns, time.perf_counter_ns() - started_ns)
+            completed = True
+            return True
+        finally:
+            if not completed:
+                self._pool.cancel()
+            self.tracker.stop(report=completed)
+            with self.trace.span('close_destination'):
+                self.destination.close(completed)
+            if self.checkpoint is not None:
+                try:
+                    self.checkpoint.close(completed)
+                except OSError as e:
+                    self.log.error("Error saving checkpoint journal: %s", e)
+            stop_scan.set()
+            # Svuota la coda per sbloccare lo scanner se e' in attesa
+            while scanner.is_alive():
+                try:
+                    entries.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+    def _scan(self, entries, stop_scan):
+        started_ns = time.perf_counter_ns()
+        try:
+            for entry in self._scan_entries():
+                if stop_scan.is_set():
+                    return
+                self.tracker.add_total(files=1)
+                self.stats.add(files_scanned=1)
+                entries.put(entry)
+            self.stats.record_phase('scan', time.monotonic() - self._started)
+        finally:
+            self.trace.record('scan', 'phase', started_ns, time.perf_counter_ns() - started_ns)
+            entries.put(_SCAN_DONE)
+
+    def _scan_entries(self):
+        if self.changed_paths is not None:
+            yield from scan_paths(self.source_paths, self.changed_paths, self._on_scan_error,
+                                  self.file_filter, self._missing.append, self.trace)
+            return
+        for source_path in self.source_paths:
+            yield from scan_source(source_path, self._on_scan_error, self.file_filter, self.trace)
+
+    def _forget_missing(self):
+        # Percorsi spariti dalla sorgente: file o cartelle intere
+        prefixes = tuple(os.path.join(path, '') for path in self._missing)
+        for path in self._missing:
+            self.new_manifest.pop(path, None)
+        for path in [path for path in self.new_manifest if path.startswith(prefixes)]:
+            del self.new_manifest[path]
+
+    def _on_scan_error(self, path, error):
+        self.log.warning("Error scanning %s: %s", path, error)
+        self.errors.append((path, str(error)))
+        self.stats.add(errors=1)
+
+    def _process(self, entry):
+        st = entry.stat
+        previous = self.manifest.get(entry.path)
+        self.new_manifest[entry.path] = ManifestRecord(
+            None, st.st_size, st.st_mtime_ns, st.st_ino,
+            previous.hash if previous is not None and previous.matches(st) else None)
+        if self._renames is not None and previous is None:
+            candidates = self._renames.candidates(entry)
+            if candidates:
+                self._rename_candidates.append((entry, candidates))
+                return
+        self._copy_or_skip(entry, previous)
+
+    def _copy_or_skip(self, entry, previous):
+        st = entry.stat
+        if self.checkpoint is not None and self.checkpoint.is_done(entry.path, st):
+            # Gia' scritto dall'esecuzione interrotta
+            self.stats.add(files_skipped=1)
+            self.tracker.add_done(files=1)
+        elif self.destination.needs_copy(entry, previous):
+            self.destination.prepare(entry)
+            self.tracker.add_total(size=st.st_size)
+            self._pool.submit(lambda: self._write(entry), st.st_dev, self.destination.device,
+                              lambda result: self._on_copied(entry, *result))
+        else:
+            self.destination.skip(entry)
+            self.stats.add(files_skipped=1)
+            self.tracker.add_done(files=1)
+
+    def _apply_renames(self, deleted):
+        for entry, candidates in self._rename_candidates:
+            old_path = confirm_rename(entry, candidates, deleted)
+            old_rel_path = relative_path(self.source_paths, old_path) if old_path else None
+            if old_rel_path is not None and self.destination.move(old_rel_path, entry.rel_path):
+                deleted.discard(old_path)
+                self.new_manifest[entry.path].hash = self.manifest[old_path].hash
+                self.stats.add(files_moved=1)
+                self.tracker.add_done(files=1)
+                if self.checkpoint is not None:
+                    self.checkpoint.record(entry.path, entry.stat)
+            else:
+                self._copy_or_skip(entry, None)
+        self._rename_candidates = []
+
+    def _apply_deletions(self, deleted):
+        # Un errore di scansione (cartella illeggibile, disco scollegato) fa
+        # sembrare spariti file che esistono ancora: in quel caso non si cancella
+        if self.errors:
+            self.log.warning("Skipping deletion of %d files: the scan reported errors", len(deleted))
+            return True
+        reason = self._deletion_guard(deleted)
+        if reason:
+            self.log.warning("Refusing to delete %d files: %s", len(deleted), reason)
+            # Restano nel manifest: la prossima esecuzione li valuta di nuovo
+            for path in deleted:
+                self.new_manifest[path] = self.manifest[path]
+            return True
+        rel_paths = [rel_path for rel_path in (relative_path(self.source_paths, path) for path in deleted)
+                     if rel_path is not None]
+        for start in range(0, len(rel_paths), DELETE_BATCH_SIZE):
+            if self.should_stop():
+                return False
+            batch = rel_paths[start:start + DELETE_BATCH_SIZE]
+            self.destination.delete(batch)
+            self.stats.add(files_deleted=len(batch))
+        return True
+
+    def _deletion_guard(self, deleted):
+        # Una sorgente vuota ma presente (disco non montato sotto il punto di
+        # mount) non da' errori di scansione e fa sembrare spariti tutti i file
+        if not deleted:
+            return None
+        for source_path in self.source_paths:
+            prefix = os.path.join(source_path, '')
+            had_files = any(path == source_path or path.startswith(prefix) for path in self.manifest)
+            if had_files and not any(path == source_path or path.startswith(prefix)
+                                     for path in self.new_manifest):
+                return f"source {source_path} has no files left"
+        if (len(deleted) >= DELETE_GUARD_MIN_FILES
+                and len(deleted) > len(self.manifest) * self.max_delete_fraction):
+            return (f"{len(deleted)} of {len(self.manifest)} files gone, "
+                    f"more than the {self.max_delete_fraction:.0%} limit")
+        return None
+
+    def _write(self, entry):
+        size = entry.stat.st_size
+        start = time.perf_counter_ns()
+        if size < PROGRESS_MIN_SIZE:
+            result = self.destination.write(entry)
+            self.trace.time_file('copy', start, path=entry.rel_path, size=size)
+            self.tracker.add_done(files=1, size=size, current_file=entry.path)
+            return result
+
+        # I file grandi avanzano a blocchi, non solo a copia finita
+        reported = 0
+
+        def advance(copied):
+            nonlocal reported
+            reported += copied
+            self.tracker.add_done(size=copied, current_file=entry.path)
+
+        result = self.destination.write(entry, advance)
+        self.trace.time_file('copy', start, path=entry.rel_path, size=size)
+        self.tracker.add_done(files=1, size=max(size - reported, 0))
+        return result
+
+    def _on_copied(self, entry, method, size):
+        if method == 'hardlink':
+            self.stats.add(files_linked=1)
+        else:
+            self.stats.add(files_copied=1, bytes_copied=size, files_sparse=int(is_sparse(entry.stat)),
+                           bytes_apparent=entry.stat.st_size, bytes_allocated=allocated_size(entry.stat))
+        self.stats.count_method(method)
+        if self.checkpoint is not None:
+            self.checkpoint.record(entry.path, entry.stat)
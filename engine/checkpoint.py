@@ -0,0 +1,141 @@
+import ctypes
+import ctypes.util
+import json
+import os
+import sys
+import threading
+import time
+
+from engine.manifest import ManifestRecord
+
+JOURNAL_MAGIC = 'PBJOURNAL1'
+
+
+_libc = None
+
+
+def _syncfs(fd):
+    # Su Linux scrive su disco solo il filesystem che contiene fd, non tutti
+    # quelli montati come os.sync()
+    global _libc
+    if _libc is None and sys.platform.startswith('linux'):
+        try:
+            _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            _libc.syncfs.argtypes = [ctypes.c_int]
+        except (OSError, AttributeError):
+            _libc = False
+    if _libc and _libc.syncfs(fd) == 0:
+        return
+    if hasattr(os, 'sync'):
+        os.sync()
+
+
+def journal_path(dest_folder, tag):
+    return os.path.join(dest_folder, '.checkpoints', f'{tag}.journal')
+
+
+class CheckpointJournal:
+    """Registro dei file gia' scritti da un'esecuzione non ancora conclusa.
+
+    Ogni file completato viene accodato con size, mtime e inode; le righe
+    vengono scritte a lotti, dopo aver forzato su disco i dati dei file del
+    lotto (syncfs del filesystem del journal, che e' quello della
+    destinazione). Se l'esecuzione si interrompe il journal resta sulla destinazione
+    e la successiva salta i file gia' copiati e invariati; a fine esecuzione
+    riuscita il journal viene eliminato.
+    """
+
+    def __init__(self, path, batch_size=500, interval=5.0, trace=None):
+        self.path = path
+        self.trace = trace
+        self.batch_size = batch_size
+        self.interval = interval
+        self.done = {}
+        self._lock = threading.Lock()
+        # Serializza le scritture sul journal; chi accoda non aspetta il sync
+        self._write_lock = threading.Lock()
+        self._pending = []
+        self._last_flush = 0.0
+        self._file = None
+
+    def open(self, target):
+        """Carica il journal precedente se si riferisce alla stessa cartella target."""
+        self.done = self._load(target)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if self.done:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        else:
+            self._file = open(self.path, 'w', encoding='utf-8')
+            self._file.write(json.dumps([JOURNAL_MAGIC, target]) + '\n')
+            self._file.flush()
+        self._last_flush = time.monotonic()
+        return len(self.done)
+
+    def _load(self, target):
+        done = {}
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                if json.loads(f.readline() or 'null') != [JOURNAL_MAGIC, target]:
+                    return {}
+                for line in f:
+                    # Un'interruzione durante la scrittura lascia l'ultima riga troncata
+                    if not line.endswith('\n'):
+                        break
+                    path, size, mtime_ns, inode = json.loads(line)
+                    done[path] = ManifestRecord(None, size, mtime_ns, inode)
+        except (OSError, ValueError):
+            return done
+        return done
+
+    def is_done(self, path, st):
+        record = self.done.get(path)
+        return record is not None and record.matches(st)
+
+    def record(self, path, st):
+        with self._lock:
+            self._pending.append(json.dumps([path, st.st_size, st.st_mtime_ns, st.st_ino]) + '\n')
+            if (len(self._pending) < self.batch_size
+                    and time.monotonic() - self._last_flush < self.interval):
+                return
+            batch = self._take_batch()
+        # Il sync avviene fuori dal lock: gli altri worker continuano ad accodare
+        self._write(batch)
+
+    def _take_batch(self):
+        batch = self._pending
+        self._pending = []
+        self._last_flush = time.monotonic()
+        return batch
+
+    def _write(self, batch):
+        with self._write_lock:
+            self._write_locked(batch)
+
+    def _write_locked(self, batch):
+        if not batch:
+            return
+        start = time.perf_counter_ns()
+        # I file del lotto devono essere su disco prima delle righe che li
+        # danno per completati
+        _syncfs(self._file.fileno())
+        self._file.write(''.join(batch))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        if self.trace is not None:
+            self.trace.record('fsync', 'io', start, time.perf_counter_ns() - start,
+                              {'files': len(batch)})
+
+    def close(self, success):
+        with self._lock, self._write_lock:
+            if self._file is None:
+                return
+            if success:
+                self._pending = []
+                self._file.close()
+                os.remove(self.path)
+            else:
+                try:
+                    self._write_locked(self._take_batch())
+                finally:
+                    self._file.close()
+            self._file = None
@@ -0,0 +1,264 @@
+import logging
+import os
+import select
+import threading
+import time
+
+from engine.filters import FileFilter
+from engine.inotify import (IN_ATTRIB, IN_CLOSE_WRITE, IN_CREATE, IN_DELETE, IN_DONT_FOLLOW, IN_EXCL_UNLINK,
+                            IN_IGNORED, IN_ISDIR, IN_MOVED_FROM, IN_MOVED_TO, IN_Q_OVERFLOW, Inotify,
+                            inotify_available)
+
+logger = logging.getLogger(__name__)
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_ATTRIB | IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+
+
+class JobWatch:
+    """Osserva le sorgenti di un job e raccoglie i percorsi modificati.
+
+    Gli eventi finiscono in un insieme di percorsi "sporchi"; il job viene
+    segnalato quando non arrivano eventi da debounce secondi (o comunque
+    dopo max_delay dal primo evento). Ogni reconcile_interval secondi, o se
+    la coda di inotify trabocca, viene chiesta una scansione completa.
+    """
+
+    def __init__(self, job_id, roots, file_filter, on_due, debounce, max_delay, reconcile_interval):
+        self.job_id = job_id
+        self.roots = roots
+        self.file_filter = file_filter
+        self.on_due = on_due
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.reconcile_interval = reconcile_interval
+        self.dirty = set()
+        self.full_needed = False
+        self._lock = threading.Lock()
+        self._first_event = None
+        self._last_event = None
+        self._signalled = False
+        self._next_reconcile = time.monotonic() + reconcile_interval
+        self._watches = {}
+        self._inotify = None
+        self._wake_read, self._wake_write = os.pipe()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name=f'backup-watch-{job_id}', daemon=True)
+
+    def start(self):
+        self._inotify = Inotify()
+        for root in self.roots:
+            self._watch_tree(root)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping = True
+        os.write(self._wake_write, b'x')
+        self._thread.join()
+        self._inotify.close()
+        os.close(self._wake_read)
+        os.close(self._wake_write)
+
+    def _watch_tree(self, root):
+        stack = [(root, self._rel_path(root))]
+        while stack:
+            path, rel_path = stack.pop()
+            try:
+                wd = self._inotify.add_watch(path, WATCH_MASK)
+            except OSError as e:
+                # Limite di fs.inotify.max_user_watches raggiunto o cartella sparita:
+                # quello che non si osserva lo recupera la scansione periodica
+                logger.warning("Cannot watch %s: %s", path, e)
+                continue
+            self._watches[wd] = path
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            child_rel = os.path.join(rel_path, entry.name) if rel_path else entry.name
+                            if not (self.file_filter and self.file_filter.exclude_dir(child_rel)):
+                                stack.append((entry.path, child_rel))
+            except NotADirectoryError:
+                pass
+            except OSError as e:
+                logger.warning("Cannot watch %s: %s", path, e)
+
+    def _rel_path(self, path):
+        for root in self.roots:
+            if path == root:
+                return ''
+            prefix = os.path.join(root, '')
+            if path.startswith(prefix):
+                return path[len(prefix):]
+        return ''
+
+    def _run(self):
+        poller = select.poll()
+        poller.register(self._inotify.fd, select.POLLIN)
+        poller.register(self._wake_read, select.POLLIN)
+        while not self._stopping:
+            ready = poller.poll(self._timeout() * 1000)
+            if self._stopping:
+                return
+            if any(fd == self._wake_read for fd, _ in ready):
+                os.read(self._wake_read, 64)
+            self._handle_events(self._inotify.read_events())
+            self._check_due()
+
+    def _timeout(self):
+        now = time.monotonic()
+        deadline = self._next_reconcile
+        with self._lock:
+            if self._last_event is not None and not self._signalled:
+                deadline = min(deadline, self._last_event + self.debounce,
+                               self._first_event + self.max_delay)
+        return max(deadline - now, 0.05)
+
+    def _handle_events(self, events):
+        if not events:
+            return
+        changed = set()
+        overflow = False
+        for wd, mask, cookie, name in events:
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, name) if name else directory
+            rel_path = self._rel_path(path)
+            if mask & IN_ISDIR:
+                if self.file_filter and rel_path and self.file_filter.exclude_dir(rel_path):
+                    continue
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Una cartella nuova (o spostata qui) va osservata e copiata per intero
+                    self._watch_tree(path)
+            changed.add(path)
+        now = time.monotonic()
+        with self._lock:
+            self.dirty.update(changed)
+            if overflow:
+                self.full_needed = True
+            if changed or overflow:
+                if self._first_event is None:
+                    self._first_event = now
+                self._last_event = now
+
+    def _check_due(self):
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_reconcile:
+                self.full_needed = True
+                self._next_reconcile = now + self.reconcile_interval
+            elif self._last_event is None or self._signalled:
+                return
+            elif now - self._last_event < self.debounce and now - self._first_event < self.max_delay:
+                return
+            self._signalled = True
+        self.on_due(self.job_id)
+
+    def take_changes(self):
+        """Percorsi da copiare, o None se serve una scansione completa."""
+        with self._lock:
+            changes = None if self.full_needed or not self.dirty else self.dirty
+            self.dirty = set()
+            self.full_needed = False
+            self._first_event = self._last_event = None
+            self._signalled = False
+            if changes is None:
+                self._next_reconcile = time.monotonic() + self.reconcile_interval
+            return changes
+
+    def run_finished(self):
+        # Le modifiche arrivate durante l'esecuzione erano state segnalate
+        # mentre il job girava, e la coda le ha scartate: si ricomincia a
+        # contare il debounce e il thread le segnala di nuovo
+        with self._lock:
+            self._signalled = False
+            pending = self._last_event is not None
+        if pending:
+            os.write(self._wake_write, b'x')
+
+    def restore_changes(self, changes):
+        # Non fa partire un'esecuzione: se la destinazione non e' raggiungibile
+        # si riprova alla prossima modifica o alla scansione periodica
+        with self._lock:
+            if changes is None:
+                self.full_needed = True
+            else:
+                self.dirty.update(changes)
+
+
+class ContinuousWatcher:
+    """Backup continuo: un JobWatch per ogni job con la modalita' attiva.
+
+    on_due(job_id) viene chiamato da un thread del watcher quando ci sono
+    modifiche da copiare o e' il momento della scansione di controllo,
+    come lo scheduler fa per gli orari pianificati.
+    """
+
+    def __init__(self, on_due, debounce=10, max_delay=120, reconcile_interval=3600):
+        self.on_due = on_due
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.reconcile_interval = reconcile_interval
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def available():
+        return inotify_available()
+
+    def set_job(self, job_id, roots, rules=()):
+        self.remove_job(job_id)
+        watch = JobWatch(job_id, list(roots), FileFilter(rules) or None, self.on_due, self.debounce,
+                         self.max_delay, self.reconcile_interval)
+        watch.start()
+        with self._lock:
+            self._jobs[job_id] = watch
+
+    def remove_job(self, job_id):
+        with self._lock:
+            watch = self._jobs.pop(job_id, None)
+        if watch is not None:
+            watch.stop()
+
+    def is_watching(self, job_id):
+        with self._lock:
+            return job_id in self._jobs
+
+    def take_changes(self, job_id):
+        """Percorsi cambiati dall'ultima esecuzione; None per una scansione completa."""
+        with self._lock:
+            watch = self._jobs.get(job_id)
+        return watch.take_changes() if watch is not None else None
+
+    def run_finished(self, job_id):
+        """Da chiamare a esecuzione terminata, dopo aver liberato il posto nella coda."""
+        with self._lock:
+            watch = self._jobs.get(job_id)
+        if watch is not None:
+            watch.run_finished()
+
+    def restore_changes(self, job_id, changes):
+        # Esecuzione fallita: le modifiche tornano nell'insieme da copiare
+        with self._lock:
+            watch = self._jobs.get(job_id)
+        if watch is not None:
+            watch.restore_changes(changes)
+
+    def request_full(self, job_id):
+        with self._lock:
+            watch = self._jobs.get(job_id)
+        if watch is not None:
+            watch.restore_changes(None)
+
+    def stop(self):
+        with self._lock:
+            jobs = list(self._jobs)
+        for job_id in jobs:
+            self.remove_job(job_id)
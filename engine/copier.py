@@ -0,0 +1,72 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class CopyPool:
+    """Pool di copia con limiti di concorrenza per dispositivo.
+
+    workers limita le copie totali in corso; per_source_device e
+    per_dest_device limitano quante di queste leggono dallo stesso disco
+    sorgente o scrivono sullo stesso disco di destinazione. submit() si
+    blocca quando tutti i posti sono occupati, cosi' lo scanner non
+    accumula lavoro in memoria.
+    """
+
+    def __init__(self, workers=4, per_source_device=None, per_dest_device=None):
+        self.workers = max(1, workers)
+        self.per_source_device = per_source_device or self.workers
+        self.per_dest_device = per_dest_device or self.workers
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='backup-copy')
+        self._slots = threading.BoundedSemaphore(self.workers * 2)
+        self._device_limits = {}
+        self._lock = threading.Lock()
+        self._error = None
+        self._cancelled = False
+
+    def _device_semaphore(self, kind, device, limit):
+        with self._lock:
+            semaphore = self._device_limits.get((kind, device))
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(limit)
+                self._device_limits[(kind, device)] = semaphore
+            return semaphore
+
+    def submit(self, task, src_device, dest_device, on_done=None):
+        """Esegue task() in un worker; on_done riceve il valore restituito."""
+        self.raise_error()
+        self._slots.acquire()
+        try:
+            self._executor.submit(self._run, task, src_device, dest_device, on_done)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _run(self, task, src_device, dest_device, on_done):
+        try:
+            if self._cancelled or self._error is not None:
+                return
+            # Ordine fisso sorgente -> destinazione per evitare deadlock
+            with self._device_semaphore('src', src_device, self.per_source_device):
+                with self._device_semaphore('dst', dest_device, self.per_dest_device):
+                    result = task()
+            if on_done:
+                on_done(result)
+        except BaseException as e:
+            with self._lock:
+                if self._error is None:
+                    self._error = e
+        finally:
+            self._slots.release()
+
+    def raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def cancel(self):
+        self._cancelled = True
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def join(self):
+        """Attende la fine di tutte le copie e rilancia il primo errore."""
+        self._executor.shutdown(wait=True)
+        self.raise_error()
@@ -0,0 +1,225 @@
+import errno
+import os
+import shutil
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# ioctl FICLONE di Linux (_IOW(0x94, 9, int)): clone copy-on-write su btrfs/xfs/...
+FICLONE = 0x40049409
+BUFFER_SIZE = 4 * 1024 * 1024
+# Blocchi per copy_file_range/sendfile: limitati per restare interrompibili
+CHUNK_SIZE = 64 * 1024 * 1024
+# I file vengono scritti con questo suffisso e rinominati solo quando completi
+TEMP_SUFFIX = '.pbtmp'
+# Sotto questa dimensione un file con pochi blocchi allocati non vale la
+# ricerca dei buchi (es. file piccoli salvati inline nei metadati)
+SPARSE_MIN_SIZE = 64 * 1024
+
+# Errori che indicano "metodo non supportato per questa coppia di file"
+_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP,
+                errno.ENOTTY, errno.EBADF, errno.ENOTSOCK, errno.EPERM}
+
+# Coppie di dispositivi (src_dev, dst_dev) su cui un metodo ha gia' fallito:
+# non ha senso ritentarlo per ogni file.
+_unsupported = set()
+_unsupported_lock = threading.Lock()
+
+
+def _mark_unsupported(method, devices):
+    with _unsupported_lock:
+        _unsupported.add((method, devices))
+
+
+def _supported(method, devices):
+    return (method, devices) not in _unsupported
+
+
+def _reflink(fsrc, fdst, size, progress):
+    if fcntl is None:
+        raise OSError(errno.ENOTSUP, 'FICLONE not available')
+    fcntl.ioctl(fdst, FICLONE, fsrc)
+
+
+def _copy_file_range(fsrc, fdst, size, progress):
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError(errno.ENOSYS, 'copy_file_range not available')
+    total = 0
+    while True:
+        copied = os.copy_file_range(fsrc, fdst, CHUNK_SIZE)
+        if copied == 0:
+            # Alcuni filesystem (FUSE, CIFS, procfs) restituiscono 0 invece
+            # di un errore: senza byte copiati si passa al metodo successivo
+            if total == 0 and size > 0:
+                raise OSError(errno.ENOTSUP, 'copy_file_range copied nothing')
+            return
+        total += copied
+        if progress:
+            progress(copied)
+
+
+def _sendfile(fsrc, fdst, size, progress):
+    if not hasattr(os, 'sendfile'):
+        raise OSError(errno.ENOSYS, 'sendfile not available')
+    total = 0
+    while True:
+        sent = os.sendfile(fdst, fsrc, None, CHUNK_SIZE)
+        if sent == 0:
+            # Come per copy_file_range: 0 alla prima chiamata non e' la fine del file
+            if total == 0 and size > 0:
+                raise OSError(errno.ENOTSUP, 'sendfile copied nothing')
+            return
+        total += sent
+        if progress:
+            progress(sent)
+
+
+def is_sparse(st):
+    """True se il file ha meno blocchi allocati della sua dimensione, cioe' contiene buchi."""
+    blocks = getattr(st, 'st_blocks', None)
+    return blocks is not None and st.st_size >= SPARSE_MIN_SIZE and blocks * 512 < st.st_size
+
+
+def allocated_size(st):
+    # Byte occupati sul disco; dove st_blocks non esiste coincide con la dimensione
+    blocks = getattr(st, 'st_blocks', None)
+    return st.st_size if blocks is None else blocks * 512
+
+
+def _sparse(fsrc, fdst, size, progress):
+    # Copia solo le estensioni di dati trovate con SEEK_DATA/SEEK_HOLE; i
+    # buchi restano non scritti e il troncamento finale ricrea quello in coda
+    if not hasattr(os, 'SEEK_DATA'):
+        raise OSError(errno.ENOSYS, 'SEEK_DATA not available')
+    offset = 0
+    while offset < size:
+        try:
+            data = os.lseek(fsrc, offset, os.SEEK_DATA)
+        except OSError as e:
+            # ENXIO: da offset alla fine c'e' solo un buco
+            if e.errno != errno.ENXIO:
+                raise
+            data = size
+        hole = min(os.lseek(fsrc, data, os.SEEK_HOLE), size) if data < size else size
+        if progress and data > offset:
+            progress(data - offset)
+        _copy_range(fsrc, fdst, data, hole - data, progress)
+        offset = hole
+    os.ftruncate(fdst, size)
+
+
+def _copy_range(fsrc, fdst, offset, length, progress):
+    end = offset + length
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while offset < end:
+                copied = os.copy_file_range(fsrc, fdst, min(CHUNK_SIZE, end - offset), offset, offset)
+                if copied == 0:
+                    # File accorciato o filesystem che non supporta la chiamata:
+                    # prosegue la lettura qui sotto, che si ferma a fine file
+                    break
+                offset += copied
+                if progress:
+                    progress(copied)
+            else:
+                return
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED:
+                raise
+    while offset < end:
+        data = os.pread(fsrc, min(BUFFER_SIZE, end - offset), offset)
+        if not data:
+            return
+        written = 0
+        while written < len(data):
+            written += os.pwrite(fdst, data[written:], offset + written)
+        offset += len(data)
+        if progress:
+            progress(len(data))
+
+
+def _userspace(fsrc, fdst, size, progress):
+    buffer = bytearray(min(BUFFER_SIZE, max(size, 1)))
+    view = memoryview(buffer)
+    while True:
+        if hasattr(os, 'readv'):
+            read = os.readv(fsrc, [buffer])
+        else:
+            chunk = os.read(fsrc, len(buffer))
+            read = len(chunk)
+            buffer[:read] = chunk
+        if not read:
+            return
+        written = 0
+        while written < read:
+            written += os.write(fdst, view[written:read])
+        if progress:
+            progress(read)
+
+
+_BACKENDS = (
+    ('reflink', _reflink),
+    ('copy_file_range', _copy_file_range),
+    ('sendfile', _sendfile),
+)
+# Per i file sparsi: reflink conserva gia' i buchi, poi la copia per estensioni
+_SPARSE_BACKENDS = (_BACKENDS[0], ('sparse', _sparse)) + _BACKENDS[1:]
+
+
+def copy_file(src, dest, progress=None):
+    """Copia src in dest con il metodo piu' veloce supportato e ne preserva i metadati.
+
+    Prova in ordine reflink (FICLONE), copy_file_range, sendfile e infine
+    una copia in userspace con un buffer grande. Per i file sparsi, dopo
+    reflink, si copiano solo le estensioni di dati e i buchi vengono
+    ricreati nella copia. La copia viene scritta in
+    un file temporaneo accanto a dest e rinominata al termine, quindi dest
+    non e' mai un file scritto a meta'. progress, se indicato, riceve i
+    byte copiati a ogni blocco. Restituisce il nome del metodo usato.
+    """
+    tmp_path = dest + TEMP_SUFFIX
+    try:
+        method = _copy_to(src, tmp_path, progress)
+        shutil.copystat(src, tmp_path)
+        os.replace(tmp_path, dest)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return method
+
+
+def _copy_to(src, dest, progress):
+    with open(src, 'rb') as fsrc, open(dest, 'wb') as fdst:
+        src_fd = fsrc.fileno()
+        dst_fd = fdst.fileno()
+        src_stat = os.fstat(src_fd)
+        devices = (src_stat.st_dev, os.fstat(dst_fd).st_dev)
+        method = 'userspace'
+        if src_stat.st_size == 0:
+            method = 'empty'
+        else:
+            for name, backend in (_SPARSE_BACKENDS if is_sparse(src_stat) else _BACKENDS):
+                if not _supported(name, devices):
+                    continue
+                try:
+                    backend(src_fd, dst_fd, src_stat.st_size, progress)
+                    method = name
+                    break
+                except OSError as e:
+                    if e.errno not in _UNSUPPORTED:
+                        raise
+                    _mark_unsupported(name, devices)
+                    # Ricomincia da capo: il metodo precedente puo' aver
+                    # scritto una parte del file prima di fallire
+                    os.lseek(src_fd, 0, os.SEEK_SET)
+                    os.lseek(dst_fd, 0, os.SEEK_SET)
+                    os.ftruncate(dst_fd, 0)
+            else:
+                _userspace(src_fd, dst_fd, src_stat.st_size, progress)
+    return method
@@ -0,0 +1,85 @@
+import hashlib
+import os
+import shutil
+import struct
+import zlib
+
+SIGNATURE_MAGIC = b'PBSIG1\n'
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+_HEADER = struct.Struct('<IQ')
+_BLOCK = struct.Struct('<I16s')
+
+
+def block_checksums(data):
+    # Adler-32 e' il checksum debole (rolling) di rsync, blake2b quello forte
+    return zlib.adler32(data), hashlib.blake2b(data, digest_size=16).digest()
+
+
+def read_signature(sig_path):
+    """Legge la firma di una copia: (block_size, size, [(weak, strong), ...]) o None."""
+    try:
+        with open(sig_path, 'rb') as f:
+            if f.read(len(SIGNATURE_MAGIC)) != SIGNATURE_MAGIC:
+                return None
+            block_size, size = _HEADER.unpack(f.read(_HEADER.size))
+            data = f.read()
+    except (OSError, struct.error):
+        return None
+    if len(data) % _BLOCK.size:
+        return None
+    blocks = [_BLOCK.unpack_from(data, offset) for offset in range(0, len(data), _BLOCK.size)]
+    return block_size, size, blocks
+
+
+def write_signature(sig_path, block_size, size, blocks):
+    os.makedirs(os.path.dirname(sig_path), exist_ok=True)
+    tmp_path = sig_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(SIGNATURE_MAGIC)
+        f.write(_HEADER.pack(block_size, size))
+        f.write(b''.join(_BLOCK.pack(weak, strong) for weak, strong in blocks))
+    os.replace(tmp_path, sig_path)
+
+
+def delta_update(src, dest, sig_path, block_size=DEFAULT_BLOCK_SIZE, progress=None):
+    """Aggiorna dest riscrivendo solo i blocchi di src diversi dalla copia precedente.
+
+    I checksum dei blocchi della copia precedente sono nel file sig_path,
+    quindi la destinazione non viene mai riletta. Senza una firma valida
+    (o con dest mancante) il file viene riscritto per intero. Restituisce
+    i byte scritti sulla destinazione.
+    """
+    signature = read_signature(sig_path) if os.path.exists(dest) else None
+    if signature is not None and signature[0] != block_size:
+        signature = None
+    old_blocks = signature[2] if signature else []
+
+    # Senza firma un'interruzione lascerebbe dest e firma disallineati:
+    # la firma vecchia si rimuove prima di toccare la destinazione.
+    if signature is not None:
+        os.remove(sig_path)
+
+    new_blocks = []
+    written = 0
+    with open(src, 'rb') as fsrc, open(dest, 'r+b' if signature else 'wb') as fdst:
+        index = 0
+        while True:
+            data = fsrc.read(block_size)
+            if not data:
+                break
+            checksums = block_checksums(data)
+            new_blocks.append(checksums)
+            if index >= len(old_blocks) or old_blocks[index] != checksums:
+                fdst.seek(index * block_size)
+                fdst.write(data)
+                written += len(data)
+            if progress:
+                progress(len(data))
+            index += 1
+        size = fsrc.tell()
+        fdst.truncate(size)
+
+    # Permessi e date come nella copia completa (copy_file)
+    shutil.copystat(src, dest)
+    write_signature(sig_path, block_size, size, new_blocks)
+    return written
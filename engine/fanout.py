@@ -0,0 +1,283 @@
+import logging
+import os
+import queue
+import shutil
+import threading
+
+from engine.copy_backend import TEMP_SUFFIX, is_sparse
+
+logger = logging.getLogger(__name__)
+
+BLOCK_SIZE = 4 * 1024 * 1024
+# Blocchi in attesa per ogni destinazione: la piu' lenta frena la lettura
+# invece di accumulare il file in memoria
+QUEUE_BLOCKS = 4
+_EOF = object()
+
+
+class Sink:
+    """Una delle destinazioni di un TeeDestination, con il suo esito."""
+
+    def __init__(self, destination, folder, lagging=False):
+        self.destination = destination
+        self.folder = folder
+        # Una destinazione rimasta indietro (ultima esecuzione fallita) non
+        # puo' fidarsi del manifest: confronta i file con le proprie copie
+        self.lagging = lagging
+        self.opened = False
+        self.failed = False
+        self.error = None
+        self.files_written = 0
+        self.bytes_written = 0
+        self._lock = threading.Lock()
+
+    def fail(self, error):
+        with self._lock:
+            if not self.failed:
+                self.failed = True
+                self.error = str(error)
+                logger.error("Destination %s disabled for this run: %s", self.folder, error)
+
+    def count(self, size):
+        with self._lock:
+            self.files_written += 1
+            self.bytes_written += size
+
+    def result(self):
+        return {'folder': self.folder, 'success': not self.failed, 'error': self.error,
+                'files_written': self.files_written, 'bytes_written': self.bytes_written}
+
+
+class _BlockWriter(threading.Thread):
+    # Scrive in un file temporaneo i blocchi letti una volta sola dal sorgente
+    def __init__(self, path):
+        super().__init__(name='backup-tee', daemon=True)
+        self.path = path
+        self.blocks = queue.Queue(maxsize=QUEUE_BLOCKS)
+        self.error = None
+
+    def run(self):
+        try:
+            with open(self.path, 'wb') as f:
+                while True:
+                    block = self.blocks.get()
+                    if block is _EOF:
+                        return
+                    f.write(block)
+        except OSError as e:
+            self.error = e
+            # Svuota la coda per non bloccare chi legge
+            while self.blocks.get() is not _EOF:
+                pass
+
+
+class TeeDestination:
+    """Scrive ogni file in piu' destinazioni dello stesso formato leggendolo una sola volta.
+
+    La prima destinazione e' quella principale del job: un suo errore fa
+    fallire l'esecuzione come prima. Un errore su una destinazione
+    aggiuntiva la esclude per il resto dell'esecuzione, senza fermare le
+    altre; la volta successiva quella destinazione viene riallineata
+    confrontando i file con le proprie copie. Per mirror e snapshot i
+    blocchi letti dal sorgente vanno a tutte le destinazioni in parallelo;
+    gli altri formati rileggono il file per ogni destinazione (di solito
+    dalla cache del sistema operativo).
+    """
+
+    def __init__(self, sinks):
+        self.sinks = sinks
+        self.primary = sinks[0].destination
+        # Il journal dei checkpoint salta i file senza chiedere alle
+        # destinazioni: non va usato finche' una di esse e' indietro
+        self.resumable = self.primary.resumable and not any(sink.lagging for sink in sinks)
+        # percorso sorgente -> destinazioni che devono scrivere il file; il
+        # rel_path non basta: due sorgenti possono avere file con lo stesso nome
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # resumable, backup_folder, snapshot_path, files... sono quelli della principale
+        return getattr(self.primary, name)
+
+    def _active(self):
+        return [sink for sink in self.sinks if not sink.failed]
+
+    def _run_on(self, sink, action):
+        # Esegue action sulla destinazione; per le aggiuntive un errore la esclude
+        try:
+            return action(sink.destination)
+        except OSError as e:
+            if sink is self.sinks[0]:
+                raise
+            sink.fail(e)
+            return None
+
+    def open(self):
+        self.primary.open()
+        self.sinks[0].opened = True
+        for sink in self.sinks[1:]:
+            self._run_on(sink, lambda destination: destination.open())
+            sink.opened = not sink.failed
+
+    def needs_copy(self, entry, previous):
+        needed = []
+        unneeded = []
+        for sink in self._active():
+            result = self._run_on(sink, lambda destination: destination.needs_copy(
+                entry, None if sink.lagging else previous))
+            (needed if result else unneeded).append(sink)
+        if not needed:
+            return False
+        # Chi ha gia' il file lo registra come invariato, come se il motore l'avesse saltato
+        for sink in unneeded:
+            if not sink.failed:
+                self._run_on(sink, lambda destination: destination.skip(entry))
+        with self._lock:
+            self._pending[entry.path] = needed
+        return True
+
+    def prepare(self, entry):
+        for sink in self._pending[entry.path]:
+            self._run_on(sink, lambda destination: destination.prepare(entry))
+
+    def skip(self, entry):
+        for sink in self._active():
+            self._run_on(sink, lambda destination: destination.skip(entry))
+
+    def write(self, entry, progress=None):
+        with self._lock:
+            targets = [sink for sink in self._pending.pop(entry.path) if not sink.failed]
+        streamed = []
+        others = []
+        # I file sparsi passano da copy_file, che salta i buchi invece di leggerli come zeri
+        stream = not is_sparse(entry.stat)
+        for sink in targets:
+            path = self._run_on(sink, lambda destination: destination.stream_path(entry)
+                                if stream and hasattr(destination, 'stream_path') else None)
+            if path:
+                streamed.append((sink, path))
+            else:
+                others.append(sink)
+        if len(streamed) < 2:
+            # Con una sola destinazione che accetta i blocchi conviene la sua
+            # write(), che puo' usare reflink e copy_file_range
+            others = [sink for sink, path in streamed] + others
+            streamed = []
+
+        results = {}
+        if streamed:
+            self._tee_copy(entry, streamed, progress)
+            progress = None
+            for sink, path in streamed:
+                if not sink.failed:
+                    results[sink] = ('tee', entry.stat.st_size)
+        for sink in others:
+            result = self._run_on(sink, lambda destination: destination.write(entry, progress))
+            progress = None
+            if result is not None:
+                sink.count(result[1])
+                results[sink] = result
+        # Nelle statistiche conta la scrittura sulla destinazione principale
+        if self.sinks[0] in results:
+            return results[self.sinks[0]]
+        return next(iter(results.values()), ('tee', 0))
+
+    def _tee_copy(self, entry, streamed, progress):
+        tmp_paths = [path + TEMP_SUFFIX for sink, path in streamed]
+        try:
+            if entry.stat.st_size <= BLOCK_SIZE:
+                errors = self._write_small(entry, tmp_paths, progress)
+            else:
+                errors = self._write_blocks(entry, tmp_paths, progress)
+        except BaseException:
+            # Lettura del sorgente fallita: vale per tutte le destinazioni
+            for tmp_path in tmp_paths:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            raise
+        # L'errore della principale si rilancia solo alla fine, dopo aver
+        # chiuso i file temporanei di tutte le destinazioni
+        primary_error = None
+        for (sink, path), tmp_path, error in zip(streamed, tmp_paths, errors):
+            try:
+                if error is not None:
+                    raise error
+                shutil.copystat(entry.path, tmp_path)
+                os.replace(tmp_path, path)
+                sink.count(entry.stat.st_size)
+            except OSError as e:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                if sink is self.sinks[0]:
+                    primary_error = e
+                else:
+                    sink.fail(e)
+        if primary_error is not None:
+            raise primary_error
+
+    def _write_small(self, entry, tmp_paths, progress):
+        # Un file piccolo si legge tutto e si scrive in sequenza: un thread
+        # per destinazione costerebbe piu' della copia
+        with open(entry.path, 'rb') as src:
+            data = src.read()
+        errors = []
+        for tmp_path in tmp_paths:
+            try:
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                errors.append(None)
+            except OSError as e:
+                errors.append(e)
+        if progress:
+            progress(len(data))
+        return errors
+
+    def _write_blocks(self, entry, tmp_paths, progress):
+        writers = [_BlockWriter(tmp_path) for tmp_path in tmp_paths]
+        for writer in writers:
+            writer.start()
+        try:
+            with open(entry.path, 'rb') as src:
+                while True:
+                    block = src.read(BLOCK_SIZE)
+                    if not block:
+                        break
+                    for writer in writers:
+                        if writer.error is None:
+                            writer.blocks.put(block)
+                    if progress:
+                        progress(len(block))
+        finally:
+            for writer in writers:
+                writer.blocks.put(_EOF)
+            for writer in writers:
+                writer.join()
+        return [writer.error for writer in writers]
+
+    def move(self, old_rel_path, new_rel_path):
+        # Riuscito solo se riesce ovunque: altrimenti il motore copia il
+        # file e le destinazioni che l'hanno gia' spostato lo saltano
+        moved = [self._run_on(sink, lambda destination: destination.move(old_rel_path, new_rel_path))
+                 for sink in self._active()]
+        return all(moved)
+
+    def delete(self, rel_paths):
+        for sink in self._active():
+            self._run_on(sink, lambda destination: destination.delete(rel_paths))
+
+    def verify_target(self, rel_path):
+        return self.primary.verify_target(rel_path)
+
+    def close(self, success):
+        # Una destinazione che non si e' aperta non ha nulla da chiudere
+        for sink in self.sinks[1:]:
+            if sink.opened:
+                self._run_on(sink, lambda destination: destination.close(success and not sink.failed))
+        self.primary.close(success)
+
+    def results(self):
+        return [sink.result() for sink in self.sinks]
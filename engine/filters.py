@@ -0,0 +1,132 @@
+import re
+import time
+
+_SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+_AGE_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400}
+_PREDICATE = re.compile(r'^(size|age)\s*([<>])\s*(\d+(?:\.\d+)?)\s*([A-Za-z]?)[bB]?$')
+# Solo queste righe sono predicati: 'agenda/' o 'sizes.txt' restano glob
+_PREDICATE_START = re.compile(r'^(size|age)\s*[<>]')
+
+
+def _glob_to_regex(glob):
+    # Traduzione delle glob in stile .gitignore: '*' e '?' non attraversano
+    # le cartelle, '**' si'
+    out = []
+    i = 0
+    while i < len(glob):
+        c = glob[i]
+        if glob.startswith('**/', i):
+            out.append('(?:.*/)?')
+            i += 3
+            continue
+        if glob.startswith('**', i):
+            out.append('.*')
+            i += 2
+            continue
+        if c == '*':
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            end = glob.find(']', i + 1)
+            if end < 0:
+                out.append(re.escape(c))
+            else:
+                body = glob[i + 1:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                out.append('[' + body.replace('\\', '\\\\') + ']')
+                i = end
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return ''.join(out)
+
+
+class _PatternRule:
+    __slots__ = ('regex', 'negate', 'dir_only')
+
+    def __init__(self, pattern):
+        self.negate = pattern.startswith('!')
+        if self.negate:
+            pattern = pattern[1:]
+        self.dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        # Con una '/' iniziale o interna la regola e' relativa alla radice,
+        # altrimenti vale per il nome a qualsiasi profondita'
+        anchored = '/' in pattern
+        pattern = pattern.lstrip('/')
+        prefix = '' if anchored else '(?:.*/)?'
+        self.regex = re.compile(prefix + _glob_to_regex(pattern) + r'\Z', re.DOTALL)
+
+
+class _PredicateRule:
+    __slots__ = ('field', 'greater', 'value')
+
+    def __init__(self, field, op, number, unit):
+        self.field = field
+        self.greater = op == '>'
+        if field == 'size':
+            self.value = float(number) * _SIZE_UNITS[unit.upper()]
+        else:
+            self.value = float(number) * _AGE_UNITS[(unit or 'd').lower()]
+
+    def matches(self, st, now):
+        value = st.st_size if self.field == 'size' else now - st.st_mtime
+        return value > self.value if self.greater else value < self.value
+
+
+def parse_rules(lines):
+    """Verifica le regole e restituisce quelle non vuote; ValueError se una non e' valida."""
+    rules = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if _PREDICATE_START.match(line):
+            match = _PREDICATE.match(line)
+            if not match or (match.group(1) == 'size' and match.group(4).upper() not in _SIZE_UNITS) \
+                    or (match.group(1) == 'age' and (match.group(4) or 'd').lower() not in _AGE_UNITS):
+                raise ValueError(f"Regola non valida: {line}")
+        rules.append(line)
+    return rules
+
+
+class FileFilter:
+    """Regole di inclusione/esclusione di un job, compilate una sola volta.
+
+    Regole in stile .gitignore (l'ultima che corrisponde vince, '!'
+    reinclude, '/' finale solo cartelle) piu' predicati sui file come
+    'size>1G' o 'age>30d'. Le cartelle escluse vengono scartate dallo
+    scanner senza essere lette.
+    """
+
+    def __init__(self, rules):
+        self.patterns = []
+        self.predicates = []
+        for rule in parse_rules(rules):
+            match = _PREDICATE.match(rule)
+            if match:
+                self.predicates.append(_PredicateRule(*match.groups()))
+            else:
+                self.patterns.append(_PatternRule(rule))
+        self._now = time.time()
+
+    def __bool__(self):
+        return bool(self.patterns or self.predicates)
+
+    def _excluded(self, rel_path, is_dir):
+        for rule in reversed(self.patterns):
+            if rule.dir_only and not is_dir:
+                continue
+            if rule.regex.match(rel_path):
+                return not rule.negate
+        return False
+
+    def exclude_dir(self, rel_path):
+        return self._excluded(rel_path.replace('\\', '/'), True)
+
+    def exclude_file(self, rel_path, st):
+        if self._excluded(rel_path.replace('\\', '/'), False):
+            return True
+        return any(predicate.matches(st, self._now) for predicate in self.predicates)
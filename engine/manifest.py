@@ -0,0 +1,62 @@
+from sqlalchemy import delete, insert, select, update
+
+from db.models import FileManifest
+
+
+class ManifestRecord:
+    __slots__ = ('id', 'size', 'mtime_ns', 'inode', 'hash')
+
+    def __init__(self, id, size, mtime_ns, inode, hash=None):
+        self.id = id
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.inode = inode
+        self.hash = hash
+
+    def matches(self, st):
+        return (self.size == st.st_size and self.mtime_ns == st.st_mtime_ns
+                and (not self.inode or not st.st_ino or self.inode == st.st_ino))
+
+
+def load_manifest(session, backup_job_id):
+    """Carica il manifest del job come dizionario path -> ManifestRecord."""
+    rows = session.execute(
+        select(FileManifest.id, FileManifest.path, FileManifest.size,
+               FileManifest.mtime_ns, FileManifest.inode, FileManifest.hash)
+        .where(FileManifest.backup_job_id == backup_job_id)
+    )
+    return {path: ManifestRecord(id, size, mtime_ns, inode, hash)
+            for id, path, size, mtime_ns, inode, hash in rows}
+
+
+def save_manifest(session, backup_job_id, previous, current):
+    """Allinea il manifest salvato allo stato dell'ultima esecuzione.
+
+    previous e' il dizionario restituito da load_manifest, current il
+    dizionario path -> ManifestRecord prodotto dal motore. Vengono scritte
+    solo le differenze.
+    """
+    to_insert = []
+    to_update = []
+    for path, record in current.items():
+        old = previous.get(path)
+        if old is None:
+            to_insert.append({'backup_job_id': backup_job_id, 'path': path, 'size': record.size,
+                              'mtime_ns': record.mtime_ns, 'inode': record.inode, 'hash': record.hash})
+        elif (old.size, old.mtime_ns, old.inode, old.hash) != (record.size, record.mtime_ns,
+                                                               record.inode, record.hash):
+            to_update.append({'id': old.id, 'size': record.size, 'mtime_ns': record.mtime_ns,
+                              'inode': record.inode, 'hash': record.hash})
+    removed = [old.id for path, old in previous.items() if path not in current]
+
+    if to_insert:
+        session.execute(insert(FileManifest), to_insert)
+    if to_update:
+        session.execute(update(FileManifest), to_update)
+    for start in range(0, len(removed), 500):
+        session.execute(delete(FileManifest).where(FileManifest.id.in_(removed[start:start + 500])))
+    session.commit()
+
+
+def clear_manifest(session, backup_job_id):
+    session.execute(delete(FileManifest).where(FileManifest.backup_job_id == backup_job_id))
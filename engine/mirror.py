@@ -0,0 +1,145 @@
+import os
+
+from engine.copy_backend import copy_file
+from engine.delta import DEFAULT_BLOCK_SIZE, delta_update
+
+
+class MirrorDestination:
+    """Copia semplice dei file sotto <dest_folder>/backup.
+
+    Le destinazioni espongono tutte la stessa interfaccia usata dal motore:
+    open() prima della scansione, needs_copy()/prepare()/skip() dal thread
+    principale, write() dai worker del pool e close() alla fine.
+    """
+    name = 'mirror'
+    # Un'esecuzione interrotta puo' riprendere dal journal dei checkpoint
+    resumable = True
+
+    def __init__(self, dest_folder, delta_threshold=None, delta_block_size=DEFAULT_BLOCK_SIZE,
+                 propagate_deletions=False):
+        self.dest_root = dest_folder
+        self.backup_folder = os.path.join(dest_folder, 'backup')
+        # Se attivo, il motore rimuove (o sposta) le copie dei file spariti dalla sorgente
+        self.propagate_deletions = propagate_deletions
+        # I file piu' grandi di delta_threshold byte vengono aggiornati a blocchi
+        self.delta_threshold = delta_threshold
+        self.delta_block_size = delta_block_size
+        self.device = None
+        self._created_dirs = set()
+
+    def open(self):
+        os.makedirs(self.backup_folder, exist_ok=True)
+        self._created_dirs.add(self.backup_folder)
+        self.device = os.stat(self.backup_folder).st_dev
+
+    def dest_path(self, rel_path):
+        return os.path.join(self.backup_folder, rel_path)
+
+    def needs_copy(self, entry, previous):
+        # I file gia' presenti nel manifest si decidono senza toccare la
+        # destinazione; solo quelli nuovi vengono confrontati con la copia
+        # esistente (es. primo backup su una destinazione gia' popolata).
+        if previous is not None:
+            return not previous.matches(entry.stat)
+        try:
+            dest_stat = os.stat(self.dest_path(entry.rel_path))
+        except FileNotFoundError:
+            return True
+        return (entry.stat.st_size != dest_stat.st_size
+                or entry.stat.st_mtime_ns > dest_stat.st_mtime_ns)
+
+    def prepare(self, entry):
+        self._prepare_path(self.dest_path(entry.rel_path))
+
+    def _prepare_path(self, dest_file):
+        dest_dir = os.path.dirname(dest_file)
+        if dest_dir not in self._created_dirs:
+            os.makedirs(dest_dir, exist_ok=True)
+            self._created_dirs.add(dest_dir)
+
+    def skip(self, entry):
+        pass
+
+    def write(self, entry, progress=None):
+        """Copia un file e restituisce (metodo usato, byte scritti).
+
+        progress, se indicato, riceve i byte elaborati man mano.
+        """
+        dest_file = self.dest_path(entry.rel_path)
+        if self.delta_threshold is None:
+            return copy_file(entry.path, dest_file, progress), entry.stat.st_size
+        sig_path = self._signature_path(entry.rel_path)
+        if entry.stat.st_size >= self.delta_threshold:
+            return 'delta', delta_update(entry.path, dest_file, sig_path, self.delta_block_size,
+                                         progress)
+        self._drop_signature(entry.rel_path)
+        return copy_file(entry.path, dest_file, progress), entry.stat.st_size
+
+    def stream_path(self, entry):
+        """Percorso finale di una copia intera, da scrivere con i blocchi letti da TeeDestination.
+
+        None se il file va aggiornato a blocchi con write().
+        """
+        if self.delta_threshold is not None:
+            if entry.stat.st_size >= self.delta_threshold:
+                return None
+            self._drop_signature(entry.rel_path)
+        return self.dest_path(entry.rel_path)
+
+    def _drop_signature(self, rel_path):
+        # Una firma rimasta da quando il file era piu' grande non
+        # descriverebbe piu' la nuova copia
+        try:
+            os.remove(self._signature_path(rel_path))
+        except FileNotFoundError:
+            pass
+
+    def move(self, old_rel_path, new_rel_path):
+        """Sposta la copia di un file rinominato alla sorgente; restituisce False se non c'e' piu'."""
+        new_path = self.dest_path(new_rel_path)
+        self._prepare_path(new_path)
+        try:
+            os.replace(self.dest_path(old_rel_path), new_path)
+        except FileNotFoundError:
+            return False
+        try:
+            new_sig = self._signature_path(new_rel_path)
+            os.makedirs(os.path.dirname(new_sig), exist_ok=True)
+            os.replace(self._signature_path(old_rel_path), new_sig)
+        except FileNotFoundError:
+            pass
+        self._prune_empty_dirs({os.path.dirname(self.dest_path(old_rel_path))})
+        return True
+
+    def delete(self, rel_paths):
+        """Rimuove le copie dei file eliminati alla sorgente e le cartelle rimaste vuote."""
+        dirs = set()
+        for rel_path in rel_paths:
+            dest_file = self.dest_path(rel_path)
+            for path in (dest_file, self._signature_path(rel_path)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            dirs.add(os.path.dirname(dest_file))
+        self._prune_empty_dirs(dirs)
+
+    def _prune_empty_dirs(self, dirs):
+        # Dalle cartelle piu' profonde verso la radice, fermandosi alla prima non vuota
+        for directory in sorted(dirs, key=len, reverse=True):
+            while directory != self.backup_folder and directory.startswith(self.backup_folder):
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    break
+                self._created_dirs.discard(directory)
+                directory = os.path.dirname(directory)
+
+    def verify_target(self, rel_path):
+        return 'file', self.dest_path(rel_path)
+
+    def _signature_path(self, rel_path):
+        return os.path.join(self.dest_root, '.signatures', rel_path + '.sig')
+
+    def close(self, success):
+        pass
@@ -0,0 +1,154 @@
+import logging
+import queue
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+
+logger = logging.getLogger(__name__)
+
+
+def format_stats(stats):
+    if not stats:
+        return ""
+    lines = [
+        f"File analizzati: {stats.get('files_scanned', 0)}",
+        f"File copiati: {stats.get('files_copied', 0)}",
+        f"File invariati: {stats.get('files_skipped', 0) + stats.get('files_linked', 0)}",
+        f"Dati copiati: {stats.get('bytes_copied', 0) / 1024 / 1024:.1f} MB",
+    ]
+    if stats.get('files_moved') or stats.get('files_deleted'):
+        lines.append(f"File spostati: {stats.get('files_moved', 0)}, eliminati: {stats.get('files_deleted', 0)}")
+    if stats.get('files_sparse'):
+        lines.append(f"File sparsi: {stats['files_sparse']} "
+                     f"({stats.get('bytes_allocated', 0) / 1024 / 1024:.1f} MB allocati su "
+                     f"{stats.get('bytes_apparent', 0) / 1024 / 1024:.1f} MB)")
+    lines.append(f"Errori: {stats.get('errors', 0)}")
+    copy_seconds = stats.get('phase_seconds', {}).get('copy')
+    if copy_seconds:
+        lines.append(f"Durata: {copy_seconds:.0f} s "
+                     f"({stats.get('bytes_copied', 0) / 1024 / 1024 / copy_seconds:.1f} MB/s)")
+    return "\n".join(lines)
+
+
+def build_message(sender, recipients, success, job_name=None, stats=None):
+    message = EmailMessage()
+    subject = "Backup Completed" if success else "Backup Failed"
+    message["Subject"] = f"{subject}: {job_name}" if job_name else subject
+    message["From"] = sender
+    message["To"] = ", ".join(recipients)
+    text = "Your backup has completed successfully." if success else "Your backup has failed."
+    summary = format_stats(stats)
+    message.set_content(f"{text}\n\n{summary}" if summary else text)
+    return message
+
+
+class NotificationDispatcher:
+    """Invio delle email di notifica in un thread separato.
+
+    I messaggi vengono accodati e spediti a gruppi: una sola connessione
+    (e un solo login) per tutti i messaggi presenti in coda, un messaggio
+    per backup indirizzato a tutti i destinatari. In caso di errore il
+    gruppo viene ritentato con attese crescenti. Il mittente e' sender o,
+    se manca, user; senza nessuno dei due le notifiche sono disattivate.
+    """
+
+    def __init__(self, host, port, user=None, password=None, use_ssl=True, timeout=30,
+                 max_retries=3, backoff=5, sender=None):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.sender = sender or user
+        self.password = password
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        if not self.sender:
+            logger.warning("Email notifications disabled: set EMAIL_FROM or EMAIL_USER")
+            return
+        self._thread = threading.Thread(target=self._run, name='backup-notifications', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join()
+
+    def notify(self, recipients, success, job_name=None, stats=None):
+        recipients = [address.strip() for address in recipients if address and address.strip()]
+        if not recipients or not self.sender:
+            return
+        self._queue.put(build_message(self.sender, recipients, success, job_name, stats))
+
+    def _run(self):
+        while True:
+            message = self._queue.get()
+            if message is None:
+                return
+            batch = [message]
+            # Raccoglie tutto quello che e' gia' in coda per usare una sola connessione
+            stop = False
+            while True:
+                try:
+                    message = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if message is None:
+                    stop = True
+                    break
+                batch.append(message)
+            self._send_with_retry(batch)
+            if stop:
+                return
+
+    def _send_with_retry(self, batch):
+        count = len(batch)
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                self._send_batch(batch)
+                logger.info("Sent %d notification emails in %.2fs", count, time.perf_counter() - started)
+                return
+            except (smtplib.SMTPException, OSError) as e:
+                if attempt == self.max_retries:
+                    logger.error("Failed to send email: %s", e)
+                    return
+                delay = self.backoff * 2 ** attempt
+                logger.warning("Failed to send email (%s), retrying in %ss", e, delay)
+                time.sleep(delay)
+
+    def _connect(self):
+        if self.use_ssl:
+            server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if not self.use_ssl:
+                # Senza SSL la connessione passa a TLS prima del login: le
+                # credenziali non devono mai viaggiare in chiaro
+                server.ehlo()
+                if server.has_extn('starttls'):
+                    server.starttls()
+                    server.ehlo()
+                elif self.user and self.password:
+                    raise smtplib.SMTPNotSupportedError(
+                        "SMTP server does not support STARTTLS: refusing to send credentials unencrypted")
+            if self.user and self.password:
+                server.login(self.user, self.password)
+        except BaseException:
+            server.close()
+            raise
+        return server
+
+    def _send_batch(self, batch):
+        # I messaggi gia' spediti vengono tolti dal gruppo, cosi' un nuovo
+        # tentativo non li invia due volte
+        with self._connect() as server:
+            while batch:
+                server.send_message(batch[0])
+                del batch[0]
@@ -0,0 +1,152 @@
+import collections
+import threading
+import time
+
+# Peso di ogni file nella percentuale, in byte equivalenti: anche i file
+# piccoli o invariati hanno un costo (apertura, stat, metadati)
+FILE_COST = 64 * 1024
+
+
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    return f"{hours}:{rest // 60:02d}:{rest % 60:02d}" if hours else f"{rest // 60}:{rest % 60:02d}"
+
+
+class ProgressSnapshot:
+    """Stato dell'avanzamento in un istante, passato alla callback di progress."""
+    __slots__ = ('percent', 'files_done', 'files_total', 'bytes_done', 'bytes_total',
+                 'throughput', 'eta', 'current_file', 'scan_complete')
+
+    def __init__(self, percent, files_done, files_total, bytes_done, bytes_total, throughput, eta,
+                 current_file, scan_complete):
+        self.percent = percent
+        self.files_done = files_done
+        self.files_total = files_total
+        self.bytes_done = bytes_done
+        self.bytes_total = bytes_total
+        # Byte al secondo negli ultimi secondi, None finche' non e' misurabile
+        self.throughput = throughput
+        # Secondi mancanti, None finche' la scansione non e' completa
+        self.eta = eta
+        self.current_file = current_file
+        self.scan_complete = scan_complete
+
+    def describe(self):
+        text = (f"{self.files_done}/{self.files_total} file, "
+                f"{format_bytes(self.bytes_done)} di {format_bytes(self.bytes_total)}")
+        if self.throughput:
+            text += f", {format_bytes(self.throughput)}/s"
+        if self.eta is not None:
+            text += f", mancano {format_duration(self.eta)}"
+        elif not self.scan_complete:
+            text += ", scansione in corso"
+        return text
+
+
+class ProgressTracker:
+    """Raccoglie l'avanzamento dai worker e lo notifica a frequenza fissa.
+
+    I contatori vengono aggiornati a ogni file (o blocco copiato) ma la
+    callback viene chiamata da un thread dedicato al massimo ogni interval
+    secondi, e solo se qualcosa e' cambiato: la GUI riceve pochi segnali
+    anche con centinaia di migliaia di file. La percentuale si basa sui
+    byte da copiare piu' un costo fisso per file, non torna mai indietro e
+    resta sotto il 100% finche' la scansione non e' completa.
+    """
+
+    def __init__(self, callback=None, interval=0.25, window=5.0):
+        self.callback = callback
+        self.interval = interval
+        self.window = window
+        self.files_total = 0
+        self.files_done = 0
+        self.bytes_total = 0
+        self.bytes_done = 0
+        self.current_file = None
+        self.scan_complete = False
+        self._lock = threading.Lock()
+        self._changed = False
+        self._last_percent = 0
+        self._samples = collections.deque()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._samples.append((time.monotonic(), 0))
+        if self.callback is not None:
+            self._thread = threading.Thread(target=self._run, name='backup-progress', daemon=True)
+            self._thread.start()
+
+    def stop(self, report=True):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if report:
+            self._report()
+
+    def add_total(self, files=0, size=0):
+        with self._lock:
+            self.files_total += files
+            self.bytes_total += size
+            self._changed = True
+
+    def add_done(self, files=0, size=0, current_file=None):
+        with self._lock:
+            self.files_done += files
+            self.bytes_done += size
+            if current_file is not None:
+                self.current_file = current_file
+            self._changed = True
+
+    def finish_scan(self):
+        with self._lock:
+            self.scan_complete = True
+            self._changed = True
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            self._changed = False
+            done = self.bytes_done + self.files_done * FILE_COST
+            total = self.bytes_total + self.files_total * FILE_COST
+            if total == 0:
+                percent = 100 if self.scan_complete else 0
+            else:
+                percent = int(done / total * 100)
+                if not self.scan_complete:
+                    percent = min(percent, 99)
+            self._last_percent = percent = max(self._last_percent, percent)
+
+            # Velocita' sulla finestra degli ultimi secondi
+            self._samples.append((now, self.bytes_done))
+            while len(self._samples) > 2 and now - self._samples[1][0] >= self.window:
+                self._samples.popleft()
+            first_time, first_bytes = self._samples[0]
+            throughput = None
+            if now - first_time >= 1:
+                throughput = (self.bytes_done - first_bytes) / (now - first_time)
+            eta = None
+            if self.scan_complete and throughput:
+                eta = max(self.bytes_total - self.bytes_done, 0) / throughput
+            return ProgressSnapshot(percent, self.files_done, self.files_total, self.bytes_done,
+                                    self.bytes_total, throughput, eta, self.current_file,
+                                    self.scan_complete)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self._changed:
+                self._report()
+
+    def _report(self):
+        if self.callback is not None:
+            self.callback(self.snapshot())
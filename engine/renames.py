@@ -0,0 +1,51 @@
+# Sotto questa dimensione rileggere il file per l'hash costa quanto copiarlo
+HASH_MATCH_MIN_SIZE = 1024 * 1024
+
+
+class RenameIndex:
+    """Riconosce i file nuovi che sono file del manifest spostati o rinominati.
+
+    Un file nuovo e' un candidato se ha inode, dimensione e mtime di un file
+    del manifest; senza inode corrispondente (es. spostato tra due dischi)
+    basta la stessa dimensione e mtime piu' lo stesso hash registrato. Lo
+    spostamento si conferma solo a scansione finita, quando si sa che il
+    vecchio percorso non esiste piu'.
+    """
+
+    def __init__(self, manifest):
+        self.by_identity = {}
+        self.by_content = {}
+        for path, record in manifest.items():
+            if record.inode:
+                self.by_identity[(record.inode, record.size, record.mtime_ns)] = path
+            if record.hash and record.size >= HASH_MATCH_MIN_SIZE:
+                self.by_content.setdefault((record.size, record.mtime_ns), []).append((path, record.hash))
+
+    def candidates(self, entry):
+        """Vecchi percorsi che entry potrebbe sostituire, in ordine di affidabilita'."""
+        st = entry.stat
+        old_path = self.by_identity.get((st.st_ino, st.st_size, st.st_mtime_ns)) if st.st_ino else None
+        found = [(old_path, None)] if old_path is not None and old_path != entry.path else []
+        found.extend(self.by_content.get((st.st_size, st.st_mtime_ns), ()))
+        return found
+
+
+def confirm_rename(entry, candidates, deleted):
+    """Sceglie tra i candidati un vecchio percorso davvero sparito; None se non c'e'."""
+    # engine.verify porta con se' il pool di processi: serve solo se c'e' un candidato
+    from engine.verify import hash_file
+
+    digest = None
+    for old_path, expected_hash in candidates:
+        if old_path not in deleted:
+            continue
+        if expected_hash is None:
+            return old_path
+        if digest is None:
+            try:
+                digest = hash_file(entry.path)
+            except OSError:
+                return None
+        if digest == expected_hash:
+            return old_path
+    return None
@@ -0,0 +1,273 @@
+import hashlib
+import os
+import re
+import threading
+import time
+
+from engine.copier import CopyPool
+from engine.copy_backend import TEMP_SUFFIX, copy_file
+from engine.filters import _glob_to_regex
+from engine.progress import ProgressTracker
+from engine.stats import RunStats
+from engine.tracing import RunTrace
+
+_GLOB_CHARS = re.compile(r'[*?\[]')
+# Blocchi di zeri piu' piccoli non vengono lasciati come buchi
+HOLE_MIN_SIZE = 4096
+_ZERO_BLOCK = bytes(HOLE_MIN_SIZE)
+
+
+class PathSelector:
+    """File da ripristinare, scelti per percorso o glob sul rel_path.
+
+    Un percorso senza caratteri jolly seleziona quel file o tutta la
+    cartella; una glob segue le regole dei filtri ('*' non attraversa le
+    cartelle, '**' si', senza '/' vale a qualsiasi profondita') e una
+    cartella che corrisponde porta con se' tutto il contenuto. Senza
+    pattern si ripristina tutto.
+    """
+
+    def __init__(self, patterns=()):
+        self.regexes = []
+        for pattern in patterns:
+            pattern = pattern.strip().replace('\\', '/')
+            if pattern.startswith('./'):
+                pattern = pattern[2:]
+            pattern = pattern.strip('/')
+            if not pattern:
+                continue
+            if _GLOB_CHARS.search(pattern):
+                prefix = '' if '/' in pattern else '(?:.*/)?'
+                regex = prefix + _glob_to_regex(pattern)
+            else:
+                regex = re.escape(pattern)
+            self.regexes.append(re.compile(regex + r'(?:/.*)?\Z', re.DOTALL))
+
+    def __bool__(self):
+        return bool(self.regexes)
+
+    def matches(self, rel_path):
+        rel_path = rel_path.replace('\\', '/')
+        return not self.regexes or any(regex.match(rel_path) for regex in self.regexes)
+
+
+def _finish(tmp_path, dest_path, record):
+    # Permessi e data di modifica come al momento del backup
+    if record.get('mode') is not None:
+        os.chmod(tmp_path, record['mode'] & 0o7777)
+    os.utime(tmp_path, ns=(record['mtime_ns'], record['mtime_ns']))
+    os.replace(tmp_path, dest_path)
+
+
+def _write_holes(f, data):
+    # I blocchi allineati di soli zeri diventano buchi: un file sparso torna sparso
+    if _ZERO_BLOCK not in data:
+        f.write(data)
+        return
+    view = memoryview(data)
+    start = 0
+    # Il primo blocco arriva al prossimo multiplo di HOLE_MIN_SIZE nel file
+    end = HOLE_MIN_SIZE - f.tell() % HOLE_MIN_SIZE
+    while start < len(data):
+        block = view[start:end]
+        if len(block) == HOLE_MIN_SIZE and block == _ZERO_BLOCK:
+            f.seek(HOLE_MIN_SIZE, os.SEEK_CUR)
+        else:
+            f.write(block)
+        start, end = end, end + HOLE_MIN_SIZE
+
+
+def _write_pieces(pieces, dest_path, record, progress):
+    tmp_path = dest_path + TEMP_SUFFIX
+    try:
+        with open(tmp_path, 'wb') as f:
+            for data in pieces:
+                _write_holes(f, data)
+                if progress:
+                    progress(len(data))
+            # Estende il file se termina con un buco
+            f.truncate()
+        _finish(tmp_path, dest_path, record)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class FolderCatalog:
+    """Copie di un backup 'mirror' o 'snapshot': un file per ogni file del manifest."""
+
+    def __init__(self, root, files):
+        self.root = root
+        # rel_path -> {'size', 'mtime_ns'}
+        self.files = files
+        self.device = None
+
+    def open(self):
+        self.device = os.stat(self.root).st_dev
+
+    def restore(self, rel_path, record, dest_path, progress=None):
+        # Stessi backend veloci del backup; copystat conserva permessi e date
+        return copy_file(os.path.join(self.root, rel_path), dest_path, progress)
+
+    def close(self):
+        pass
+
+
+class StoreCatalog:
+    """File ricomposti dai chunk di uno store deduplicato."""
+
+    def __init__(self, store, files):
+        self.store = store
+        self.files = files
+        self.device = None
+
+    def open(self):
+        self.store.open()
+        self.device = os.stat(self.store.root).st_dev
+
+    def restore(self, rel_path, record, dest_path, progress=None):
+        _write_pieces(self._chunks(record['chunks']), dest_path, record, progress)
+        return 'store'
+
+    def _chunks(self, chunks):
+        # Un chunk danneggiato nel pack non deve finire nel file ripristinato
+        for chunk in chunks:
+            digest = bytes.fromhex(chunk)
+            data = self.store.get(digest)
+            if hashlib.sha256(data).digest() != digest:
+                raise OSError(f"Chunk {chunk} is corrupt")
+            yield data
+
+    def close(self):
+        self.store.close()
+
+
+class ArchiveCatalog:
+    """File estratti dagli archivi tar compressi, letti direttamente all'offset indicato dall'indice."""
+
+    def __init__(self, root, files):
+        self.root = root
+        self.files = files
+        self.device = None
+
+    def open(self):
+        self.device = os.stat(self.root).st_dev
+
+    def restore(self, rel_path, record, dest_path, progress=None):
+        from engine.archive import iter_member
+
+        pieces = iter_member(os.path.join(self.root, record['archive']), record['offset'], record['length'],
+                             record['codec'])
+        _write_pieces(pieces, dest_path, record, progress)
+        return f'archive-{record["codec"] or "stored"}'
+
+    def close(self):
+        pass
+
+
+class RestoreEngine:
+    """Ripristino in parallelo dei file selezionati di un backup in target_folder.
+
+    I file vengono cercati nell'indice del backup (catalog), senza
+    percorrere la destinazione. Quelli gia' presenti con stessa dimensione
+    e data vengono saltati, quindi un ripristino interrotto si riprende
+    rilanciandolo. Un errore su un file non ferma gli altri.
+    """
+
+    def __init__(self, catalog, target_folder, patterns=(), progress=None, should_stop=None, workers=4,
+                 per_source_device=None, per_dest_device=None, progress_interval=0.25, trace=None):
+        self.catalog = catalog
+        self.target_folder = target_folder
+        self.selector = PathSelector(patterns)
+        self.should_stop = should_stop or (lambda: False)
+        self.workers = workers
+        self.per_source_device = per_source_device
+        self.per_dest_device = per_dest_device
+        self.tracker = ProgressTracker(progress, progress_interval)
+        self.stats = RunStats()
+        self.trace = trace or RunTrace('restore')
+        self.errors = []
+        self._lock = threading.Lock()
+        self._created_dirs = set()
+
+    def select(self):
+        return {rel_path: record for rel_path, record in self.catalog.files.items()
+                if self.selector.matches(rel_path)}
+
+    def run(self):
+        started = time.monotonic()
+        started_ns = time.perf_counter_ns()
+        with self.trace.span('select'):
+            selected = self.select()
+        self.catalog.open()
+        pool = None
+        completed = False
+        try:
+            os.makedirs(self.target_folder, exist_ok=True)
+            device = os.stat(self.target_folder).st_dev
+            pool = CopyPool(self.workers, self.per_source_device, self.per_dest_device)
+            self.tracker.start()
+            self.tracker.add_total(files=len(selected), size=sum(record['size'] for record in selected.values()))
+            self.tracker.finish_scan()
+            self.stats.add(files_scanned=len(selected))
+            for rel_path in sorted(selected):
+                if self.should_stop():
+                    return False
+                record = selected[rel_path]
+                dest_path = os.path.join(self.target_folder, rel_path)
+                if self._already_restored(dest_path, record):
+                    self.stats.add(files_skipped=1)
+                    self.tracker.add_done(files=1, size=record['size'])
+                    continue
+                self._prepare_dir(os.path.dirname(dest_path))
+                pool.submit(lambda rel_path=rel_path, record=record, dest_path=dest_path:
+                            self._restore(rel_path, record, dest_path),
+                            self.catalog.device, device)
+            pool.join()
+            self.stats.record_phase('restore', time.monotonic() - started)
+            self.trace.record('restore', 'phase', started_ns, time.perf_counter_ns() - started_ns)
+            completed = True
+            return not self.errors
+        finally:
+            if pool is not None and not completed:
+                pool.cancel()
+            self.tracker.stop(report=completed)
+            self.catalog.close()
+
+    def _already_restored(self, dest_path, record):
+        try:
+            st = os.stat(dest_path)
+        except OSError:
+            return False
+        return st.st_size == record['size'] and st.st_mtime_ns == record['mtime_ns']
+
+    def _prepare_dir(self, directory):
+        if directory not in self._created_dirs:
+            os.makedirs(directory, exist_ok=True)
+            self._created_dirs.add(directory)
+
+    def _restore(self, rel_path, record, dest_path):
+        reported = 0
+
+        def advance(copied):
+            nonlocal reported
+            reported += copied
+            self.tracker.add_done(size=copied, current_file=rel_path)
+
+        start = time.perf_counter_ns()
+        try:
+            method = self.catalog.restore(rel_path, record, dest_path, advance)
+        except OSError as e:
+            self.trace.logger.warning("Error restoring %s: %s", rel_path, e)
+            with self._lock:
+                self.errors.append((rel_path, str(e)))
+            self.stats.add(errors=1)
+            self.tracker.add_done(files=1, size=max(record['size'] - reported, 0))
+            return
+        self.trace.time_file('restore', start, path=rel_path, size=record['size'])
+        self.stats.add(files_copied=1, bytes_copied=record['size'])
+        self.stats.count_method(method)
+        self.tracker.add_done(files=1, size=max(record['size'] - reported, 0), current_file=rel_path)
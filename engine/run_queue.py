@@ -0,0 +1,100 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_SCHEDULED = 0
+PRIORITY_MANUAL = 10
+
+
+class RunQueue:
+    """Coda centrale delle esecuzioni di backup.
+
+    Limita le esecuzioni contemporanee in totale (max_concurrent) e per
+    cartella di destinazione (per_destination). Una richiesta per un job
+    gia' in coda o in esecuzione viene unita a quella esistente. A parita'
+    di condizioni parte prima la priorita' piu' alta, poi la piu' vecchia.
+
+    start_run(job_id) deve avviare l'esecuzione senza bloccare; al termine
+    va chiamato finished(job_id).
+    """
+
+    def __init__(self, start_run, max_concurrent=2, per_destination=1):
+        self.start_run = start_run
+        self.max_concurrent = max(1, max_concurrent)
+        self.per_destination = max(1, per_destination)
+        self._lock = threading.RLock()
+        self._heap = []
+        self._counter = itertools.count()
+        # job_id -> (priorita', destinazione) delle richieste in attesa
+        self._queued = {}
+        # job_id -> destinazione delle esecuzioni in corso
+        self._running = {}
+
+    @staticmethod
+    def destination_key(dest_folder):
+        return os.path.normcase(os.path.realpath(dest_folder))
+
+    def submit(self, job_id, dest_folder, priority=PRIORITY_SCHEDULED):
+        """Accoda un job; restituisce 'queued', 'merged' o 'running'."""
+        with self._lock:
+            if job_id in self._running:
+                return 'running'
+            destination = self.destination_key(dest_folder)
+            queued = self._queued.get(job_id)
+            if queued is not None and queued[0] >= priority:
+                return 'merged'
+            # Nuova richiesta o priorita' piu' alta: la voce precedente
+            # nell'heap resta e viene scartata quando esce
+            self._queued[job_id] = (priority, destination)
+            heapq.heappush(self._heap, (-priority, next(self._counter), job_id))
+            result = 'merged' if queued is not None else 'queued'
+        self._dispatch()
+        return result
+
+    def finished(self, job_id):
+        with self._lock:
+            self._running.pop(job_id, None)
+        self._dispatch()
+
+    def is_busy(self, job_id):
+        with self._lock:
+            return job_id in self._running or job_id in self._queued
+
+    def running_jobs(self):
+        with self._lock:
+            return list(self._running)
+
+    def pending_jobs(self):
+        with self._lock:
+            return list(self._queued)
+
+    def _dispatch(self):
+        to_start = []
+        with self._lock:
+            skipped = []
+            while self._heap and len(self._running) < self.max_concurrent:
+                entry = heapq.heappop(self._heap)
+                job_id = entry[2]
+                queued = self._queued.get(job_id)
+                if queued is None or queued[0] != -entry[0]:
+                    continue
+                destination = queued[1]
+                busy = sum(1 for running in self._running.values() if running == destination)
+                if busy >= self.per_destination:
+                    skipped.append(entry)
+                    continue
+                del self._queued[job_id]
+                self._running[job_id] = destination
+                to_start.append(job_id)
+            for entry in skipped:
+                heapq.heappush(self._heap, entry)
+        for job_id in to_start:
+            try:
+                self.start_run(job_id)
+            except Exception as e:
+                logger.exception("Error starting backup job %s: %s", job_id, e)
+                self.finished(job_id)
@@ -0,0 +1,327 @@
+import datetime
+import logging
+import os
+
+from db.models import BackupJob, BackupRun, BackupSnapshot, Destination, FilterRule, VerifyFailure
+from engine.backup import BackupEngine, create_destination
+from engine.checkpoint import CheckpointJournal, journal_path
+from engine.filters import FileFilter
+from engine.manifest import ManifestRecord, load_manifest, save_manifest
+from engine.scanner import relative_path
+from engine.tracing import RunTrace, run_log_path
+
+logger = logging.getLogger(__name__)
+
+
+def run_backup(session, backup_job_id, source_paths, dest_folder, dest_format='mirror',
+               delta_threshold=None, verify='off', verify_sample=0.05, verify_workers=None,
+               changed_paths=None, archive_codec='gzip', compress_workers=None, log_dir=None,
+               log_keep=None, trace_export=False, **engine_options):
+    """Esegue il backup di un job e ne registra l'esito nel database.
+
+    Carica il manifest, le regole di filtro e l'ultimo snapshot del job, esegue il motore e, se
+    l'esecuzione riesce, salva il nuovo manifest (e lo snapshot) e aggiorna
+    data dell'ultima esecuzione e contatore del job. In ogni caso aggiunge
+    una riga a backup_runs. Un'esecuzione interrotta lascia sulla
+    destinazione un journal da cui riparte la successiva. Con verify
+    'full' o 'sample' le copie vengono poi confrontate con i sorgenti
+    (tutte o una frazione verify_sample). changed_paths limita un backup
+    'mirror' ai percorsi modificati segnalati dal backup continuo; gli altri
+    formati li ignorano, perche' ogni esecuzione deve contenere tutti i file.
+    archive_codec e compress_workers valgono per il formato 'archive'.
+    Con log_dir ogni esecuzione scrive un log in quella cartella (tenendo
+    gli ultimi log_keep) e, con trace_export, la traccia in formato Chrome.
+    Le destinazioni aggiuntive del job vengono scritte insieme a
+    dest_folder: un loro errore le esclude dall'esecuzione senza farla
+    fallire e resta registrato in destinations.
+    Restituisce (successo, statistiche).
+    """
+    started_at = datetime.datetime.now()
+    tag = f'job-{backup_job_id}' if backup_job_id else 'default'
+    log_path = run_log_path(log_dir, tag, 'backup', log_keep) if log_dir else None
+    trace = RunTrace(tag, log_path)
+    trace.logger.info("Backup %s started: %s -> %s (%s)", tag, ', '.join(source_paths), dest_folder, dest_format)
+    engine = None
+    success = False
+    report = None
+    extras = []
+    destination = None
+    try:
+        with trace.span('load_job', 'database'):
+            manifest = load_manifest(session, backup_job_id) if backup_job_id else {}
+            previous_snapshot = None
+            file_filter = None
+            propagate_deletions = False
+            extra_destinations = []
+            if backup_job_id:
+                backup_job = session.get(BackupJob, backup_job_id)
+                propagate_deletions = bool(backup_job and backup_job.mirror_deletions)
+                if backup_job is not None:
+                    extras = list(backup_job.extra_destinations)
+                    extra_destinations = [(extra.folder, extra.is_lagging(backup_job.last_run_date))
+                                          for extra in extras]
+                rules = (session.query(FilterRule.pattern).filter_by(backup_job_id=backup_job_id)
+                         .order_by(FilterRule.position).all())
+                file_filter = FileFilter([rule.pattern for rule in rules]) or None
+                last_snapshot = (session.query(BackupSnapshot).filter_by(backup_job_id=backup_job_id)
+                                 .order_by(BackupSnapshot.created_at.desc()).first())
+                previous_snapshot = last_snapshot.path if last_snapshot else None
+        destination = create_destination(dest_format, dest_folder, backup_job_id,
+                                         delta_threshold=delta_threshold,
+                                         previous_snapshot=previous_snapshot,
+                                         propagate_deletions=propagate_deletions,
+                                         archive_codec=archive_codec, compress_workers=compress_workers,
+                                         extra_destinations=extra_destinations)
+        checkpoint = None
+        if destination.resumable:
+            checkpoint = CheckpointJournal(journal_path(dest_folder, f'{destination.name}-{tag}'), trace=trace)
+        if dest_format != 'mirror' or any(lagging for folder, lagging in extra_destinations):
+            # Una destinazione rimasta indietro va confrontata per intero
+            changed_paths = None
+        engine = BackupEngine(source_paths, destination, manifest=manifest,
+                              file_filter=file_filter, checkpoint=checkpoint,
+                              changed_paths=changed_paths, trace=trace, **engine_options)
+        success = engine.run()
+        if success and verify != 'off':
+            records = engine.new_manifest
+            if changed_paths is not None:
+                # Si verificano solo i file esaminati in questa esecuzione: gli
+                # altri record sono gli stessi oggetti del manifest precedente
+                records = {path: record for path, record in records.items()
+                           if manifest.get(path) is not record}
+            with trace.span('verify'):
+                report = _verify(destination, source_paths, records, verify == 'sample',
+                                 verify_sample, verify_workers, trace.logger)
+            engine.stats.add(files_verified=report.files_verified,
+                             verify_mismatches=len(report.mismatches))
+            engine.stats.record_phase('verify', report.seconds)
+        stats = engine.stats.as_dict()
+        if extras:
+            stats['destinations'] = destination.results()
+        if success and backup_job_id:
+            with trace.span('save_manifest', 'database'):
+                if dest_format == 'snapshot':
+                    session.add(BackupSnapshot(backup_job_id=backup_job_id,
+                                               path=destination.snapshot_path,
+                                               created_at=destination.created_at,
+                                               files_copied=stats['files_copied'],
+                                               files_linked=stats['files_linked'],
+                                               bytes_copied=stats['bytes_copied']))
+                save_manifest(session, backup_job_id, manifest, engine.new_manifest)
+        return success, stats
+    except Exception:
+        trace.logger.exception("Backup %s failed", tag)
+        raise
+    finally:
+        if backup_job_id:
+            with trace.span('record_run', 'database'):
+                session.rollback()
+                _record_run(session, backup_job_id, started_at, success,
+                            engine.stats.as_dict() if engine else None,
+                            report.mismatches if report else (),
+                            _destination_results(trace, extras, destination))
+        _finish_trace(trace, success, engine.stats.as_dict() if engine else None, trace_export)
+
+
+def verify_backup(session, backup_job_id, source_paths, dest_folder, dest_format='mirror',
+                  sample=None, workers=None):
+    """Verifica su richiesta le copie dell'ultimo backup riuscito di un job.
+
+    Le copie di file con un hash registrato si confrontano con quello,
+    senza rileggere il sorgente; le altre con il sorgente, se non e'
+    cambiato dall'ultimo backup. Con sample si verifica solo quella
+    frazione dei file. Gli hash confermati vengono salvati nel manifest, le
+    differenze in verify_failures. Restituisce il VerifyReport.
+    """
+    manifest = load_manifest(session, backup_job_id)
+    destination = create_destination(dest_format, dest_folder, backup_job_id)
+    if dest_format == 'snapshot':
+        last_snapshot = (session.query(BackupSnapshot).filter_by(backup_job_id=backup_job_id)
+                         .order_by(BackupSnapshot.created_at.desc()).first())
+        if last_snapshot is None:
+            manifest = {}
+        else:
+            destination.snapshot_path = last_snapshot.path
+    elif dest_format == 'store':
+        snapshot = destination.store.latest_snapshot(destination.tag)
+        destination.files = snapshot['files'] if snapshot else {}
+    elif dest_format == 'archive':
+        destination.files = destination.latest_index()
+
+    records = {}
+    for path, record in manifest.items():
+        if record.hash is None:
+            try:
+                if not record.matches(os.stat(path)):
+                    continue
+            except OSError:
+                continue
+        records[path] = ManifestRecord(record.id, record.size, record.mtime_ns, record.inode, record.hash)
+    report = _verify(destination, source_paths, records, sample is not None, sample, workers)
+    # I file esclusi perche' cambiati restano nel manifest cosi' come sono
+    save_manifest(session, backup_job_id, manifest, {**manifest, **records})
+    _add_failures(session, backup_job_id, None, report.mismatches)
+    session.commit()
+    return report
+
+
+def restore_backup(session, backup_job_id, source_paths, dest_folder, dest_format, target_folder,
+                   patterns=(), progress=None, should_stop=None, log_dir=None, log_keep=None,
+                   trace_export=False, **restore_options):
+    """Ripristina in target_folder i file dell'ultimo backup riuscito di un job.
+
+    patterns sceglie i file per percorso o glob (vedi PathSelector), anche
+    come percorsi assoluti delle sorgenti; senza pattern si ripristina
+    tutto. I file mantengono la struttura relativa alle sorgenti. log_dir,
+    log_keep e trace_export come in run_backup.
+    Restituisce (successo, statistiche, errori).
+    """
+    # Restore e verifica servono solo a chi li usa: non pesano su ogni backup
+    from engine.restore import RestoreEngine
+
+    tag = f'job-{backup_job_id}'
+    log_path = run_log_path(log_dir, tag, 'restore', log_keep) if log_dir else None
+    trace = RunTrace(f'restore-{tag}', log_path)
+    trace.logger.info("Restore %s started: %s -> %s (%s)", tag, dest_folder, target_folder,
+                      ', '.join(patterns) or 'all files')
+    engine = None
+    success = False
+    try:
+        with trace.span('load_catalog', 'database'):
+            catalog = _restore_catalog(session, backup_job_id, source_paths, dest_folder, dest_format)
+        patterns = [_restore_pattern(source_paths, catalog.files, pattern) for pattern in patterns]
+        engine = RestoreEngine(catalog, target_folder, patterns, progress=progress, should_stop=should_stop,
+                               trace=trace, **restore_options)
+        success = engine.run()
+        return success, engine.stats.as_dict(), engine.errors
+    except Exception:
+        trace.logger.exception("Restore %s failed", tag)
+        raise
+    finally:
+        _finish_trace(trace, success, engine.stats.as_dict() if engine else None, trace_export)
+
+
+def _restore_catalog(session, backup_job_id, source_paths, dest_folder, dest_format):
+    from engine.restore import ArchiveCatalog, FolderCatalog, StoreCatalog
+
+    destination = create_destination(dest_format, dest_folder, backup_job_id)
+    if dest_format in ('mirror', 'snapshot'):
+        root = destination.backup_folder
+        if dest_format == 'snapshot':
+            last_snapshot = (session.query(BackupSnapshot).filter_by(backup_job_id=backup_job_id)
+                             .order_by(BackupSnapshot.created_at.desc()).first())
+            if last_snapshot is None:
+                raise FileNotFoundError(f"No snapshot found for backup job {backup_job_id}")
+            root = last_snapshot.path
+        files = {}
+        for path, record in load_manifest(session, backup_job_id).items():
+            rel_path = relative_path(source_paths, path)
+            if rel_path is not None:
+                files[rel_path] = {'size': record.size, 'mtime_ns': record.mtime_ns}
+        catalog = FolderCatalog(root, files)
+    elif dest_format == 'store':
+        snapshot = destination.store.latest_snapshot(destination.tag)
+        catalog = StoreCatalog(destination.store, snapshot['files'] if snapshot else {})
+    elif dest_format == 'archive':
+        catalog = ArchiveCatalog(destination.root, destination.latest_index())
+    else:
+        raise ValueError(f"Unknown destination format: {dest_format}")
+    return catalog
+
+
+def _restore_pattern(source_paths, files, pattern):
+    # I percorsi assoluti delle sorgenti diventano rel_path; una cartella
+    # sorgente indicata per intero (non un file sorgente) seleziona tutto
+    if not os.path.isabs(pattern):
+        return pattern
+    pattern = pattern.rstrip(os.sep) or os.sep
+    if pattern in source_paths and os.path.basename(pattern) not in files:
+        return '**'
+    return relative_path(source_paths, pattern) or pattern
+
+
+def _finish_trace(trace, success, stats, export):
+    trace.logger.info("%s %s: %s", trace.name, 'completed' if success else 'failed', stats)
+    if export and trace.log_path:
+        try:
+            trace.export(trace.log_path[:-len('.log')] + '.trace.json')
+        except OSError as e:
+            trace.logger.error("Cannot write trace: %s", e)
+    trace.close()
+
+
+def _verify(destination, source_paths, records, sampled, fraction, workers, log=logger):
+    from engine.verify import VerifyItem, select_sample, verify_files
+
+    items = []
+    for path, record in records.items():
+        rel_path = relative_path(source_paths, path)
+        target = destination.verify_target(rel_path) if rel_path else None
+        if target is not None:
+            items.append(VerifyItem(path, target, record.hash))
+    if sampled:
+        items = select_sample(items, fraction)
+    report = verify_files(items, workers)
+    for path, digest in report.digests.items():
+        records[path].hash = digest
+    for path, error, expected, actual in report.mismatches:
+        # Con una mtime impossibile il file non corrisponde piu' al manifest
+        # e il prossimo backup lo copia di nuovo
+        records[path].mtime_ns = 0
+        records[path].hash = None
+        log.warning("Verification failed for %s: %s", path, error or 'content differs')
+    return report
+
+
+def _add_failures(session, backup_job_id, run, mismatches):
+    for path, error, expected, actual in mismatches:
+        session.add(VerifyFailure(backup_job_id=backup_job_id, run=run, path=path, error=error,
+                                  expected_hash=expected, actual_hash=actual))
+
+
+def _destination_results(trace, extras, destination):
+    # (id della riga in destinations, esito) per ogni destinazione aggiuntiva
+    if not extras or destination is None:
+        return ()
+    results = destination.results()[1:]
+    for result in results:
+        if result['success']:
+            trace.logger.info("Destination %s: %d files, %d bytes written", result['folder'],
+                              result['files_written'], result['bytes_written'])
+        else:
+            trace.logger.warning("Destination %s failed: %s", result['folder'], result['error'])
+    return [(extra.id, result) for extra, result in zip(extras, results)]
+
+
+def _record_run(session, backup_job_id, started_at, success, stats, mismatches=(), destinations=()):
+    run = BackupRun(backup_job_id=backup_job_id, started_at=started_at,
+                    finished_at=datetime.datetime.now(), success=success)
+    if stats:
+        phases = stats['phase_seconds']
+        run.files_scanned = stats['files_scanned']
+        run.files_copied = stats['files_copied'] + stats['files_linked']
+        run.files_skipped = stats['files_skipped']
+        run.bytes_copied = stats['bytes_copied']
+        run.error_count = stats['errors']
+        run.scan_seconds = phases.get('scan')
+        run.copy_seconds = phases.get('copy')
+        run.verify_seconds = phases.get('verify')
+        run.files_verified = stats['files_verified']
+    session.add(run)
+    _add_failures(session, backup_job_id, run, mismatches)
+    for destination_id, result in destinations:
+        extra = session.get(Destination, destination_id)
+        if extra is None:
+            continue
+        if not result['success']:
+            extra.last_error = result['error']
+        elif success:
+            # Allineata alla principale: la prossima esecuzione puo' usare il manifest
+            extra.last_success_at = run.finished_at
+            extra.last_error = None
+    if success:
+        backup_job = session.get(BackupJob, backup_job_id)
+        if backup_job is not None:
+            backup_job.last_run_date = run.finished_at
+            backup_job.run_count = (backup_job.run_count or 0) + 1
+    session.commit()
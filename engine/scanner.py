@@ -0,0 +1,134 @@
+import os
+import stat as stat_module
+import time
+
+
+class ScanEntry:
+    __slots__ = ('path', 'rel_path', 'stat')
+
+    def __init__(self, path, rel_path, stat):
+        self.path = path
+        self.rel_path = rel_path
+        self.stat = stat
+
+
+def scan_source(source_path, on_error=None, file_filter=None, trace=None):
+    """Percorre una sorgente (cartella o singolo file) in un solo passaggio.
+
+    Restituisce un generatore di ScanEntry; rel_path e' relativo alla radice
+    della cartella, oppure il solo nome del file se la sorgente e' un file.
+    Con un FileFilter le cartelle escluse non vengono nemmeno aperte; con
+    un RunTrace la durata di ogni stat finisce nell'istogramma 'stat'.
+    """
+    try:
+        st = os.stat(source_path)
+    except OSError as e:
+        if on_error:
+            on_error(source_path, e)
+        return
+
+    if stat_module.S_ISDIR(st.st_mode):
+        yield from scan_tree(source_path, on_error, file_filter, trace=trace)
+    elif stat_module.S_ISREG(st.st_mode):
+        if file_filter and file_filter.exclude_file(os.path.basename(source_path), st):
+            return
+        yield ScanEntry(source_path, os.path.basename(source_path), st)
+
+
+def relative_path(source_paths, path):
+    """Il rel_path che lo scanner assegna a path, o None se path non e' in nessuna sorgente."""
+    for source_path in source_paths:
+        if path == source_path:
+            return os.path.basename(source_path)
+        prefix = os.path.join(source_path, '')
+        if path.startswith(prefix):
+            return path[len(prefix):]
+    return None
+
+
+def scan_paths(source_paths, paths, on_error=None, file_filter=None, on_missing=None, trace=None):
+    """Percorre solo i percorsi indicati (file o cartelle dentro le sorgenti).
+
+    Usata dal backup continuo per i percorsi segnalati come modificati: i
+    rel_path sono gli stessi di una scansione completa. on_missing riceve i
+    percorsi che non esistono piu'.
+    """
+    seen_dirs = []
+    for path in sorted(paths):
+        # Le cartelle gia' visitate comprendono anche i percorsi al loro interno
+        if any(path.startswith(os.path.join(directory, '')) for directory in seen_dirs):
+            continue
+        rel_path = relative_path(source_paths, path)
+        if rel_path is None:
+            continue
+        try:
+            st = os.lstat(path)
+        except FileNotFoundError:
+            if on_missing:
+                on_missing(path)
+            continue
+        except OSError as e:
+            if on_error:
+                on_error(path, e)
+            continue
+        if stat_module.S_ISLNK(st.st_mode):
+            # Come scan_tree: si seguono i link a file, non quelli a cartelle
+            # ne' quelli interrotti, che restano fuori dal manifest
+            try:
+                target = os.stat(path)
+            except OSError:
+                target = None
+            if target is not None and stat_module.S_ISREG(target.st_mode):
+                st = target
+        if stat_module.S_ISDIR(st.st_mode):
+            if path in source_paths:
+                rel_path = ''
+            elif file_filter and file_filter.exclude_dir(rel_path):
+                continue
+            seen_dirs.append(path)
+            yield from scan_tree(path, on_error, file_filter, rel_path, trace)
+        elif stat_module.S_ISREG(st.st_mode):
+            if file_filter and file_filter.exclude_file(rel_path, st):
+                continue
+            yield ScanEntry(path, rel_path, st)
+        elif on_missing:
+            # Non e' piu' un file normale (es. sostituito da un link a una cartella)
+            on_missing(path)
+
+
+def scan_tree(root, on_error=None, file_filter=None, rel_root='', trace=None):
+    # Visita iterativa: niente ricorsione e una sola scandir per cartella.
+    # Lo stat di DirEntry viene riutilizzato (su Windows e' gratuito, su
+    # Linux costa una sola chiamata, poi resta in cache nell'entry).
+    stack = [(root, rel_root)]
+    while stack:
+        dir_path, rel_dir = stack.pop()
+        try:
+            with os.scandir(dir_path) as it:
+                subdirs = []
+                for entry in it:
+                    rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if file_filter and file_filter.exclude_dir(rel_path):
+                                continue
+                            subdirs.append((entry.path, rel_path))
+                        elif entry.is_file():
+                            if trace is None:
+                                st = entry.stat()
+                            else:
+                                start = time.perf_counter_ns()
+                                st = entry.stat()
+                                trace.observe('stat', time.perf_counter_ns() - start)
+                            if file_filter and file_filter.exclude_file(rel_path, st):
+                                continue
+                            yield ScanEntry(entry.path, rel_path, st)
+                    except OSError as e:
+                        if on_error:
+                            on_error(entry.path, e)
+        except OSError as e:
+            if on_error:
+                on_error(dir_path, e)
+            continue
+        # Inverti per visitare le sottocartelle in ordine di lettura
+        stack.extend(reversed(subdirs))
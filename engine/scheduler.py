@@ -0,0 +1,125 @@
+import datetime
+import heapq
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# I giorni vengono salvati dal dialog in italiano; i nomi inglesi sono
+# accettati per i job creati con versioni precedenti
+WEEKDAYS = {
+    'Lunedì': 0, 'Martedì': 1, 'Mercoledì': 2, 'Giovedì': 3, 'Venerdì': 4, 'Sabato': 5, 'Domenica': 6,
+    'Monday': 0, 'Tuesday': 1, 'Wednesday': 2, 'Thursday': 3, 'Friday': 4, 'Saturday': 5, 'Sunday': 6,
+}
+
+# Anche senza nuove scadenze il thread si risveglia periodicamente per
+# accorgersi di cambi dell'orologio di sistema (ora legale, NTP)
+MAX_SLEEP = 60
+
+
+def next_fire_time(schedule_time, days, after):
+    """Prossimo istante (datetime locale) strettamente successivo ad after, o None."""
+    try:
+        at = datetime.datetime.strptime(schedule_time, '%H:%M').time()
+    except (TypeError, ValueError):
+        return None
+    weekdays = {WEEKDAYS[day.strip()] for day in (days or '').split(',') if day.strip() in WEEKDAYS}
+    if not weekdays:
+        return None
+    for offset in range(8):
+        candidate = datetime.datetime.combine(after.date() + datetime.timedelta(days=offset), at)
+        if candidate.weekday() in weekdays and candidate > after:
+            return candidate
+    return None
+
+
+class JobScheduler:
+    """Scheduler a eventi: un heap ordinato per prossima esecuzione.
+
+    Il thread dorme su una Condition fino alla scadenza piu' vicina e viene
+    svegliato subito quando un job viene aggiunto, modificato o rimosso.
+    on_due(job_id) viene chiamato una sola volta per ogni scadenza, fuori
+    dal lock.
+    """
+
+    def __init__(self, on_due, now=datetime.datetime.now):
+        self.on_due = on_due
+        self.now = now
+        self._heap = []
+        # job_id -> (schedule_time, days, versione); le voci dell'heap con una
+        # versione diversa sono state superate da una modifica e si scartano
+        self._jobs = {}
+        self._version = 0
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def set_job(self, job_id, schedule_time, days):
+        with self._condition:
+            self._version += 1
+            self._jobs[job_id] = (schedule_time, days, self._version)
+            when = next_fire_time(schedule_time, days, self.now())
+            if when is not None:
+                heapq.heappush(self._heap, (when, job_id, self._version))
+            self._condition.notify()
+
+    def remove_job(self, job_id):
+        with self._condition:
+            self._jobs.pop(job_id, None)
+            self._condition.notify()
+
+    def next_run(self, job_id):
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return min((when for when, heap_id, version in self._heap
+                        if heap_id == job_id and version == job[2]), default=None)
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='backup-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                due = self._pop_due()
+                while due is None and self._running:
+                    self._condition.wait(self._sleep_time())
+                    due = self._pop_due()
+                if not self._running:
+                    return
+            try:
+                self.on_due(due)
+            except Exception as e:
+                logger.exception("Error starting scheduled backup %s: %s", due, e)
+
+    def _sleep_time(self):
+        if not self._heap:
+            return MAX_SLEEP
+        delay = (self._heap[0][0] - self.now()).total_seconds()
+        return min(max(delay, 0), MAX_SLEEP)
+
+    def _pop_due(self):
+        now = self.now()
+        while self._heap and self._heap[0][0] <= now:
+            when, job_id, version = heapq.heappop(self._heap)
+            job = self._jobs.get(job_id)
+            if job is None or job[2] != version:
+                continue
+            # La prossima scadenza parte dall'ultima eseguita (o da adesso, se
+            # il computer era sospeso): ogni orario scatta una sola volta
+            next_when = next_fire_time(job[0], job[1], max(when, now))
+            if next_when is not None:
+                heapq.heappush(self._heap, (next_when, job_id, version))
+            return job_id
+        return None
@@ -0,0 +1,102 @@
+import os
+
+
+class Settings:
+    """Configurazione letta dal file .env e dalle variabili d'ambiente."""
+
+    def __init__(self, environ):
+        def number(name, default):
+            return int(environ.get(name) or default)
+
+        self.email_user = environ.get('EMAIL_USER')
+        self.email_password = environ.get('EMAIL_PASSWORD')
+        # Mittente delle notifiche: serve se il server SMTP non richiede login
+        self.email_from = environ.get('EMAIL_FROM') or self.email_user
+        self.smtp_host = environ.get('SMTP_HOST') or 'smtp.gmail.com'
+        self.smtp_port = number('SMTP_PORT', 465)
+        self.smtp_ssl = (environ.get('SMTP_SSL') or 'true').lower() in ('1', 'true', 'yes')
+        # Numero di copie parallele e limiti per singolo disco sorgente/destinazione
+        self.workers = number('BACKUP_WORKERS', 4)
+        self.source_device_limit = number('BACKUP_SOURCE_DEVICE_LIMIT', 0) or None
+        self.dest_device_limit = number('BACKUP_DEST_DEVICE_LIMIT', 0) or None
+        # I file piu' grandi di questa soglia (MB) vengono aggiornati solo nei blocchi modificati
+        delta_threshold_mb = number('BACKUP_DELTA_THRESHOLD_MB', 0)
+        self.delta_threshold = delta_threshold_mb * 1024 * 1024 if delta_threshold_mb else None
+        # Propagazione delle cancellazioni: oltre questa percentuale di file spariti non si elimina nulla
+        self.max_delete_fraction = number('BACKUP_MAX_DELETE_PERCENT', 50) / 100
+        # Backup contemporanei, in totale e sulla stessa cartella di destinazione
+        self.max_concurrent_runs = number('BACKUP_MAX_CONCURRENT_RUNS', 2)
+        self.max_runs_per_destination = number('BACKUP_MAX_RUNS_PER_DESTINATION', 1)
+        # Verifica dopo la copia: 'off', 'full' (tutti i file) o 'sample' (una percentuale a caso)
+        self.verify = (environ.get('BACKUP_VERIFY') or 'off').lower()
+        if self.verify not in ('off', 'full', 'sample'):
+            raise ValueError(f"BACKUP_VERIFY must be off, full or sample, not {self.verify}")
+        self.verify_sample = number('BACKUP_VERIFY_SAMPLE_PERCENT', 5) / 100
+        self.verify_workers = number('BACKUP_VERIFY_WORKERS', 0) or None
+        # Formato 'archive': compressione (gzip, bz2 o lzma) e processi che comprimono
+        self.archive_codec = (environ.get('BACKUP_ARCHIVE_CODEC') or 'gzip').lower()
+        if self.archive_codec not in ('gzip', 'bz2', 'lzma'):
+            raise ValueError(f"BACKUP_ARCHIVE_CODEC must be gzip, bz2 or lzma, not {self.archive_codec}")
+        self.compress_workers = number('BACKUP_COMPRESS_WORKERS', 0) or None
+        # Log di ogni esecuzione (gli ultimi log_keep per job) e traccia in formato Chrome
+        self.log_dir = environ.get('BACKUP_LOG_DIR') or 'logs'
+        self.log_keep = number('BACKUP_LOG_KEEP', 30)
+        self.log_level = (environ.get('BACKUP_LOG_LEVEL') or 'INFO').upper()
+        self.trace_export = (environ.get('BACKUP_TRACE') or 'false').lower() in ('1', 'true', 'yes')
+        # Backup continuo: attesa dopo l'ultima modifica e intervallo della scansione completa di controllo
+        self.watch_debounce = number('BACKUP_WATCH_DEBOUNCE_SECONDS', 10)
+        self.reconcile_interval = number('BACKUP_RECONCILE_MINUTES', 60) * 60
+
+    def engine_options(self):
+        """Argomenti per run_backup()."""
+        return {
+            'delta_threshold': self.delta_threshold,
+            'max_delete_fraction': self.max_delete_fraction,
+            'workers': self.workers,
+            'per_source_device': self.source_device_limit,
+            'per_dest_device': self.dest_device_limit,
+            'verify': self.verify,
+            'verify_sample': self.verify_sample,
+            'verify_workers': self.verify_workers,
+            'archive_codec': self.archive_codec,
+            'compress_workers': self.compress_workers,
+            'log_dir': self.log_dir,
+            'log_keep': self.log_keep,
+            'trace_export': self.trace_export,
+        }
+
+    def restore_options(self):
+        """Argomenti per restore_backup()."""
+        return {
+            'workers': self.workers,
+            'per_source_device': self.source_device_limit,
+            'per_dest_device': self.dest_device_limit,
+            'log_dir': self.log_dir,
+            'log_keep': self.log_keep,
+            'trace_export': self.trace_export,
+        }
+
+    def setup_logging(self):
+        from engine.tracing import setup_logging
+
+        setup_logging(self.log_level)
+
+    def create_watcher(self, on_due):
+        from engine.continuous import ContinuousWatcher
+
+        return ContinuousWatcher(on_due, debounce=self.watch_debounce,
+                                 max_delay=max(self.watch_debounce * 12, 60),
+                                 reconcile_interval=self.reconcile_interval)
+
+    def create_notifier(self):
+        from engine.notify import NotificationDispatcher
+
+        return NotificationDispatcher(self.smtp_host, self.smtp_port, self.email_user, self.email_password,
+                                      use_ssl=self.smtp_ssl, sender=self.email_from)
+
+
+def load_settings():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    return Settings(os.environ)
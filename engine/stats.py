@@ -0,0 +1,60 @@
+import threading
+from collections import Counter
+
+
+class RunStats:
+    """Contatori di un'esecuzione, aggiornati in modo thread-safe dai worker."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.files_scanned = 0
+        self.files_copied = 0
+        self.files_skipped = 0
+        self.files_linked = 0
+        # File rimossi o spostati nella copia perche' eliminati o rinominati alla sorgente
+        self.files_deleted = 0
+        self.files_moved = 0
+        self.bytes_copied = 0
+        # Dimensione apparente e spazio allocato dei file copiati: differiscono per i file sparsi
+        self.files_sparse = 0
+        self.bytes_apparent = 0
+        self.bytes_allocated = 0
+        self.errors = 0
+        self.files_verified = 0
+        self.verify_mismatches = 0
+        self.copy_methods = Counter()
+        # Durata in secondi delle fasi (scan, copy, verify)
+        self.phase_seconds = {}
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def count_method(self, method):
+        with self._lock:
+            self.copy_methods[method] += 1
+
+    def record_phase(self, phase, seconds):
+        with self._lock:
+            self.phase_seconds[phase] = seconds
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'files_scanned': self.files_scanned,
+                'files_copied': self.files_copied,
+                'files_skipped': self.files_skipped,
+                'files_linked': self.files_linked,
+                'files_deleted': self.files_deleted,
+                'files_moved': self.files_moved,
+                'bytes_copied': self.bytes_copied,
+                'files_sparse': self.files_sparse,
+                'bytes_apparent': self.bytes_apparent,
+                'bytes_allocated': self.bytes_allocated,
+                'errors': self.errors,
+                'files_verified': self.files_verified,
+                'verify_mismatches': self.verify_mismatches,
+                'copy_methods': dict(self.copy_methods),
+                'phase_seconds': dict(self.phase_seconds),
+            }
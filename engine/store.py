@@ -0,0 +1,216 @@
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import uuid
+import zlib
+
+# Parametri del chunking content-defined
+MIN_CHUNK = 256 * 1024
+MAX_CHUNK = 4 * 1024 * 1024
+WINDOW = 48
+BOUNDARY_MASK = 0x7FF
+BOUNDARY_BYTE = b'\n'
+MAX_CANDIDATES = 16384
+PACK_SIZE = 64 * 1024 * 1024
+READ_SIZE = MAX_CHUNK
+
+
+def _find_cut(buffer, limit):
+    # I punti di taglio candidati sono le occorrenze di BOUNDARY_BYTE (cercate
+    # in C con find); un candidato diventa taglio se il CRC dei WINDOW byte
+    # che lo precedono ha i bit di BOUNDARY_MASK a zero. Il taglio dipende
+    # quindi solo dal contenuto locale e si riallinea dopo inserimenti o
+    # cancellazioni. Oltre MAX_CANDIDATES candidati (dati degeneri, es. file
+    # di soli '\n') si taglia a MAX_CHUNK.
+    view = memoryview(buffer)
+    pos = MIN_CHUNK
+    for _ in range(MAX_CANDIDATES):
+        index = buffer.find(BOUNDARY_BYTE, pos, limit)
+        if index < 0:
+            return limit
+        if zlib.crc32(view[index - WINDOW:index + 1]) & BOUNDARY_MASK == 0:
+            return index + 1
+        pos = index + 1
+    return limit
+
+
+def iter_chunks(f):
+    """Divide il contenuto di un file aperto in chunk content-defined."""
+    buffer = bytearray()
+    eof = False
+    while True:
+        while not eof and len(buffer) < MAX_CHUNK:
+            data = f.read(READ_SIZE)
+            if not data:
+                eof = True
+            buffer += data
+        if not buffer:
+            return
+        if len(buffer) <= MIN_CHUNK and eof:
+            cut = len(buffer)
+        else:
+            cut = _find_cut(buffer, min(len(buffer), MAX_CHUNK))
+        yield bytes(buffer[:cut])
+        del buffer[:cut]
+
+
+class ChunkStore:
+    """Archivio di chunk indirizzati per contenuto.
+
+    I chunk vengono accodati in file pack; l'indice SQLite associa l'hash
+    di ogni chunk al pack e all'offset in cui si trova. Ogni processo
+    scrive i propri pack, quindi piu' job possono usare lo stesso store.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.packs_dir = os.path.join(root, 'packs')
+        self.snapshots_dir = os.path.join(root, 'snapshots')
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._pack = None
+        self._pack_name = None
+        self._db = None
+
+    def open(self):
+        os.makedirs(self.packs_dir, exist_ok=True)
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(self.root, 'index.db'), timeout=60,
+                                   check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS chunks ('
+                         'hash BLOB PRIMARY KEY, pack TEXT NOT NULL, '
+                         'offset INTEGER NOT NULL, length INTEGER NOT NULL)')
+        self._db.commit()
+
+    def put(self, data):
+        """Salva un chunk se non e' gia' presente; restituisce (hash, byte scritti)."""
+        digest = hashlib.sha256(data).digest()
+        with self._lock:
+            if digest in self._pending or self._db.execute(
+                    'SELECT 1 FROM chunks WHERE hash = ?', (digest,)).fetchone():
+                return digest, 0
+            if self._pack is None or self._pack.tell() >= PACK_SIZE:
+                self._rotate_pack()
+            offset = self._pack.tell()
+            self._pack.write(data)
+            self._pending[digest] = (self._pack_name, offset, len(data))
+            return digest, len(data)
+
+    def get(self, digest):
+        row = self._db.execute('SELECT pack, offset, length FROM chunks WHERE hash = ?', (digest,)).fetchone()
+        if row is None:
+            raise OSError(f"Chunk {digest.hex()} is missing from the store")
+        pack, offset, length = row
+        with open(os.path.join(self.packs_dir, pack), 'rb') as f:
+            f.seek(offset)
+            data = f.read(length)
+        if len(data) != length:
+            raise OSError(f"Pack {pack} is truncated at chunk {digest.hex()}")
+        return data
+
+    def _rotate_pack(self):
+        self._flush()
+        self._pack_name = uuid.uuid4().hex + '.pack'
+        self._pack = open(os.path.join(self.packs_dir, self._pack_name), 'ab')
+
+    def _flush(self):
+        # I chunk entrano nell'indice solo dopo che il pack e' su disco
+        if self._pack is not None:
+            self._pack.flush()
+            os.fsync(self._pack.fileno())
+            self._pack.close()
+            self._pack = None
+        if self._pending:
+            self._db.executemany('INSERT OR IGNORE INTO chunks (hash, pack, offset, length) '
+                                 'VALUES (?, ?, ?, ?)',
+                                 [(digest,) + location for digest, location in self._pending.items()])
+            self._db.commit()
+            self._pending = {}
+
+    def close(self):
+        with self._lock:
+            self._flush()
+        self._db.close()
+
+    def latest_snapshot(self, tag):
+        folder = os.path.join(self.snapshots_dir, tag)
+        try:
+            names = sorted(name for name in os.listdir(folder) if name.endswith('.json.gz'))
+        except FileNotFoundError:
+            return None
+        if not names:
+            return None
+        with gzip.open(os.path.join(folder, names[-1]), 'rt', encoding='utf-8') as f:
+            return json.load(f)
+
+    def write_snapshot(self, tag, files):
+        folder = os.path.join(self.snapshots_dir, tag)
+        os.makedirs(folder, exist_ok=True)
+        created = datetime.datetime.now()
+        path = os.path.join(folder, created.strftime('%Y%m%d-%H%M%S-%f') + '.json.gz')
+        with gzip.open(path + '.tmp', 'wt', encoding='utf-8') as f:
+            json.dump({'created': created.isoformat(), 'files': files}, f)
+        os.replace(path + '.tmp', path)
+        return path
+
+
+class StoreDestination:
+    """Destinazione deduplicata: chunk store in <dest_folder>/store e uno snapshot per esecuzione."""
+    name = 'store'
+    # Niente journal: i chunk gia' salvati restano nello store anche se
+    # l'esecuzione fallisce, quindi ripeterla non riscrive i dati
+    resumable = False
+
+    def __init__(self, dest_folder, tag='default'):
+        self.store = ChunkStore(os.path.join(dest_folder, 'store'))
+        self.tag = tag
+        self.device = None
+        self.previous_files = {}
+        self.files = {}
+
+    def open(self):
+        self.store.open()
+        self.device = os.stat(self.store.root).st_dev
+        snapshot = self.store.latest_snapshot(self.tag)
+        self.previous_files = snapshot['files'] if snapshot else {}
+
+    def needs_copy(self, entry, previous):
+        # Lo snapshot precedente contiene size e mtime: e' lui a dire se il
+        # file e' gia' nello store, indipendentemente dal manifest
+        old = self.previous_files.get(entry.rel_path)
+        return (old is None or old['size'] != entry.stat.st_size
+                or old['mtime_ns'] != entry.stat.st_mtime_ns)
+
+    def prepare(self, entry):
+        pass
+
+    def skip(self, entry):
+        self.files[entry.rel_path] = self.previous_files[entry.rel_path]
+
+    def write(self, entry, progress=None):
+        chunks = []
+        written = 0
+        with open(entry.path, 'rb') as f:
+            for data in iter_chunks(f):
+                digest, stored = self.store.put(data)
+                chunks.append(digest.hex())
+                written += stored
+                if progress:
+                    progress(len(data))
+        self.files[entry.rel_path] = {'size': entry.stat.st_size, 'mtime_ns': entry.stat.st_mtime_ns,
+                                      'mode': entry.stat.st_mode, 'chunks': chunks}
+        return 'store', written
+
+    def verify_target(self, rel_path):
+        record = self.files.get(rel_path)
+        return ('store', self.store.root, record['chunks']) if record else None
+
+    def close(self, success):
+        self.store.close()
+        if success:
+            self.store.write_snapshot(self.tag, self.files)
@@ -0,0 +1,222 @@
+import atexit
+import contextlib
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+# Span per file conservati per l'export Chrome: oltre restano solo gli istogrammi
+MAX_FILE_SPANS = 50000
+LOG_FORMAT = '%(asctime)s %(levelname)s %(threadName)s %(name)s: %(message)s'
+
+logger = logging.getLogger(__name__)
+_listener = None
+
+
+def setup_logging(level='INFO'):
+    """Log dell'applicazione su stderr attraverso una coda.
+
+    Chi scrive accoda il record e prosegue: formattazione e scrittura
+    avvengono nel thread del QueueListener. Sostituisce gli handler gia'
+    presenti sul logger radice (es. quello di logging.basicConfig()).
+    """
+    global _listener
+    if _listener is not None:
+        return
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    # I log delle esecuzioni accettano anche i DEBUG per il loro file: qui no
+    handler.setLevel(level)
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    root = logging.getLogger()
+    for old_handler in root.handlers[:]:
+        root.removeHandler(old_handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+    # Le migrazioni all'avvio non devono riempire il log
+    logging.getLogger('alembic').setLevel(logging.WARNING)
+
+
+class LatencyHistogram:
+    """Latenze in bucket a potenze di due: il bucket k contiene i valori sotto 2**k microsecondi."""
+
+    BUCKETS = 40
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def add(self, duration_ns):
+        bucket = min((duration_ns // 1000).bit_length(), self.BUCKETS - 1)
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total_ns += duration_ns
+        if duration_ns > self.max_ns:
+            self.max_ns = duration_ns
+
+    def percentile(self, fraction):
+        """Limite superiore in microsecondi del bucket che contiene il percentile."""
+        threshold = self.count * fraction
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= threshold:
+                return 2 ** bucket
+        return 0
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'mean_us': round(self.total_ns / self.count / 1000, 1) if self.count else 0,
+            'max_us': round(self.max_ns / 1000, 1),
+            'p50_us': self.percentile(0.5),
+            'p90_us': self.percentile(0.9),
+            'p99_us': self.percentile(0.99),
+            'buckets_us': {2 ** bucket: count for bucket, count in enumerate(self.counts) if count},
+        }
+
+
+class RunTrace:
+    """Tracciamento di un'esecuzione: span temporizzati, istogrammi delle latenze per file e log dedicato.
+
+    Gli span di fase (scan, copy, fsync, database, verify...) vengono sempre
+    registrati; quelli per file fino a MAX_FILE_SPANS, poi solo negli
+    istogrammi. Con log_path i messaggi dell'esecuzione finiscono anche in
+    quel file, scritto da un QueueListener senza bloccare i worker.
+    """
+
+    def __init__(self, name='backup', log_path=None):
+        self.name = name
+        self.log_path = log_path
+        self.logger = logging.getLogger(f'engine.run.{name}')
+        self.started_ns = time.perf_counter_ns()
+        self.started_at = time.time()
+        # (nome, categoria, inizio ns, durata ns, thread, argomenti)
+        self.events = []
+        self.histograms = {}
+        self.dropped_spans = 0
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._handler = None
+        self._listener = None
+        if log_path:
+            os.makedirs(os.path.dirname(log_path) or '.', exist_ok=True)
+            log_queue = queue.SimpleQueue()
+            file_handler = logging.FileHandler(log_path, encoding='utf-8')
+            file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+            self._listener = logging.handlers.QueueListener(log_queue, file_handler)
+            self._listener.start()
+            self._handler = logging.handlers.QueueHandler(log_queue)
+            self.logger.addHandler(self._handler)
+            self.logger.setLevel(logging.DEBUG)
+
+    @contextlib.contextmanager
+    def span(self, name, category='phase', **args):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.record(name, category, start, time.perf_counter_ns() - start, args)
+
+    def observe(self, name, duration_ns):
+        """Aggiunge una latenza all'istogramma name, senza registrare uno span."""
+        with self._lock:
+            self._observe(name, duration_ns)
+
+    def _observe(self, name, duration_ns):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = LatencyHistogram()
+        histogram.add(duration_ns)
+
+    def record(self, name, category, start_ns, duration_ns, args=None):
+        thread = threading.current_thread()
+        with self._lock:
+            if category == 'file':
+                self._observe(name, duration_ns)
+                if len(self.events) >= MAX_FILE_SPANS:
+                    self.dropped_spans += 1
+                    return
+            self._threads.setdefault(thread.ident, thread.name)
+            self.events.append((name, category, start_ns, duration_ns, thread.ident, args))
+
+    def time_file(self, name, start_ns, **args):
+        """Chiude lo span per file iniziato a start_ns (da time.perf_counter_ns())."""
+        self.record(name, 'file', start_ns, time.perf_counter_ns() - start_ns, args)
+
+    def phase_summary(self):
+        phases = {}
+        with self._lock:
+            for name, category, start, duration, thread, args in self.events:
+                if category != 'file':
+                    phases[f'{category}.{name}'] = phases.get(f'{category}.{name}', 0) + duration / 1e9
+        return {name: round(seconds, 4) for name, seconds in phases.items()}
+
+    def latency_summary(self):
+        with self._lock:
+            return {name: histogram.as_dict() for name, histogram in self.histograms.items()}
+
+    def chrome_trace(self):
+        """Eventi nel formato Trace Event, da aprire con chrome://tracing o Perfetto."""
+        pid = os.getpid()
+        with self._lock:
+            events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                      for tid, name in self._threads.items()]
+            for name, category, start, duration, tid, args in self.events:
+                event = {'name': name, 'cat': category, 'ph': 'X', 'pid': pid, 'tid': tid,
+                         'ts': (start - self.started_ns) / 1000, 'dur': duration / 1000}
+                if args:
+                    event['args'] = args
+                events.append(event)
+        return {'traceEvents': events, 'displayTimeUnit': 'ms',
+                'otherData': {'run': self.name, 'started_at': self.started_at,
+                              'dropped_file_spans': self.dropped_spans,
+                              'latency': self.latency_summary()}}
+
+    def export(self, path):
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.chrome_trace(), f)
+        os.replace(path + '.tmp', path)
+
+    def close(self):
+        """Scrive nel log fasi e latenze, poi chiude il file del log."""
+        phases = self.phase_summary()
+        if phases:
+            self.logger.debug("Phase durations (s): %s", json.dumps(phases))
+        for name, histogram in self.latency_summary().items():
+            self.logger.debug("Latency %s: count=%d mean=%.1fus p50<=%dus p90<=%dus p99<=%dus max=%.1fus",
+                             name, histogram['count'], histogram['mean_us'], histogram['p50_us'],
+                             histogram['p90_us'], histogram['p99_us'], histogram['max_us'])
+        if self._handler is not None:
+            self.logger.removeHandler(self._handler)
+            self._listener.stop()
+            self._listener.handlers[0].close()
+            self._handler = None
+
+
+def run_log_path(log_dir, tag, kind='backup', keep=None):
+    """Percorso del log di una nuova esecuzione; con keep elimina i log piu' vecchi dello stesso job."""
+    prefix = f'{kind}-{tag}-'
+    if keep:
+        try:
+            names = sorted(name for name in os.listdir(log_dir) if name.startswith(prefix))
+        except FileNotFoundError:
+            names = []
+        runs = sorted({name.split('.')[0] for name in names})
+        old_runs = set(runs[:max(len(runs) - keep + 1, 0)])
+        for name in names:
+            if name.split('.')[0] in old_runs:
+                try:
+                    os.remove(os.path.join(log_dir, name))
+                except OSError as e:
+                    logger.warning("Cannot remove old log %s: %s", name, e)
+    return os.path.join(log_dir, prefix + datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f') + '.log')
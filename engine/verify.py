@@ -0,0 +1,154 @@
+import hashlib
+import mmap
+import multiprocessing
+import os
+import random
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+VERIFY_MODES = ('off', 'full', 'sample')
+# Il file mappato viene passato all'hash a fette, per non tenere
+# l'intera mappatura in un unico buffer
+HASH_SLICE = 16 * 1024 * 1024
+
+
+def _new_hash():
+    return hashlib.blake2b(digest_size=32)
+
+
+def hash_file(path, drop_cache=False):
+    """Hash BLAKE2b di un file letto tramite mmap.
+
+    Con drop_cache le pagine gia' in cache vengono scartate prima della
+    lettura, cosi' una copia appena scritta viene riletta davvero dal disco.
+    """
+    digest = _new_hash()
+    with open(path, 'rb') as f:
+        fd = f.fileno()
+        size = os.fstat(fd).st_size
+        if drop_cache and hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        if size:
+            with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mapped:
+                if hasattr(mapped, 'madvise'):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+                with memoryview(mapped) as view:
+                    for offset in range(0, size, HASH_SLICE):
+                        digest.update(view[offset:offset + HASH_SLICE])
+    return digest.hexdigest()
+
+
+def hash_store_file(store_root, chunks):
+    """Ricompone un file dallo store e ne calcola l'hash, controllando ogni chunk."""
+    digest = _new_hash()
+    db = sqlite3.connect(os.path.join(store_root, 'index.db'))
+    try:
+        for chunk in chunks:
+            row = db.execute('SELECT pack, offset, length FROM chunks WHERE hash = ?',
+                             (bytes.fromhex(chunk),)).fetchone()
+            if row is None:
+                raise OSError(f"Chunk {chunk} missing from the index")
+            pack, offset, length = row
+            with open(os.path.join(store_root, 'packs', pack), 'rb') as f:
+                f.seek(offset)
+                data = f.read(length)
+            if hashlib.sha256(data).hexdigest() != chunk:
+                raise OSError(f"Chunk {chunk} is corrupted")
+            digest.update(data)
+    finally:
+        db.close()
+    return digest.hexdigest()
+
+
+def hash_archive_member(archive_path, offset, length, codec):
+    """Hash del contenuto di un file salvato in un archivio tar, decompresso."""
+    from engine.archive import iter_member
+
+    digest = _new_hash()
+    for data in iter_member(archive_path, offset, length, codec):
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def _verify_one(task):
+    # Eseguita nei processi del pool: riceve e restituisce solo tipi semplici
+    path, source, target = task
+    source_hash = None
+    if source:
+        try:
+            source_hash = hash_file(path)
+        except OSError:
+            # Sorgente sparito o illeggibile: non c'e' niente con cui confrontare
+            return path, None, None, None, False
+    try:
+        if target[0] == 'store':
+            dest_hash = hash_store_file(target[1], target[2])
+        elif target[0] == 'archive':
+            dest_hash = hash_archive_member(*target[1:])
+        else:
+            dest_hash = hash_file(target[1], drop_cache=True)
+    except OSError as e:
+        return path, source_hash, None, str(e), True
+    return path, source_hash, dest_hash, None, True
+
+
+class VerifyItem:
+    __slots__ = ('path', 'target', 'expected')
+
+    def __init__(self, path, target, expected=None):
+        self.path = path
+        # ('file', percorso della copia), ('store', radice dello store, chunk)
+        # oppure ('archive', archivio, offset, lunghezza, compressione)
+        self.target = target
+        # Hash registrato dal manifest quando il sorgente non e' cambiato da allora
+        self.expected = expected
+
+
+class VerifyReport:
+    def __init__(self):
+        self.files_verified = 0
+        # path -> hash del contenuto verificato, da salvare nel manifest
+        self.digests = {}
+        # (path, errore di lettura o None se il contenuto e' diverso, hash atteso, hash trovato)
+        self.mismatches = []
+        self.seconds = 0.0
+
+
+def select_sample(items, fraction, rng=random):
+    """Sottoinsieme casuale: ogni file ha probabilita' fraction di essere scelto."""
+    return [item for item in items if rng.random() < fraction]
+
+
+def verify_files(items, workers=None, chunksize=16):
+    """Confronta le copie con i sorgenti usando un pool di processi.
+
+    Se un elemento ha un hash atteso il sorgente non viene riletto: basta
+    hashare la copia. Altrimenti si hashano entrambi e, se coincidono,
+    l'hash viene restituito per essere salvato come riferimento.
+    """
+    report = VerifyReport()
+    if not items:
+        return report
+    started = time.monotonic()
+    by_path = {item.path: item for item in items}
+    tasks = [(item.path, item.expected is None, item.target) for item in items]
+    # spawn: il processo principale ha thread (Qt, scheduler, copie) e un
+    # fork ne erediterebbe lock in stato incoerente
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=context) as pool:
+        for path, source_hash, dest_hash, error, checked in pool.map(_verify_one, tasks,
+                                                                     chunksize=chunksize):
+            if not checked:
+                continue
+            item = by_path[path]
+            report.files_verified += 1
+            expected = item.expected or source_hash
+            if error is not None:
+                report.mismatches.append((path, error, expected, None))
+            elif dest_hash != expected:
+                report.mismatches.append((path, None, expected, dest_hash))
+            else:
+                report.digests[path] = dest_hash
+    report.seconds = time.monotonic() - started
+    return report
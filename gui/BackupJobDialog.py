@@ -1,6 +1,13 @@
-from PyQt5.QtWidgets import QDialog, QVBoxLayout, QPushButton, QLineEdit, QTimeEdit, QCheckBox, QHBoxLayout, QLabel, QTextEdit, QFileDialog, QTableWidget, QTableWidgetItem, QHeaderView
+import logging
+
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QPushButton, QLineEdit, QTimeEdit, QCheckBox, QHBoxLayout, QLabel, QTextEdit, QFileDialog, QTableWidget, QTableWidgetItem, QHeaderView, QComboBox, QMessageBox
 from PyQt5.QtCore import QTime, pyqtSignal, pyqtSlot
-from db.models import Session, BackupJob, Path, EmailAddress
+from db.models import Session, BackupJob, Path, EmailAddress, FilterRule, Destination
+from engine.filters import parse_rules
+from engine.inotify import inotify_available
+from engine.manifest import clear_manifest
+
+logger = logging.getLogger(__name__)
 
 class BackupJobDialog(QDialog):
     backup_job_saved = pyqtSignal(BackupJob)
@@ -35,6 +42,40 @@ class BackupJobDialog(QDialog):
         self.dest_button.clicked.connect(self.select_dest_folder)
         layout.addWidget(self.dest_button)
 
+        # Destinazioni aggiuntive: ricevono gli stessi file, letti una sola volta dalla sorgente
+        self.extra_dest_button = QPushButton('Aggiungi destinazione aggiuntiva')
+        self.extra_dest_button.clicked.connect(self.add_extra_destination)
+        layout.addWidget(self.extra_dest_button)
+
+        self.extra_dest_table = QTableWidget(0, 1)
+        self.extra_dest_table.setHorizontalHeaderLabels(['Destinazioni aggiuntive'])
+        self.extra_dest_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        layout.addWidget(self.extra_dest_table)
+
+        self.remove_extra_dest_button = QPushButton('Rimuovi destinazione selezionata')
+        self.remove_extra_dest_button.clicked.connect(self.remove_extra_destination)
+        layout.addWidget(self.remove_extra_dest_button)
+
+        self.dest_format_combo = QComboBox()
+        self.dest_format_combo.addItem('Copia semplice', 'mirror')
+        self.dest_format_combo.addItem('Archivio deduplicato', 'store')
+        self.dest_format_combo.addItem('Snapshot con hardlink', 'snapshot')
+        self.dest_format_combo.addItem('Archivio tar compresso', 'archive')
+        layout.addWidget(self.dest_format_combo)
+
+        self.mirror_deletions_checkbox = QCheckBox('Rimuovi dalla copia i file eliminati alla sorgente')
+        layout.addWidget(self.mirror_deletions_checkbox)
+        # Vale solo per la copia semplice: snapshot e archivio conservano le versioni precedenti
+        self.dest_format_combo.currentIndexChanged.connect(
+            lambda: self.mirror_deletions_checkbox.setEnabled(self.dest_format_combo.currentData() == 'mirror'))
+
+        layout.addWidget(QLabel('Regole di esclusione'))
+        self.filter_rules_edit = QTextEdit()
+        self.filter_rules_edit.setPlaceholderText(
+            "Una regola per riga, come in .gitignore: node_modules/, *.tmp, !importante.tmp\n"
+            "Limiti sui file: size>2G, age>365d")
+        layout.addWidget(self.filter_rules_edit)
+
         self.time_edit = QTimeEdit(self)
         self.time_edit.setTime(QTime.currentTime())
         layout.addWidget(self.time_edit)
@@ -49,6 +90,10 @@ class BackupJobDialog(QDialog):
             self.days_layout.addWidget(checkbox)
         layout.addLayout(self.days_layout)
 
+        self.continuous_checkbox = QCheckBox('Backup continuo: copia le modifiche appena avvengono')
+        self.continuous_checkbox.setEnabled(inotify_available())
+        layout.addWidget(self.continuous_checkbox)
+
         self.send_email_checkbox = QCheckBox('Invia email al termine')
         layout.addWidget(self.send_email_checkbox)
 
@@ -64,6 +109,7 @@ class BackupJobDialog(QDialog):
 
         self.source_paths = []
         self.dest_folder = ""
+        self.extra_folders = []
 
     def select_source_paths(self):
         options = QFileDialog.Options()
@@ -88,6 +134,25 @@ class BackupJobDialog(QDialog):
         folder = QFileDialog.getExistingDirectory(self, 'Seleziona cartella di destinazione')
         self.dest_folder = folder
 
+    def add_extra_destination(self):
+        folder = QFileDialog.getExistingDirectory(self, 'Seleziona destinazione aggiuntiva')
+        if folder and folder != self.dest_folder and folder not in self.extra_folders:
+            self.extra_folders.append(folder)
+            self.update_extra_dest_table()
+
+    def remove_extra_destination(self):
+        row = self.extra_dest_table.currentRow()
+        if row >= 0:
+            del self.extra_folders[row]
+            self.update_extra_dest_table()
+
+    def update_extra_dest_table(self):
+        self.extra_dest_table.setRowCount(0)
+        for folder in self.extra_folders:
+            row_position = self.extra_dest_table.rowCount()
+            self.extra_dest_table.insertRow(row_position)
+            self.extra_dest_table.setItem(row_position, 0, QTableWidgetItem(folder))
+
     def load_backup_job(self):
         if self.backup_job:
             self.name_edit.setText(self.backup_job.name)
@@ -95,6 +160,12 @@ class BackupJobDialog(QDialog):
             self.source_paths = [path.path for path in self.backup_job.paths]
             self.update_source_table()
             self.dest_folder = self.backup_job.dest_folder
+            self.extra_folders = [extra.folder for extra in self.backup_job.extra_destinations]
+            self.update_extra_dest_table()
+            self.dest_format_combo.setCurrentIndex(self.dest_format_combo.findData(self.backup_job.dest_format))
+            self.mirror_deletions_checkbox.setChecked(bool(self.backup_job.mirror_deletions))
+            self.continuous_checkbox.setChecked(bool(self.backup_job.continuous))
+            self.filter_rules_edit.setPlainText('\n'.join(rule.pattern for rule in self.backup_job.filter_rules))
 
             if self.backup_job.days:
                 selected_days = self.backup_job.days.split(',')
@@ -106,7 +177,7 @@ class BackupJobDialog(QDialog):
             email_addresses = [email.email for email in self.backup_job.email_addresses]
             self.email_addresses_edit.setText(','.join(email_addresses))
         else:
-            print("No backup job selected.")
+            logger.debug("No backup job selected.")
 
     def save_backup_job(self):
         name = self.name_edit.text()
@@ -115,24 +186,51 @@ class BackupJobDialog(QDialog):
         days_str = ','.join(selected_days)
         send_email = self.send_email_checkbox.isChecked()
         email_addresses = self.email_addresses_edit.toPlainText().split(',')
+        dest_format = self.dest_format_combo.currentData()
+        mirror_deletions = self.mirror_deletions_checkbox.isChecked()
+        continuous = self.continuous_checkbox.isChecked()
+        try:
+            filter_rules = parse_rules(self.filter_rules_edit.toPlainText().splitlines())
+        except ValueError as e:
+            QMessageBox.warning(self, 'Regole di esclusione', str(e))
+            return
 
         if self.backup_job:
             # Recupera l'oggetto dalla sessione corrente
             backup_job = self.session.merge(self.backup_job)
-            print(f"Backup job da save backup job: {name}")
+            logger.debug("Backup job da save backup job: %s", name)
+            # Con una nuova destinazione il manifest non descrive piu' il suo contenuto
+            if backup_job.dest_folder != self.dest_folder or backup_job.dest_format != dest_format:
+                clear_manifest(self.session, backup_job.id)
+            # Le destinazioni gia' presenti conservano il loro stato; con un
+            # altro formato vanno riscritte tutte
+            for extra in list(backup_job.extra_destinations):
+                if extra.folder not in self.extra_folders:
+                    backup_job.extra_destinations.remove(extra)
+                elif backup_job.dest_format != dest_format:
+                    extra.last_success_at = None
+            existing_folders = {extra.folder for extra in backup_job.extra_destinations}
+            for folder in self.extra_folders:
+                if folder not in existing_folders:
+                    backup_job.extra_destinations.append(Destination(folder=folder))
+
             # Aggiorna i campi
             backup_job.name = name
             backup_job.dest_folder = self.dest_folder
             backup_job.schedule_time = schedule_time  # Aggiorna il campo schedule_time
             backup_job.days = days_str
             backup_job.send_email = send_email
+            backup_job.dest_format = dest_format
+            backup_job.mirror_deletions = mirror_deletions
+            backup_job.continuous = continuous
 
             # Debug: verifica che l'orario venga aggiornato
-            print(f"Updating backup job: {backup_job.schedule_time}")
+            logger.debug("Updating backup job: %s", backup_job.schedule_time)
 
             # Pulisci le relazioni esistenti
             backup_job.paths.clear()
             backup_job.email_addresses.clear()
+            backup_job.filter_rules.clear()
 
             # Aggiungi i nuovi percorsi
             for path in self.source_paths:
@@ -142,10 +240,13 @@ class BackupJobDialog(QDialog):
             for email in email_addresses:
                 backup_job.email_addresses.append(EmailAddress(email=email.strip()))
 
+            for position, rule in enumerate(filter_rules):
+                backup_job.filter_rules.append(FilterRule(pattern=rule, position=position))
+
             # Salva le modifiche
             self.session.commit()
             self.backup_job_saved.emit(backup_job)
-            print("Signal backup_job_saved emitted")
+            logger.debug("Signal backup_job_saved emitted")
             self.accept()
         else:
             # Crea un nuovo BackupJob e aggiungi le relazioni
@@ -154,20 +255,29 @@ class BackupJobDialog(QDialog):
                 dest_folder=self.dest_folder,
                 schedule_time=schedule_time,
                 days=days_str,
-                send_email=send_email
+                send_email=send_email,
+                dest_format=dest_format,
+                mirror_deletions=mirror_deletions,
+                continuous=continuous
             )
 
             for path in self.source_paths:
                 backup_job.paths.append(Path(path=path))
 
+            for folder in self.extra_folders:
+                backup_job.extra_destinations.append(Destination(folder=folder))
+
             for email in email_addresses:
                 backup_job.email_addresses.append(EmailAddress(email=email.strip()))
 
+            for position, rule in enumerate(filter_rules):
+                backup_job.filter_rules.append(FilterRule(pattern=rule, position=position))
+
             # Aggiungi il nuovo BackupJob alla sessione
             self.session.add(backup_job)
             self.session.commit()
             self.backup_job_saved.emit(backup_job)
-            print("Signal backup_job_saved emitted")
+            logger.debug("Signal backup_job_saved emitted")
             self.accept()
 
 
@@ -1,101 +1,124 @@
-import datetime
+import logging
 import os
-import shutil
-import smtplib
 import sys
-import threading
-import time
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-import schedule
 from PyQt5.QtCore import QThread, pyqtSignal, Qt, QCoreApplication
 from PyQt5.QtGui import QIcon, QMovie, QPixmap
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QVBoxLayout,
                              QHBoxLayout, QWidget, QTreeWidget,
                              QTreeWidgetItem, QLabel, QProgressBar,
                              QDialog, QAction, QPushButton, QSplitter,
-                             QSystemTrayIcon, QMenu, QMessageBox
+                             QSystemTrayIcon, QMenu, QMessageBox, QFileDialog,
+                             QInputDialog
                              )
-from dotenv import load_dotenv
 
-from db.models import Session, BackupJob, create_tables
+from db.models import Session, BackupJob, BackupRun, create_tables, get_job
+from engine.run_queue import RunQueue, PRIORITY_MANUAL, PRIORITY_SCHEDULED
+from engine.runner import restore_backup, run_backup, verify_backup
+from engine.scheduler import JobScheduler
+from engine.settings import load_settings
 from gui.BackupJobDialog import BackupJobDialog
 
-load_dotenv()
-EMAIL_USER = os.getenv('EMAIL_USER')
-EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD')
+settings = load_settings()
+settings.setup_logging()
+logger = logging.getLogger('main')
 
 
 class BackupThread(QThread):
-    progress = pyqtSignal(int)
-    current_file = pyqtSignal(str)
+    # ProgressSnapshot, emesso al massimo qualche volta al secondo
+    progress = pyqtSignal(object)
     finished = pyqtSignal(bool)
 
-    def __init__(self, source_paths, dest_folder, email_addresses):
+    def __init__(self, source_paths, dest_folder, email_addresses, backup_job_id=None, dest_format='mirror',
+                 changed_paths=None):
         super().__init__()
+        self.backup_job_id = backup_job_id
+        self.dest_format = dest_format
+        # Backup continuo: solo i percorsi modificati (None = scansione completa)
+        self.changed_paths = changed_paths
         self.source_paths = source_paths
         self.dest_folder = dest_folder
         self.email_addresses = email_addresses
         self._stop_requested = False
+        self.stats = None
+
+    def stop(self):
+        self._stop_requested = True
 
     def run(self):
+        session = Session()
         try:
-            self.dest_folder = os.path.join(self.dest_folder, 'backup')
-            if not os.path.exists(self.dest_folder):
-                os.makedirs(self.dest_folder)
-
-            total_files = 0
-            for source_path in self.source_paths:
-                if os.path.isdir(source_path):
-                    for _, _, files in os.walk(source_path):
-                        total_files += len(files)
-                elif os.path.isfile(source_path):
-                    total_files += 1
-
-            print(f"Total files to copy: {total_files}")
-
-            copied_files = 0
-
-            for source_path in self.source_paths:
-                if os.path.isdir(source_path):
-                    for root, _, files in os.walk(source_path):
-                        relative_path = os.path.relpath(root, source_path)
-                        dest_dir = os.path.join(str(self.dest_folder), str(relative_path))
-
-                        if not os.path.exists(dest_dir):
-                            os.makedirs(dest_dir)
-
-                        for file in files:
-                            if self._stop_requested:
-                                self.finished.emit(False)
-                                return
-
-                            src_file = os.path.join(root, file)
-                            dest_file = os.path.join(dest_dir, file)
-
-                            print(f"Copying file from {src_file} to {dest_file}")
-                            if not os.path.exists(dest_file) or os.path.getmtime(src_file) > os.path.getmtime(
-                                    dest_file):
-                                shutil.copy2(str(src_file), str(dest_file))
-                                copied_files += 1
-                                self.progress.emit(int(copied_files / total_files * 100))
-                                self.current_file.emit(src_file)
-
-                elif os.path.isfile(source_path):
-                    dest_file = os.path.join(self.dest_folder, os.path.basename(source_path))
-                    shutil.copy2(source_path, dest_file)
-                    copied_files += 1
-                    self.progress.emit(int(copied_files / total_files * 100))
-                    self.current_file.emit(source_path)
-
-            self.finished.emit(True)
+            success, self.stats = run_backup(
+                session, self.backup_job_id, self.source_paths, self.dest_folder, self.dest_format,
+                progress=self.progress.emit,
+                should_stop=lambda: self._stop_requested,
+                changed_paths=self.changed_paths,
+                **settings.engine_options())
+            logger.info("Backup stats: %s", self.stats)
+            self.finished.emit(success)
         except Exception as e:
-            print(f"Error during backup: {e}")
+            logger.exception("Error during backup: %s", e)
             self.finished.emit(False)
             raise
+        finally:
+            session.close()
+
+
+class VerifyThread(QThread):
+    finished = pyqtSignal(object)
+
+    def __init__(self, backup_job_id, source_paths, dest_folder, dest_format):
+        super().__init__()
+        self.backup_job_id = backup_job_id
+        self.source_paths = source_paths
+        self.dest_folder = dest_folder
+        self.dest_format = dest_format
+
+    def run(self):
+        session = Session()
+        report = None
+        try:
+            report = verify_backup(session, self.backup_job_id, self.source_paths, self.dest_folder,
+                                   self.dest_format, workers=settings.verify_workers)
+        except Exception as e:
+            logger.exception("Error during verification: %s", e)
+        finally:
+            session.close()
+            self.finished.emit(report)
+
+
+class RestoreThread(QThread):
+    progress = pyqtSignal(object)
+    # (successo, statistiche, errori)
+    finished = pyqtSignal(bool, object, object)
+
+    def __init__(self, backup_job_id, source_paths, dest_folder, dest_format, target_folder, patterns):
+        super().__init__()
+        self.backup_job_id = backup_job_id
+        self.source_paths = source_paths
+        self.dest_folder = dest_folder
+        self.dest_format = dest_format
+        self.target_folder = target_folder
+        self.patterns = patterns
+
+    def run(self):
+        session = Session()
+        result = (False, None, [])
+        try:
+            result = restore_backup(session, self.backup_job_id, self.source_paths, self.dest_folder,
+                                    self.dest_format, self.target_folder, self.patterns,
+                                    progress=self.progress.emit, **settings.restore_options())
+        except Exception as e:
+            logger.exception("Error during restore: %s", e)
+            result = (False, None, [(self.target_folder, str(e))])
+        finally:
+            session.close()
+            self.finished.emit(*result)
 
 
 class MainWindow(QMainWindow):
+    # Emesso dal thread dello scheduler, gestito nel thread della GUI
+    backup_due = pyqtSignal(int)
+
     def __init__(self):
         super().__init__()
         # Configura la system tray
@@ -115,31 +138,55 @@ class MainWindow(QMainWindow):
         self.tray_icon.setContextMenu(tray_menu)
 
         create_tables()
-        self.scheduler_thread_running = True
-        self.last_check_time = 0
-        self.check_interval = 30  # 1 minuto
 
         self.current_backup_job_id = None
-        self.backup_thread = None
+        # Backup in esecuzione (job_id -> BackupThread), avviati dalla coda
+        self.backup_threads = {}
+        # Ultimo avanzamento di ogni backup in corso (job_id -> (nome, ProgressSnapshot))
+        self.backup_progress = {}
+        # Verifiche su richiesta in corso (job_id -> VerifyThread)
+        self.verify_threads = {}
+        # Ripristini in corso (job_id -> RestoreThread)
+        self.restore_threads = {}
+        self.run_queue = RunQueue(self.launch_backup, max_concurrent=settings.max_concurrent_runs,
+                                  per_destination=settings.max_runs_per_destination)
         self.setWindowTitle("Backup Manager")
         icon_path = os.path.abspath('icons/backup.ico')
         if os.path.exists(icon_path):
             self.setWindowIcon(QIcon(icon_path))
-            print("Icon set successfully.")
+            logger.debug("Icon set successfully.")
         else:
-            print(f"Icon not found at {icon_path}")
+            logger.warning("Icon not found at %s", icon_path)
 
         self.setGeometry(450, 150, 1000, 750)
         self.initUI()
         self.session = Session()
         self.load_backup_jobs()
 
-        # Flag per il controllo dello stato del thread
-        self.scheduler_thread_running = True
-        # Avvia il thread dello scheduler
-        self.scheduler_thread = threading.Thread(target=self.run_scheduler, daemon=True)
-        self.scheduler_thread.start()
-        print("Scheduler thread started")
+        self.notifier = settings.create_notifier()
+        self.notifier.start()
+
+        # Avvia lo scheduler: dorme fino alla prossima scadenza
+        self.backup_due.connect(self.start_scheduled_backup)
+        self.scheduler = JobScheduler(self.backup_due.emit)
+        # Backup continuo: le modifiche ai file segnalano il job come lo scheduler
+        self.watcher = settings.create_watcher(self.backup_due.emit)
+        for job in self.session.query(BackupJob).all():
+            self.scheduler.set_job(job.id, job.schedule_time, job.days)
+            if job.continuous:
+                self.watch_job(job)
+        self.scheduler.start()
+        logger.info("Scheduler thread started")
+
+    def watch_job(self, job):
+        if not job.continuous or not self.watcher.available():
+            self.watcher.remove_job(job.id)
+            return
+        try:
+            self.watcher.set_job(job.id, [path.path for path in job.paths],
+                                 [rule.pattern for rule in job.filter_rules])
+        except OSError as e:
+            logger.warning("Cannot watch backup job %s: %s", job.name, e)
 
     def initUI(self):
         # self.setStyleSheet("background-color: white;")
@@ -217,6 +264,16 @@ class MainWindow(QMainWindow):
         self.start_backup_btn.hide()  # Nascondi il pulsante all'avvio
         right_layout.addWidget(self.start_backup_btn)
 
+        self.verify_backup_btn = QPushButton('Verifica Backup')
+        self.verify_backup_btn.clicked.connect(self.verify_backup_job)
+        self.verify_backup_btn.hide()
+        right_layout.addWidget(self.verify_backup_btn)
+
+        self.restore_backup_btn = QPushButton('Ripristina Backup')
+        self.restore_backup_btn.clicked.connect(self.restore_backup_job)
+        self.restore_backup_btn.hide()
+        right_layout.addWidget(self.restore_backup_btn)
+
         # Aggiungi lo spinner centrato
         spinner_layout = QHBoxLayout()  # Layout per centrare lo spinner orizzontalmente
         self.spinner_label = QLabel(self)
@@ -284,25 +341,28 @@ class MainWindow(QMainWindow):
         return bottom_layout
 
     def on_backup_job_saved(self, backup_job):
-        print("Chiamato")
+        logger.debug("Chiamato")
+        # Ricalcola subito la prossima esecuzione del job
+        self.scheduler.set_job(backup_job.id, backup_job.schedule_time, backup_job.days)
+        self.watch_job(self.session.get(BackupJob, backup_job.id))
         # Logica per aggiornare la UI della finestra principale
-        print(f"Backup job {backup_job.name} salvato correttamente.")
+        logger.debug("Backup job %s salvato correttamente.", backup_job.name)
 
         # Memorizza l'elemento selezionato
         current_item = self.tree_widget.currentItem()
-        print(f"Current item: {current_item}")
+        logger.debug("Current item: %s", current_item)
         # Aggiorna la lista dei backup jobs
         self.details_label.clear()
         self.update_backup_job_list()
 
         # Reseleziona l'elemento precedentemente selezionato
         if current_item:
-            print(f"current_item: {current_item}")
+            logger.debug("current_item: %s", current_item)
             items = self.tree_widget.findItems(backup_job.name, Qt.MatchExactly)
-            print(f"items: {items}")
+            logger.debug("items: %s", items)
             if items:
                 item = items[0]
-                print(f"item: {item}")
+                logger.debug("item: %s", item)
                 self.tree_widget.setCurrentItem(item)
                 self.display_backup_details(item)
 
@@ -313,11 +373,11 @@ class MainWindow(QMainWindow):
         self.tree_widget.clear()
         backup_jobs = self.session.query(BackupJob).all()
         for job in backup_jobs:
-            print(f"Sto caricando il Backup job: {job.name}")
+            logger.debug("Sto caricando il Backup job: %s", job.name)
             item = QTreeWidgetItem([job.name])
             item.setData(0, 1, job.id)
             self.tree_widget.addTopLevelItem(item)
-        print("Backup jobs loaded")
+        logger.debug("Backup jobs loaded")
 
     def display_backup_details(self, item):
         job_id = item.data(0, 1)
@@ -333,8 +393,47 @@ class MainWindow(QMainWindow):
                        f"{', '.join([email.email for email in backup_job.email_addresses])}\n"
                        f"Ultima esecuzione: {last_run_formatted}\n"
                        f"Numero di esecuzioni: {backup_job.run_count or 0}")
+            for extra in backup_job.extra_destinations:
+                details += f"\nDestinazione aggiuntiva: {extra.describe(backup_job.last_run_date)}"
+            next_run = self.scheduler.next_run(backup_job.id)
+            details += f"\nProssima esecuzione: {next_run.strftime('%d/%m/%Y %H:%M') if next_run else 'Non pianificata'}"
+            if backup_job.snapshots:
+                last_snapshot = backup_job.snapshots[-1]
+                details += (f"\nSnapshot: {len(backup_job.snapshots)}, ultimo: "
+                            f"{last_snapshot.created_at.strftime('%d/%m/%Y %H:%M')} "
+                            f"({last_snapshot.files_copied} copiati, {last_snapshot.files_linked} collegati)")
+            runs = backup_job.runs.order_by(BackupRun.started_at.desc()).limit(20).all()
+            if runs:
+                details += "\n\n" + self.format_run_history(runs[::-1])
+            failures = backup_job.verify_failures.count()
+            if failures:
+                details += f"\n\nCopie non corrispondenti rilevate: {failures}"
             self.details_label.setText(details)
             self.start_backup_btn.show()
+            self.verify_backup_btn.show()
+            self.restore_backup_btn.show()
+
+    @staticmethod
+    def format_run_history(runs, limit=10):
+        # runs: le esecuzioni piu' recenti, in ordine cronologico
+        lines = ["Ultime esecuzioni:"]
+        for run in reversed(runs[-limit:]):
+            throughput = run.throughput
+            lines.append(f"{run.started_at.strftime('%d/%m/%Y %H:%M')}  "
+                         f"{'OK' if run.success else 'ERRORE'}  "
+                         f"{run.duration or 0:.0f}s  "
+                         f"{run.files_copied or 0}/{run.files_scanned or 0} file  "
+                         f"{(run.bytes_copied or 0) / 1024 / 1024:.1f} MB  "
+                         f"{throughput / 1024 / 1024 if throughput else 0:.1f} MB/s")
+
+        # Confronta la velocita' media delle ultime 5 esecuzioni riuscite con le 5 precedenti
+        rates = [run.throughput for run in runs if run.success and run.throughput]
+        if len(rates) >= 10:
+            recent = sum(rates[-5:]) / 5
+            before = sum(rates[-10:-5]) / 5
+            lines.append(f"Andamento velocita': {(recent - before) / before * 100:+.0f}% "
+                         f"rispetto alle 5 esecuzioni precedenti")
+        return "\n".join(lines)
 
     def edit_backup_job(self, item=None):
         if item is not None:
@@ -349,9 +448,9 @@ class MainWindow(QMainWindow):
                 if dialog.exec_() == QDialog.Accepted:
                     self.load_backup_jobs()
             else:
-                print("Backup job not found.")
+                logger.warning("Backup job not found.")
         else:
-            print("No item provided.")
+            logger.debug("No item provided.")
 
     def open_backup_job_dialog(self, backup_job=None):
         dialog = BackupJobDialog(backup_job, self)
@@ -359,157 +458,166 @@ class MainWindow(QMainWindow):
         dialog.exec_()
 
     def start_backup_job(self):
-        if hasattr(self, 'current_backup_job_id'):
-            print("Starting backup job...")
-            backup_job_id = self.current_backup_job_id
-            backup_job = self.session.get(BackupJob, backup_job_id)
+        if self.current_backup_job_id:
+            backup_job = self.session.get(BackupJob, self.current_backup_job_id)
             if backup_job:
-                source_paths = [path.path for path in backup_job.paths]
-                email_addresses = [email.email for email in backup_job.email_addresses]
-                print(f"Source paths: {source_paths}")
-                print(f"Destination folder: {backup_job.dest_folder}")
-
-                # Mostra lo spinner e avvia l'animazione
-                self.spinner_label.show()
-                self.spinner_movie.start()
+                logger.debug("Starting backup job...")
                 self.start_backup_btn.hide()
-                self.update_tray_icon(True)
-
-                # Stop any existing backup thread
-                if self.backup_thread and self.backup_thread.isRunning():
-                    self.backup_thread.stop()
-                    self.backup_thread.wait()
-
-                # Start a new backup thread
-                self.backup_thread = BackupThread(source_paths, backup_job.dest_folder, email_addresses)
-                self.backup_thread.progress.connect(self.progress_bar.setValue)
-                self.backup_thread.current_file.connect(self.details_label.setText)
-                self.backup_thread.finished.connect(self.backup_finished)
-                self.backup_thread.start()
+                # Avvio manuale: sempre una scansione completa, anche per i job continui
+                self.watcher.request_full(backup_job.id)
+                status = self.run_queue.submit(backup_job.id, backup_job.dest_folder, PRIORITY_MANUAL)
+                if status == 'running':
+                    self.details_label.setText(f"Backup {backup_job.name} gia' in esecuzione.")
+                elif backup_job.id not in self.backup_threads:
+                    self.details_label.setText(f"Backup {backup_job.name} in coda.")
             else:
-                print("Backup job not found.")
+                logger.warning("Backup job not found.")
         else:
-            print("No backup job selected.")
+            logger.debug("No backup job selected.")
 
-    def backup_finished(self, success):
-        self.details_label.setText("Backup completato con successo." if success else "Backup fallito.")
-        if success and self.current_backup_job_id:
-            backup_job = self.session.get(BackupJob, self.current_backup_job_id)
-            if backup_job:
-                # Aggiorna la data dell'ultima esecuzione
-                backup_job.last_run_date = datetime.datetime.now()
-
-                # Incrementa il contatore delle esecuzioni
-                if backup_job.run_count is None:
-                    backup_job.run_count = 0
-                backup_job.run_count += 1
-
-                # Salva le modifiche nel database
-                self.session.commit()
-                email_addresses = [email.email for email in backup_job.email_addresses] if backup_job else []
-                self.send_email(True, email_addresses)
-        else:
-            self.send_email(False, [])
-
-        self.spinner_label.hide()
-        self.spinner_movie.stop()
-        self.update_tray_icon(False)
+    def start_scheduled_backup(self, job_id):
+        job = self.session.get(BackupJob, job_id)
+        if job is None:
+            return
+        logger.info("Backup scheduled for job: %s", job.name)
+        self.run_queue.submit(job.id, job.dest_folder, PRIORITY_SCHEDULED)
+
+    def launch_backup(self, job_id):
+        # Chiamato dalla coda quando il job puo' partire
+        job = get_job(self.session, job_id)
+        if job is None:
+            self.run_queue.finished(job_id)
+            return
+        source_paths = [path.path for path in job.paths]
+        email_addresses = [email.email for email in job.email_addresses]
+        logger.info("Starting backup for job: %s", job.name)
+        logger.debug("Source paths: %s", source_paths)
+        logger.debug("Destination folder: %s", job.dest_folder)
+
+        # Mostra lo spinner e avvia l'animazione
+        self.spinner_label.show()
+        self.spinner_movie.start()
+        self.update_tray_icon(True)
+
+        changed_paths = self.watcher.take_changes(job.id) if job.continuous else None
+        thread = BackupThread(source_paths, job.dest_folder, email_addresses, job.id, job.dest_format,
+                              changed_paths)
+        thread.progress.connect(lambda snapshot, job_id=job.id, name=job.name:
+                                self.update_progress(job_id, name, snapshot))
+        thread.finished.connect(lambda success, job_id=job.id: self.backup_finished(success, job_id))
+        # Mantiene un riferimento al thread finche' e' in esecuzione
+        self.backup_threads[job.id] = thread
+        thread.start()
 
+    def verify_backup_job(self):
+        job = get_job(self.session, self.current_backup_job_id) if self.current_backup_job_id else None
+        if job is None:
+            return
+        if self.run_queue.is_busy(job.id) or job.id in self.verify_threads:
+            QMessageBox.information(self, "Verifica", f"Il backup {job.name} e' in uso, riprova piu' tardi.")
+            return
+        self.details_label.setText(f"Verifica di {job.name} in corso...")
+        thread = VerifyThread(job.id, [path.path for path in job.paths], job.dest_folder, job.dest_format)
+        thread.finished.connect(lambda report, job_id=job.id, name=job.name:
+                                self.verify_finished(job_id, name, report))
+        self.verify_threads[job.id] = thread
+        thread.start()
 
-    @staticmethod
-    def send_email(success, email_addresses):
-        sender_email = EMAIL_USER
-        password = EMAIL_PASSWORD
-
-        for email_address in email_addresses:
-            receiver_email = email_address.strip()
-
-            message = MIMEMultipart("alternative")
-            message["Subject"] = "Backup Completed" if success else "Backup Failed"
-            message["From"] = sender_email
-            message["To"] = receiver_email
-
-            text = "Your backup has completed successfully." if success else "Your backup has failed."
-            part = MIMEText(text, "plain")
-            message.attach(part)
-
-            try:
-                with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-                    server.login(sender_email, password)
-                    server.sendmail(
-                        sender_email, receiver_email, message.as_string()
-                    )
-            except Exception as e:
-                print(f"Failed to send email: {e}")
-
-
-    def run_scheduler(self):
-        print("Scheduler thread running")
-        while self.scheduler_thread_running:
-            current_time = time.time()
-            elapsed_time = current_time - self.last_check_time
-            print(f"Current time: {current_time}")
-            print(f"Last check time: {self.last_check_time}")
-            print(f"Elapsed time: {elapsed_time}")
-
-            if current_time - self.last_check_time >= self.check_interval:
-                print("Checking backup jobs")
-                for job in self.session.query(BackupJob).all():
-                    if self.is_backup_due(job):
-                        print(f"Starting backup for job: {job.name}")
-                        # self.start_scheduled_backup(job)
-                        # Avvia il backup in un nuovo thread
-                        thread = BackupThread([path.path for path in job.paths], job.dest_folder,
-                                              [email.email for email in job.email_addresses])
-                        thread.progress.connect(self.progress_bar.setValue)
-                        thread.current_file.connect(self.details_label.setText)
-                        thread.finished.connect(self.backup_finished)
-                        thread.start()
-                self.last_check_time = current_time
-
-            schedule.run_pending()
-            time.sleep(1)
-
-    def is_backup_due(self, job):
-        now = datetime.datetime.now()
-
-        # Ottieni il giorno della settimana corrente in italiano con la prima lettera maiuscola
-        current_day_english = now.strftime("%A")  # Giorno in inglese, e.g., 'Sunday'
-        current_day_capitalized = current_day_english.capitalize()  # Giorno con la prima lettera maiuscola
-
-        print(f"Current day in English: {current_day_capitalized}")
-
-        current_time = now.strftime("%H:%M")
-        try:
-            scheduled_time = datetime.datetime.strptime(job.schedule_time, "%H:%M").strftime("%H:%M")
-        except ValueError as e:
-            print(f"Error parsing scheduled_time: {e}")
-            return False
+    def verify_finished(self, job_id, job_name, report):
+        self.verify_threads.pop(job_id, None)
+        if report is None:
+            QMessageBox.warning(self, "Verifica", f"Verifica di {job_name} non riuscita.")
+        elif report.mismatches:
+            paths = "\n".join(path for path, *_ in report.mismatches[:20])
+            QMessageBox.warning(self, "Verifica",
+                                f"{len(report.mismatches)} copie su {report.files_verified} non corrispondono "
+                                f"ai sorgenti:\n{paths}")
+        else:
+            QMessageBox.information(self, "Verifica",
+                                    f"{report.files_verified} file verificati, nessuna differenza.")
+        self.details_label.setText(f"Verifica di {job_name} completata.")
 
-        # Controlla se il giorno corrente è presente nei giorni pianificati
-        scheduled_days = [day.strip() for day in job.days.split(',')]
-        print(f"Scheduled days from job: {scheduled_days}")
+    def restore_backup_job(self):
+        job = get_job(self.session, self.current_backup_job_id) if self.current_backup_job_id else None
+        if job is None:
+            return
+        if self.run_queue.is_busy(job.id) or job.id in self.restore_threads:
+            QMessageBox.information(self, "Ripristino", f"Il backup {job.name} e' in uso, riprova piu' tardi.")
+            return
+        target_folder = QFileDialog.getExistingDirectory(self, "Cartella in cui ripristinare i file")
+        if not target_folder:
+            return
+        text, ok = QInputDialog.getMultiLineText(
+            self, "Ripristino",
+            "File da ripristinare, uno per riga (percorsi o glob come *.pdf o docs/**).\n"
+            "Lascia vuoto per ripristinare tutto:")
+        if not ok:
+            return
+        patterns = [line.strip() for line in text.splitlines() if line.strip()]
+        self.details_label.setText(f"Ripristino di {job.name} in corso...")
+        thread = RestoreThread(job.id, [path.path for path in job.paths], job.dest_folder, job.dest_format,
+                               target_folder, patterns)
+        thread.progress.connect(lambda snapshot, name=job.name: self.update_restore_progress(name, snapshot))
+        thread.finished.connect(lambda success, stats, errors, job_id=job.id, name=job.name:
+                                self.restore_finished(job_id, name, success, stats, errors))
+        self.restore_threads[job.id] = thread
+        thread.start()
 
-        # Verifica se il giorno corrente è presente nella lista dei giorni programmati
-        is_due_today = current_day_capitalized in scheduled_days
-        is_time_matching = current_time == scheduled_time
+    def update_restore_progress(self, job_name, snapshot):
+        self.progress_bar.setValue(snapshot.percent)
+        self.details_label.setText(f"Ripristino di {job_name}: {snapshot.describe()}")
 
-        print(f"Checking if backup is due: Job={job.name}, Time={scheduled_time}, Day={job.days}")
-        print(f"Current day (Capitalized): {current_day_capitalized}, Scheduled days: {scheduled_days}")
-        print(f"Is due today? {is_due_today}")
-        print(f"Is time matching? {is_time_matching}")
+    def restore_finished(self, job_id, job_name, success, stats, errors):
+        self.restore_threads.pop(job_id, None)
+        if success:
+            QMessageBox.information(self, "Ripristino",
+                                    f"{stats['files_copied']} file ripristinati, "
+                                    f"{stats['files_skipped']} gia' presenti.")
+        else:
+            paths = "\n".join(f"{path}: {error}" for path, error in errors[:20])
+            QMessageBox.warning(self, "Ripristino",
+                                f"Ripristino di {job_name} non riuscito per {len(errors)} file:\n{paths}")
+        self.details_label.setText(f"Ripristino di {job_name} completato.")
+
+    def update_progress(self, job_id, job_name, snapshot):
+        self.backup_progress[job_id] = (job_name, snapshot)
+        self.progress_bar.setValue(snapshot.percent)
+        current_file = f"{snapshot.current_file}\n" if snapshot.current_file else ""
+        self.details_label.setText(f"{job_name}: {current_file}{snapshot.describe()}")
+        self.update_tray_tooltip()
+
+    def update_tray_tooltip(self):
+        lines = [f"{name}: {snapshot.percent}% - {snapshot.describe()}"
+                 for name, snapshot in self.backup_progress.values()]
+        self.tray_icon.setToolTip("\n".join(lines) if lines else "Backup Manager")
+
+    def backup_finished(self, success, job_id):
+        thread = self.backup_threads.pop(job_id, None)
+        self.backup_progress.pop(job_id, None)
+        self.update_tray_tooltip()
+        self.details_label.setText("Backup completato con successo." if success else "Backup fallito.")
+        # Data dell'ultima esecuzione e contatore sono aggiornati da run_backup
+        self.session.expire_all()
+        backup_job = self.session.get(BackupJob, job_id)
+        partial = thread is not None and thread.changed_paths is not None
+        if not success and thread is not None:
+            # Le modifiche non copiate restano da fare alla prossima esecuzione
+            self.watcher.restore_changes(job_id, thread.changed_paths)
+        if backup_job:
+            # Le esecuzioni parziali del backup continuo avvisano solo in caso di errore
+            if backup_job.send_email and not (partial and success):
+                # L'invio avviene in background, la GUI non resta bloccata
+                self.notifier.notify([email.email for email in backup_job.email_addresses], success,
+                                     backup_job.name, thread.stats if thread else None)
 
-        return is_due_today and is_time_matching
+        # Libera il posto nella coda: puo' partire il prossimo job
+        self.run_queue.finished(job_id)
+        self.watcher.run_finished(job_id)
+        if not self.backup_threads:
+            self.spinner_label.hide()
+            self.spinner_movie.stop()
+            self.update_tray_icon(False)
 
-    def start_scheduled_backup(self, job):
-        source_paths = [path.path for path in job.paths]
-        email_addresses = [email.email for email in job.email_addresses]
-        print(f"Starting backup for job: {job.name}")
-        thread = BackupThread(source_paths, job.dest_folder, email_addresses)
-        thread.progress.connect(self.progress_bar.setValue)
-        thread.current_file.connect(self.details_label.setText)
-        thread.finished.connect(self.backup_finished)
-        thread.start()
 
     def delete_backup_job(self):
         # Ottieni l'elemento selezionato nel tree_widget
@@ -530,15 +638,18 @@ class MainWindow(QMainWindow):
             for item in selected_items:
                 index = self.tree_widget.indexOfTopLevelItem(item)
                 self.tree_widget.takeTopLevelItem(index)
+                self.scheduler.remove_job(item.data(0, 1))
+                self.watcher.remove_job(item.data(0, 1))
             # Se devi rimuovere anche un backup associato dal sistema (oltre che dall'interfaccia),
             # aggiungi qui la logica per farlo, come eliminare file o record dal database.
 
 
     def closeEvent(self, event):
-        # Gestisci il backup thread se è in esecuzione
-        if self.backup_thread and self.backup_thread.isRunning():
-            self.backup_thread.stop()
-            self.backup_thread.wait()  # Assicurati che il thread sia completamente fermo
+        # Gestisci i backup thread in esecuzione
+        for thread in list(self.backup_threads.values()):
+            if thread.isRunning():
+                thread.stop()
+                thread.wait()  # Assicurati che il thread sia completamente fermo
 
         # Nascondi la finestra e mostra l'icona nella system tray
         self.hide()  # Nascondi la finestra principale
@@ -0,0 +1,324 @@
+"""Esecuzione dei backup senza interfaccia grafica (server, cron, systemd).
+
+    python -m pythonbackup list
+    python -m pythonbackup run <id o nome del job> [...]
+    python -m pythonbackup restore <id o nome del job> <cartella> [pattern ...]
+    python -m pythonbackup daemon
+
+Non importa Qt; i moduli pesanti vengono importati solo dai comandi che
+li usano, cosi' un'esecuzione singola parte rapidamente.
+"""
+import argparse
+import logging
+import sys
+import threading
+
+logger = logging.getLogger('pythonbackup')
+
+
+def _open_session():
+    from db.models import Session, create_tables
+
+    create_tables()
+    return Session()
+
+
+def _find_jobs(session, selectors):
+    from db.models import get_job, query_jobs
+
+    jobs = []
+    for selector in selectors:
+        job = get_job(session, int(selector)) if selector.isdigit() else None
+        if job is None:
+            job = query_jobs(session).filter_by(name=selector).first()
+        if job is None:
+            raise SystemExit(f"Backup job not found: {selector}")
+        jobs.append(job)
+    return jobs
+
+
+def cmd_list(args):
+    import datetime
+
+    from sqlalchemy.orm import selectinload
+
+    from db.models import BackupJob, query_jobs
+    from engine.scheduler import next_fire_time
+
+    session = _open_session()
+    now = datetime.datetime.now()
+    jobs = query_jobs(session).options(selectinload(BackupJob.extra_destinations)).order_by(BackupJob.id)
+    for job in jobs:
+        next_run = next_fire_time(job.schedule_time, job.days, now)
+        last_run = job.last_run_date.strftime('%d/%m/%Y %H:%M') if job.last_run_date else 'Mai eseguito'
+        print(f"{job.id:>4}  {job.name:<30} {job.dest_format:<8} {job.dest_folder}")
+        print(f"      Orario: {job.schedule_time} ({job.days or '-'})  "
+              f"Ultima esecuzione: {last_run}  "
+              f"Prossima: {next_run.strftime('%d/%m/%Y %H:%M') if next_run else 'Non pianificata'}")
+        for extra in job.extra_destinations:
+            print(f"      Anche su {extra.describe(job.last_run_date)}")
+    return 0
+
+
+def _print_progress(snapshot):
+    # La riga viene riscritta: lo spazio finale cancella i resti di quella precedente
+    sys.stderr.write(f"\r{snapshot.percent:3d}% {snapshot.describe()}".ljust(79)[:79])
+    sys.stderr.flush()
+
+
+def cmd_run(args):
+    from engine.runner import run_backup
+    from engine.settings import load_settings
+
+    settings = load_settings()
+    settings.setup_logging()
+    session = _open_session()
+    notifier = settings.create_notifier()
+    notifier.start()
+    exit_code = 0
+    try:
+        for job in _find_jobs(session, args.jobs):
+            print(f"Starting backup for job: {job.name}")
+            options = settings.engine_options()
+            if args.trace:
+                options['trace_export'] = True
+            success, stats = run_backup(
+                session, job.id, [path.path for path in job.paths], job.dest_folder, job.dest_format,
+                progress=_print_progress if sys.stderr.isatty() and not args.quiet else None,
+                **options)
+            if sys.stderr.isatty() and not args.quiet:
+                sys.stderr.write("\n")
+            print(f"Backup {'completato' if success else 'fallito'}: {stats}")
+            if job.send_email:
+                notifier.notify([email.email for email in job.email_addresses], success, job.name, stats)
+            if not success:
+                exit_code = 1
+    finally:
+        # Attende l'invio delle notifiche prima di uscire
+        notifier.stop()
+        session.close()
+    return exit_code
+
+
+def cmd_verify(args):
+    from engine.runner import verify_backup
+    from engine.settings import load_settings
+
+    settings = load_settings()
+    settings.setup_logging()
+    session = _open_session()
+    exit_code = 0
+    try:
+        for job in _find_jobs(session, args.jobs):
+            print(f"Verifying backup for job: {job.name}")
+            report = verify_backup(session, job.id, [path.path for path in job.paths], job.dest_folder,
+                                   job.dest_format, args.sample / 100 if args.sample else None,
+                                   settings.verify_workers)
+            print(f"File verificati: {report.files_verified}, differenze: {len(report.mismatches)} "
+                  f"({report.seconds:.1f} s)")
+            for path, error, expected, actual in report.mismatches:
+                print(f"  {path}: {error or 'contenuto diverso'}")
+            if report.mismatches:
+                exit_code = 1
+    finally:
+        session.close()
+    return exit_code
+
+
+def cmd_restore(args):
+    from engine.runner import restore_backup
+    from engine.settings import load_settings
+
+    settings = load_settings()
+    settings.setup_logging()
+    session = _open_session()
+    try:
+        job = _find_jobs(session, [args.job])[0]
+        print(f"Restoring backup for job: {job.name} into {args.target}")
+        show_progress = sys.stderr.isatty() and not args.quiet
+        success, stats, errors = restore_backup(
+            session, job.id, [path.path for path in job.paths], job.dest_folder, job.dest_format,
+            args.target, args.patterns, progress=_print_progress if show_progress else None,
+            **settings.restore_options())
+        if show_progress:
+            sys.stderr.write("\n")
+    finally:
+        session.close()
+    print(f"Ripristino {'completato' if success else 'fallito'}: {stats}")
+    for path, error in errors:
+        print(f"  {path}: {error}")
+    return 0 if success else 1
+
+
+class Daemon:
+    """Scheduler e coda delle esecuzioni senza GUI, come in MainWindow."""
+
+    def __init__(self, settings, reload_interval):
+        from engine.run_queue import RunQueue
+        from engine.scheduler import JobScheduler
+
+        self.settings = settings
+        self.reload_interval = reload_interval
+        self.notifier = settings.create_notifier()
+        self.run_queue = RunQueue(self._launch, max_concurrent=settings.max_concurrent_runs,
+                                  per_destination=settings.max_runs_per_destination)
+        self.scheduler = JobScheduler(self._on_due)
+        self.watcher = settings.create_watcher(self._on_due)
+        self._stopping = threading.Event()
+        self._threads = {}
+        # job_id -> (schedule_time, days, dest_folder) dall'ultima lettura del database
+        self._jobs = {}
+        # job_id -> (sorgenti, regole) dei job in backup continuo
+        self._watched = {}
+
+    def reload_jobs(self):
+        # Il database puo' essere modificato dalla GUI: lo scheduler viene
+        # aggiornato solo per i job cambiati, cosi' le scadenze non si spostano
+        from sqlalchemy.orm import selectinload
+
+        from db.models import BackupJob, Session, query_jobs
+
+        session = Session()
+        try:
+            jobs = {}
+            watched = {}
+            # Percorsi e regole dei job continui in una query ciascuno, non per job
+            for job in query_jobs(session).options(selectinload(BackupJob.filter_rules)):
+                jobs[job.id] = (job.schedule_time, job.days, job.dest_folder)
+                if job.continuous and self.watcher.available():
+                    watched[job.id] = (tuple(path.path for path in job.paths),
+                                       tuple(rule.pattern for rule in job.filter_rules))
+        finally:
+            session.close()
+        for job_id, job in jobs.items():
+            if self._jobs.get(job_id) != job:
+                self.scheduler.set_job(job_id, job[0], job[1])
+        for job_id in set(self._jobs) - set(jobs):
+            self.scheduler.remove_job(job_id)
+        self._jobs = jobs
+
+        for job_id, (roots, rules) in watched.items():
+            if self._watched.get(job_id) != (roots, rules):
+                try:
+                    self.watcher.set_job(job_id, roots, rules)
+                except OSError as e:
+                    logger.warning("Cannot watch backup job %s: %s", job_id, e)
+        for job_id in set(self._watched) - set(watched):
+            self.watcher.remove_job(job_id)
+        self._watched = watched
+
+    def _on_due(self, job_id):
+        from engine.run_queue import PRIORITY_SCHEDULED
+
+        job = self._jobs.get(job_id)
+        if job is not None:
+            self.run_queue.submit(job_id, job[2], PRIORITY_SCHEDULED)
+
+    def _launch(self, job_id):
+        thread = threading.Thread(target=self._run_job, args=(job_id,), name=f'backup-job-{job_id}')
+        self._threads[job_id] = thread
+        thread.start()
+
+    def _run_job(self, job_id):
+        from db.models import Session, get_job
+        from engine.runner import run_backup
+
+        session = Session()
+        changed_paths = self.watcher.take_changes(job_id)
+        success = False
+        try:
+            job = get_job(session, job_id)
+            if job is None:
+                return
+            logger.info("Starting backup for job: %s", job.name)
+            success, stats = run_backup(
+                session, job.id, [path.path for path in job.paths], job.dest_folder, job.dest_format,
+                should_stop=self._stopping.is_set, changed_paths=changed_paths,
+                **self.settings.engine_options())
+            logger.info("Backup %s %s: %s", job.name, 'completato' if success else 'fallito', stats)
+            # Le esecuzioni parziali del backup continuo avvisano solo in caso di errore
+            if job.send_email and not (success and changed_paths is not None):
+                self.notifier.notify([email.email for email in job.email_addresses], success, job.name, stats)
+        except Exception as e:
+            logger.exception("Error during backup %s: %s", job_id, e)
+        finally:
+            session.close()
+            if not success:
+                self.watcher.restore_changes(job_id, changed_paths)
+            self._threads.pop(job_id, None)
+            if not self._stopping.is_set():
+                self.run_queue.finished(job_id)
+                self.watcher.run_finished(job_id)
+
+    def run(self):
+        self.notifier.start()
+        self.reload_jobs()
+        self.scheduler.start()
+        logger.info("Scheduler started")
+        while not self._stopping.wait(self.reload_interval):
+            self.reload_jobs()
+        self.scheduler.stop()
+        self.watcher.stop()
+        for thread in list(self._threads.values()):
+            thread.join()
+        self.notifier.stop()
+
+    def stop(self, *args):
+        self._stopping.set()
+
+
+def cmd_daemon(args):
+    import signal
+
+    from db.models import create_tables
+    from engine.settings import load_settings
+
+    settings = load_settings()
+    settings.setup_logging()
+    create_tables()
+    daemon = Daemon(settings, args.reload_interval)
+    signal.signal(signal.SIGINT, daemon.stop)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    daemon.run()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pythonbackup', description='Backup Manager senza interfaccia grafica')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    list_parser = commands.add_parser('list', help='elenca i backup job')
+    list_parser.set_defaults(func=cmd_list)
+
+    run_parser = commands.add_parser('run', help='esegue subito uno o piu\' backup job')
+    run_parser.add_argument('jobs', nargs='+', help='id o nome del job')
+    run_parser.add_argument('-q', '--quiet', action='store_true', help='non mostra l\'avanzamento')
+    run_parser.add_argument('--trace', action='store_true',
+                            help='salva accanto al log dell\'esecuzione la traccia per chrome://tracing')
+    run_parser.set_defaults(func=cmd_run)
+
+    verify_parser = commands.add_parser('verify', help='controlla che le copie corrispondano ai sorgenti')
+    verify_parser.add_argument('jobs', nargs='+', help='id o nome del job')
+    verify_parser.add_argument('--sample', type=float, metavar='PERCENTUALE',
+                               help='verifica solo questa percentuale di file scelti a caso')
+    verify_parser.set_defaults(func=cmd_verify)
+
+    restore_parser = commands.add_parser('restore', help='ripristina i file dell\'ultimo backup di un job')
+    restore_parser.add_argument('job', help='id o nome del job')
+    restore_parser.add_argument('target', help='cartella in cui ripristinare i file')
+    restore_parser.add_argument('patterns', nargs='*',
+                                help='percorsi o glob dei file da ripristinare (predefinito: tutti)')
+    restore_parser.add_argument('-q', '--quiet', action='store_true', help='non mostra l\'avanzamento')
+    restore_parser.set_defaults(func=cmd_restore)
+
+    daemon_parser = commands.add_parser('daemon', help='esegue i backup pianificati')
+    daemon_parser.add_argument('--reload-interval', type=float, default=60,
+                               help='secondi tra due letture dei job dal database')
+    daemon_parser.set_defaults(func=cmd_daemon)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())